@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Load test for budgetbuddy.server over localhost.
+#
+#   python -m benchmarks.load_test --users 20 --rows 5000 --concurrency 50 --duration 20
+#
+# Without --port it seeds a scratch copy of instance/finance_app.db with
+# synthetic users and ledgers and starts its own server; with --port it runs
+# against a server that is already up, as --username/--password. Clients
+# keep their connections alive and pick requests from a weighted mix; the
+# result is JSON with throughput and latency percentiles per endpoint.
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIX = {"balances": 4, "summary": 4, "page": 4, "stream": 1, "add": 1}
+
+
+def seed_database(path, users, rows, seed):
+    from benchmarks.synthetic import generate_frame
+    from budgetbuddy.server import hash_password
+    from budgetbuddy.storage import open_database
+
+    conn = open_database(path)
+    credentials = []
+    with conn:
+        for number in range(users):
+            username, password = f"student{number:03d}", f"password{number:03d}"
+            # Few iterations: logins are cached by the server, and seeding
+            # hundreds of users at full strength would take minutes
+            user_id = conn.execute("INSERT INTO user (username, password_hash) VALUES (?, ?)",
+                                   (username, hash_password(password, iterations=1000))).lastrowid
+            frame = generate_frame(rows, seed + number)
+            accounts = {}
+            for account in frame["Account"].unique():
+                accounts[account] = conn.execute(
+                    "INSERT INTO account (user_id, account_type, name, balance) VALUES (?, ?, ?, 0)",
+                    (user_id, account, account)).lastrowid
+            conn.executemany(
+                'INSERT INTO "transaction" (account_id, amount, date, description, transaction_type, category) VALUES (?, ?, ?, ?, ?, ?)',
+                zip(frame["Account"].map(accounts), frame["Amount"], frame["Date"], frame["Notes"], frame["Type"],
+                    frame["Source/Category"]))
+            credentials.append((username, password))
+    conn.close()
+    return credentials
+
+
+class Client:
+    # One keep-alive HTTP/1.1 connection
+    def __init__(self, host, port, username, password):
+        self.host, self.port = host, port
+        token = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+        self.authorization = f"Basic {token}"
+        self.reader = self.writer = None
+
+    async def request(self, method, target, document=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(document).encode("utf-8") if document is not None else b""
+        head = (f"{method} {target} HTTP/1.1\r\nHost: {self.host}\r\nAuthorization: {self.authorization}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+        status_line, _, headers = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").partition("\r\n")
+        headers = dict(line.split(": ", 1) for line in headers.strip().split("\r\n") if ": " in line)
+        headers = {name.lower(): value for name, value in headers.items()}
+        if headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).strip(), 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            payload = b"".join(chunks)
+        else:
+            payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection") == "close":
+            await self.close()
+        return int(status_line.split(" ")[1]), payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def pick_request(rng):
+    kind = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+    if kind == "balances":
+        return kind, "GET", f"/api/balances?date=2023-{rng.randint(1, 12):02d}-15", None
+    if kind == "summary":
+        return kind, "GET", f"/api/summary?period={rng.choice(['weekly', 'monthly', 'quarterly'])}", None
+    if kind == "page":
+        return kind, "GET", f"/api/transactions?limit=100&offset={rng.randint(0, 1000)}", None
+    if kind == "stream":
+        return kind, "GET", "/api/transactions", None
+    return kind, "POST", "/api/transactions", {"date": "2024-06-01", "type": "Expense", "account": "Checking",
+                                               "amount": round(rng.uniform(1, 50), 2), "category": "Food",
+                                               "notes": "load test"}
+
+
+async def run_clients(host, port, credentials, concurrency, duration, seed):
+    latencies = {kind: [] for kind in MIX}
+    errors = {}
+    stop_at = time.perf_counter() + duration
+
+    async def worker(number):
+        rng = random.Random(seed + number)
+        client = Client(host, port, *credentials[number % len(credentials)])
+        try:
+            while time.perf_counter() < stop_at:
+                kind, method, target, document = pick_request(rng)
+                start = time.perf_counter()
+                try:
+                    status, _ = await client.request(method, target, document)
+                except (ConnectionError, asyncio.IncompleteReadError) as error:
+                    status = type(error).__name__
+                    await client.close()
+                if status in (200, 201):
+                    latencies[kind].append(time.perf_counter() - start)
+                else:
+                    errors[f"{kind}: {status}"] = errors.get(f"{kind}: {status}", 0) + 1
+        finally:
+            await client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests": total,
+        "requests_per_second": total / elapsed,
+        "errors": errors,
+        "endpoints": {kind: _percentiles(samples) for kind, samples in latencies.items() if samples},
+    }
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+    return {"count": len(samples), "mean_ms": statistics.fmean(samples) * 1000,
+            "p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "max_ms": samples[-1] * 1000}
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load_test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="test a running server instead of starting one")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--users", type=int, default=20, help="synthetic users to seed")
+    parser.add_argument("--rows", type=int, default=5000, help="transactions per synthetic user")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", help="JSON results file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if args.port:
+        if not args.username or args.password is None:
+            parser.error("--port needs --username and --password")
+        result = asyncio.run(run_clients(args.host, args.port, [(args.username, args.password)],
+                                         args.concurrency, args.duration, args.seed))
+    else:
+        with tempfile.TemporaryDirectory(prefix="budgetbuddy-load-") as workdir:
+            path = os.path.join(workdir, "finance_app.db")
+            shutil.copy(os.path.join(REPO, "instance", "finance_app.db"), path)
+            credentials = seed_database(path, args.users, args.rows, args.seed)
+            port = _free_port()
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")])))
+            server = subprocess.Popen([sys.executable, "-m", "budgetbuddy.server", "--db", path, "--port", str(port),
+                                       "--pool-size", str(args.pool_size)], env=env)
+            try:
+                _wait_for_port(port, server)
+                result = asyncio.run(run_clients("127.0.0.1", port, credentials, args.concurrency, args.duration,
+                                                 args.seed))
+            finally:
+                server.terminate()
+                server.wait()
+        result.update(users=args.users, rows_per_user=args.rows, pool_size=args.pool_size)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(result, handle, indent=1)
+    else:
+        json.dump(result, sys.stdout, indent=1)
+        print()
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
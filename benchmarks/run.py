@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Times every FinanceTracker operation against synthetic ledgers, headless:
+#
+#   python -m benchmarks.run --rows 1k 100k 1M --storage csv sqlite -o results.json
+#
+# Each (rows, storage) case runs in its own process, in a scratch directory
+# holding a generated transactions.csv and a copy of instance/finance_app.db,
+# so peak RSS belongs to that case alone and nothing touches the real ledger.
+# Operations that normally go through a dialog (edit, delete) are timed from
+# the point the dialog hands over, i.e. replace_row / remove_rows.
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORAGES = ["csv", "journal", "sqlite"]
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_rows(text):
+    text = text.strip().lower()
+    if text[-1:] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(runs):
+    return {"runs": runs, "min": min(runs), "median": statistics.median(runs), "max": max(runs)}
+
+
+def measure(storage, repeat):
+    # Runs inside the case's scratch directory
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import QEventLoop
+    from PyQt5.QtWidgets import QApplication
+
+    from budgetbuddy.storage import STORAGE_BACKENDS
+
+    if storage in ("journal", "sqlite"):
+        # One-off CSV migration, so load_data below times a normal start
+        prepared = STORAGE_BACKENDS[storage]()
+        prepared.load()
+        prepared.close()
+
+    import main
+
+    app = QApplication(sys.argv[:1])
+    window = main.FinanceTracker(storage)
+    operations = {}
+
+    def timed(name, operation, runs=repeat):
+        results = []
+        for run in range(runs):
+            start = time.perf_counter()
+            operation(run)
+            app.processEvents()
+            results.append(time.perf_counter() - start)
+        operations[name] = summarize(results)
+
+    def load(run):
+        # Showing the window paints it, which starts load_data
+        loop = QEventLoop()
+        window.data_loaded.connect(loop.quit)
+        window.show()
+        loop.exec_()
+
+    timed("load_data", load, runs=1)
+    rows = len(window.ledger)
+    rss_after_load = peak_rss_mb()
+
+    def add(run):
+        window.amount_edit.setText(f"{12.5 + run:.2f}")
+        window.source_category_edit.setText("Groceries")
+        window.notes_edit.setText(f"benchmark add {run}")
+        window.add_transaction()
+
+    def edit(run):
+        live = window.ledger.positions()
+        position = int(live[(run * 7919) % len(live)])
+        updated = window.ledger.row(position)
+        updated["Amount"] = f"{updated['Amount'] + 1:.2f}"
+        window.replace_row(position, updated)
+
+    def delete(run):
+        live = window.ledger.positions()
+        window.remove_rows([int(live[(run * 104729) % len(live)])])
+
+    def search(run):
+        window.search_bar.blockSignals(True)
+        window.search_bar.setText(["groc", "coffee", "#12"][run % 3])
+        window.search_bar.blockSignals(False)
+        window.filter_table()
+
+    def clear_search():
+        window.search_bar.blockSignals(True)
+        window.search_bar.clear()
+        window.search_bar.blockSignals(False)
+        window.filter_table()
+
+    def charts(run):
+        window.update_analysis_charts()
+        window.chart_timer.stop()  # render now rather than after the debounce
+        window.render_analysis_charts()
+        window.chart_pool.waitForDone()
+
+    timed("filter_table", search)
+    clear_search()
+    timed("update_table", lambda run: window.update_table())
+    timed("add_transaction", add)
+    timed("edit_transaction", edit)
+    timed("delete_transaction", delete)
+    window.tabs.setCurrentWidget(window.analysis_tab)
+    app.processEvents()
+    timed("update_analysis_charts", charts)
+    timed("save_data", lambda run: window.save_data())
+
+    window.storage.close()
+    return {"loaded_rows": rows, "operations": operations,
+            "peak_rss_mb": {"after_load": rss_after_load, "end": peak_rss_mb()}}
+
+
+def run_case(rows, storage, seed, repeat, ledger_csv):
+    with tempfile.TemporaryDirectory(prefix="budgetbuddy-bench-") as workdir:
+        shutil.copy(ledger_csv, os.path.join(workdir, "transactions.csv"))
+        os.mkdir(os.path.join(workdir, "instance"))
+        shutil.copy(os.path.join(REPO, "instance", "finance_app.db"), os.path.join(workdir, "instance"))
+        output = os.path.join(workdir, "result.json")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")])))
+        command = [sys.executable, "-m", "benchmarks.run", "--case", storage, str(repeat), output]
+        completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        case = {"rows": rows, "storage": storage, "seed": seed}
+        if completed.returncode:
+            return {**case, "error": completed.stderr.strip().splitlines()[-1:] or ["exit status %d" % completed.returncode]}
+        with open(output) as handle:
+            return {**case, **json.load(handle)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--rows", nargs="+", default=["1k", "10k", "100k"],
+                        help="ledger sizes, e.g. 1k 100k 10M")
+    parser.add_argument("--storage", nargs="+", choices=STORAGES, default=STORAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per operation")
+    parser.add_argument("--output", "-o", help="JSON results file (default: stdout)")
+    parser.add_argument("--case", nargs=3, metavar=("STORAGE", "REPEAT", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        storage, repeat, output = args.case
+        result = measure(storage, int(repeat))
+        with open(output, "w") as handle:
+            json.dump(result, handle)
+        return 0
+
+    from benchmarks.synthetic import write_ledger
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="budgetbuddy-ledgers-") as ledgers:
+        for rows in map(parse_rows, args.rows):
+            ledger_csv = os.path.join(ledgers, f"{rows}.csv")
+            write_ledger(ledger_csv, rows, args.seed)
+            for storage in args.storage:
+                print(f"{rows} rows, {storage}...", file=sys.stderr)
+                results.append(run_case(rows, storage, args.seed, args.repeat, ledger_csv))
+
+    report = {"python": platform.python_version(), "platform": platform.platform(), "results": results}
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from budgetbuddy.columns import COLUMNS
+
+# Deterministic synthetic ledgers: the same (rows, seed) always gives the
+# same transactions.csv, so timings from different runs compare like for like.
+#
+#   python -m benchmarks.synthetic 1000000 -o transactions.csv
+
+ACCOUNTS = ["Checking", "Savings", "Credit Card"]
+INCOME_SOURCES = ["Salary", "Scholarship", "Tutoring", "Gift", "Refund", "Interest"]
+EXPENSE_CATEGORIES = ["Rent", "Groceries", "Food", "Books", "Tuition", "Transport", "Utilities",
+                      "Phone", "Entertainment", "Clothing", "Health", "Subscriptions"]
+MERCHANTS = ["Campus Store", "Corner Market", "City Transit", "Coffee House", "Online Order",
+             "Bookshop", "Pharmacy", "Cinema", "Landlord", "Power Co", "Mobile Plan", "Streaming"]
+START_DATE = np.datetime64("2020-01-01")
+DAYS = 5 * 365
+
+
+def generate_frame(rows, seed=0, distinct_notes=5000):
+    rng = np.random.default_rng(seed)
+    income = rng.random(rows) < 0.2
+    days = np.sort(rng.integers(0, DAYS, rows))
+    dates = (START_DATE + days.astype("timedelta64[D]")).astype(str)
+    amounts = np.where(income, rng.lognormal(6.0, 0.8, rows), rng.lognormal(3.2, 1.0, rows)).round(2)
+    categories = np.where(income,
+                          np.array(INCOME_SOURCES)[rng.integers(0, len(INCOME_SOURCES), rows)],
+                          np.array(EXPENSE_CATEGORIES)[rng.integers(0, len(EXPENSE_CATEGORIES), rows)])
+    # Notes repeat the way real ones do: a merchant plus one of a limited set of references
+    notes = (pd.Series(np.array(MERCHANTS)[rng.integers(0, len(MERCHANTS), rows)]) + " #"
+             + pd.Series(rng.integers(0, distinct_notes, rows)).astype(str))
+    return pd.DataFrame({
+        "Date": dates,
+        "Type": np.where(income, "Income", "Expense"),
+        "Account": np.array(ACCOUNTS)[rng.integers(0, len(ACCOUNTS), rows)],
+        "Amount": amounts,
+        "Source/Category": categories,
+        "Notes": notes.to_numpy(),
+    }, columns=COLUMNS)
+
+
+def write_ledger(path, rows, seed=0):
+    generate_frame(rows, seed).to_csv(path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.synthetic")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", default="transactions.csv")
+    args = parser.parse_args()
+    write_ledger(args.output, args.rows, args.seed)
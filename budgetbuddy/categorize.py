@@ -0,0 +1,231 @@
+import itertools
+import json
+import re
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+import pandas as pd
+
+from budgetbuddy.ledger import parse_amount, parse_cents
+from budgetbuddy.profiling import traced
+
+# Rule-based Source/Category suggestions. A rule matches a transaction's
+# notes or its amount, optionally only for one Type, and the first rule in
+# the list that matches names the category:
+#
+#   keyword  the notes contain pattern, ignoring case
+#   prefix   the notes start with pattern, ignoring case
+#   regex    re.search(pattern, notes, re.IGNORECASE) finds something
+#   amount   low <= amount <= high, either bound may be left out
+#
+# Keywords and prefixes share one Aho-Corasick automaton, so a text is
+# scanned once however many rules there are. Text rules are matched once
+# per distinct text and remembered; rows are then resolved with array
+# lookups, which is what keeps imports of millions of rows fast.
+
+RULE_KINDS = ["keyword", "prefix", "regex", "amount"]
+RULES_FILE = "category_rules.json"
+
+
+class Rule:
+    def __init__(self, kind, category, pattern="", _type=None, low=None, high=None):
+        if kind not in RULE_KINDS:
+            raise ValueError(f"unknown rule kind {kind!r}")
+        if not category:
+            raise ValueError("a rule needs a category")
+        if kind != "amount" and not pattern:
+            raise ValueError(f"a {kind} rule needs a pattern")
+        if kind == "regex":
+            try:
+                re.compile(pattern)
+            except re.error as error:
+                raise ValueError(f"bad regex {pattern!r}: {error}")
+        self.kind = kind
+        self.category = category
+        self.pattern = pattern
+        self.type = _type or None
+        # Amount bounds in cents, inclusive
+        self.low = _bound("low", low)
+        self.high = _bound("high", high)
+        if self.low is not None and self.high is not None and self.low > self.high:
+            raise ValueError(f"low amount {low} is above high amount {high}")
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(record.get("kind", ""), record.get("category", ""), record.get("pattern", ""),
+                   record.get("type"), record.get("low"), record.get("high"))
+
+    def to_dict(self):
+        record = {"kind": self.kind, "category": self.category}
+        if self.pattern:
+            record["pattern"] = self.pattern
+        if self.type:
+            record["type"] = self.type
+        if self.low is not None:
+            record["low"] = self.low / 100
+        if self.high is not None:
+            record["high"] = self.high / 100
+        return record
+
+
+def _bound(name, value):
+    # parse_amount reads anything it cannot parse as 0, so check first
+    if value is None or value == "":
+        return None
+    try:
+        valid = Decimal(str(value).strip()).is_finite()
+    except InvalidOperation:
+        valid = False
+    if not valid:
+        raise ValueError(f"bad {name} amount {value!r}")
+    return parse_amount(value)
+
+
+def load_rules(path=RULES_FILE):
+    try:
+        with open(path) as handle:
+            return [Rule.from_dict(record) for record in json.load(handle)]
+    except FileNotFoundError:
+        return []
+
+
+def save_rules(rules, path=RULES_FILE):
+    with open(path, "w") as handle:
+        json.dump([rule.to_dict() for rule in rules], handle, indent=1)
+
+
+class _Automaton:
+    # Aho-Corasick trie over lower-cased keywords and prefixes. Each node
+    # lists the rules whose keyword ends there, its own or through failure
+    # links, and the rules whose prefix is exactly the path to it. build()
+    # folds the failure links into a full transition table, so scanning is
+    # one dict lookup per character.
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.keywords = [()]
+        self.prefixes = [()]
+        self.step = None
+
+    def add(self, pattern, rule, prefix):
+        node = 0
+        for character in pattern.lower():
+            following = self.goto[node].get(character)
+            if following is None:
+                following = self.goto[node][character] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.keywords.append(())
+                self.prefixes.append(())
+            node = following
+        if prefix:
+            self.prefixes[node] += (rule,)
+        else:
+            self.keywords[node] += (rule,)
+
+    def build(self):
+        # Failure links breadth first, so a node's are done before its children's
+        self.step = [dict(self.goto[0])] + [None] * (len(self.goto) - 1)
+        queue = list(self.goto[0].values())
+        for node in queue:
+            # A node's failure link is shallower, so its row is already done
+            self.step[node] = {**self.step[self.fail[node]], **self.goto[node]}
+            for character, child in self.goto[node].items():
+                self.fail[child] = self.step[self.fail[node]].get(character, 0)
+                self.keywords[child] += self.keywords[self.fail[child]]
+                queue.append(child)
+
+    def scan(self, text, matched):
+        step, keywords = self.step, self.keywords
+        node = 0
+        for character in text:
+            node = step[node].get(character, 0)
+            if keywords[node]:
+                matched.update(keywords[node])
+        goto, node = self.goto, 0
+        for character in text:
+            node = goto[node].get(character)
+            if node is None:
+                break
+            if self.prefixes[node]:
+                matched.update(self.prefixes[node])
+
+
+class Categorizer:
+    # Compiled form of a rule list. Keep one per rule list: the texts it has
+    # matched are remembered for its lifetime.
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._automaton = _Automaton()
+        self._regexes = []
+        for index, rule in enumerate(self.rules):
+            if rule.kind in ("keyword", "prefix"):
+                self._automaton.add(rule.pattern, index, rule.kind == "prefix")
+            elif rule.kind == "regex":
+                self._regexes.append((index, re.compile(rule.pattern, re.IGNORECASE)))
+        self._automaton.build()
+        self._amounts = [(index, rule) for index, rule in enumerate(self.rules) if rule.kind == "amount"]
+        self._categories = np.array([rule.category for rule in self.rules] + [""], dtype=object)
+        self._matches = {}  # text -> indexes of the text rules it matches, ascending
+
+    def matches(self, text):
+        found = self._matches.get(text)
+        if found is None:
+            matched = set()
+            self._automaton.scan(text.lower(), matched)
+            matched.update(index for index, regex in self._regexes if regex.search(text))
+            found = self._matches[text] = tuple(sorted(matched))
+        return found
+
+    def category_for(self, notes, _type, amount):
+        # One transaction typed in by hand; "" if no rule matches
+        return self.categorize([notes], [_type], [amount])[0]
+
+    @traced
+    def categorize(self, notes, types, amounts):
+        # Category for each row of equal-length notes, Type and Amount
+        # sequences; "" where no rule matches
+        note_codes, note_values = pd.factorize(np.asarray(notes, dtype=object))
+        type_codes, type_values = pd.factorize(np.asarray(types, dtype=object))
+        # Missing values (code -1) get a trailing ""
+        note_codes = np.where(note_codes < 0, len(note_values), note_codes)
+        type_codes = np.where(type_codes < 0, len(type_values), type_codes)
+        note_values = list(note_values) + [""]
+        type_values = list(type_values) + [""]
+        return self._categories[self._first_rule(note_codes, note_values, type_codes, type_values, parse_cents(amounts))]
+
+    @traced
+    def _first_rule(self, note_codes, note_values, type_codes, type_values, cents):
+        # Index of the first rule each row matches, len(rules) where none does
+        unmatched = len(self.rules)
+        first = np.full(len(note_codes), unmatched, dtype=np.int64)
+        if not self.rules:
+            return first
+        # Every (distinct text, text rule) match as two flat arrays, ordered
+        # by text and then rule
+        matches = [self.matches(value) for value in note_values]
+        counts = np.fromiter(map(len, matches), dtype=np.int64, count=len(matches))
+        matched_text = np.repeat(np.arange(len(matches)), counts)
+        matched_rule = np.fromiter(itertools.chain.from_iterable(matches), dtype=np.int64, count=int(counts.sum()))
+        rule_types = np.array([rule.type or "" for rule in self.rules], dtype=object)
+        for type_code, type_name in enumerate(type_values):
+            rows = np.flatnonzero(type_codes == type_code)
+            if not len(rows):
+                continue
+            # Per distinct text, the first of its rules that allows this Type
+            allowed = ((rule_types == "") | (rule_types == type_name))[matched_rule]
+            allowed_text, allowed_rule = matched_text[allowed], matched_rule[allowed]
+            starts = np.flatnonzero(np.diff(allowed_text, prepend=-1))
+            table = np.full(len(matches), unmatched, dtype=np.int64)
+            table[allowed_text[starts]] = allowed_rule[starts]
+            first[rows] = table[note_codes[rows]]
+        for index, rule in self._amounts:
+            hit = np.ones(len(first), dtype=bool)
+            if rule.low is not None:
+                hit &= cents >= rule.low
+            if rule.high is not None:
+                hit &= cents <= rule.high
+            if rule.type is not None:
+                hit &= np.isin(type_codes, [code for code, name in enumerate(type_values) if name == rule.type])
+            first[hit & (first > index)] = index
+        return first
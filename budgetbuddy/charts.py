@@ -0,0 +1,77 @@
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from budgetbuddy.profiling import traced
+
+
+# Rendering uses only the object-oriented Matplotlib API with the Agg
+# canvas, so it is safe to run off the GUI thread as long as each figure
+# is touched by one thread at a time.
+
+@traced
+def render_monthly_spending(monthly_spending, width, height, dpi=100):
+    figure, ax = _figure(width, height, dpi)
+    if monthly_spending:
+        months, totals = zip(*monthly_spending)
+        ax.bar(months, totals)
+        ax.tick_params(axis="x", labelrotation=90)
+    ax.set_title("Monthly Spending")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Amount")
+    return _rasterize(figure)
+
+
+@traced
+def render_category_pie(category_spending, width, height, dpi=100):
+    figure, ax = _figure(width, height, dpi)
+    if category_spending:
+        categories, totals = zip(*category_spending)
+        ax.pie(totals, labels=categories, autopct='%1.1f%%', startangle=90)
+    ax.set_title("Expense Categories")
+    return _rasterize(figure)
+
+
+@traced
+def render_daily_balance(daily_balance, width, height, dpi=100):
+    # daily_balance is (day numbers, cents) from BalanceIndex.daily
+    figure, ax = _figure(width, height, dpi)
+    if daily_balance is not None:
+        days, cents = daily_balance
+        ax.plot(days.astype("datetime64[D]"), cents / 100)
+        ax.tick_params(axis="x", labelrotation=30)
+    ax.set_title("Daily Balance")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Balance")
+    return _rasterize(figure)
+
+
+@traced
+def render_balance_forecast(balance_forecast, width, height, dpi=100):
+    # balance_forecast is (day numbers, cents, cents after subscriptions)
+    figure, ax = _figure(width, height, dpi)
+    days, cents, projected = balance_forecast
+    if len(days):
+        dates = days.astype("datetime64[D]")
+        ax.plot(dates, cents / 100, label="Ledger")
+        ax.plot(dates, projected / 100, label="With subscriptions")
+        ax.legend()
+        ax.tick_params(axis="x", labelrotation=30)
+    ax.set_title("Balance Forecast")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Balance")
+    return _rasterize(figure)
+
+
+def _figure(width, height, dpi):
+    figure = Figure(figsize=(max(width, 1) / dpi, max(height, 1) / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+    figure.set_layout_engine("tight")
+    return figure, figure.add_subplot(111)
+
+
+def _rasterize(figure):
+    # Returns (rgba bytes, width, height) of the drawn figure
+    canvas = figure.canvas
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    return bytes(canvas.buffer_rgba()), width, height
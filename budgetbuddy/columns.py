@@ -0,0 +1,4 @@
+COLUMNS = ["Date", "Type", "Account", "Amount", "Source/Category", "Notes"]
+DATE_COLUMN = COLUMNS.index("Date")
+AMOUNT_COLUMN = COLUMNS.index("Amount")
+ID_COLUMN = "ID"  # written to CSV ahead of COLUMNS; not shown in the table
@@ -0,0 +1,192 @@
+import os
+
+import numpy as np
+
+from budgetbuddy.ledger import NO_DAY, StringPool, add_months, month_of, month_start, parse_days
+from budgetbuddy.profiling import traced
+from budgetbuddy.storage import open_database
+
+# Subscriptions from finance_app.db expanded into the charges they will make
+# over a horizon, and merged with the ledger's balances into a forecast.
+# Expansion is vectorized: every subscription's first and last charge in the
+# horizon is worked out with array arithmetic, and the charges are laid out
+# with repeat/arange rather than stepping through dates one at a time.
+
+# billing_cycle -> (unit, step); monthly-style cycles keep the day of month,
+# falling back to the month's last day when it is shorter
+CYCLES = {
+    "daily": ("D", 1),
+    "weekly": ("D", 7),
+    "biweekly": ("D", 14),
+    "fortnightly": ("D", 14),
+    "monthly": ("M", 1),
+    "bimonthly": ("M", 2),
+    "quarterly": ("M", 3),
+    "semiannual": ("M", 6),
+    "semiannually": ("M", 6),
+    "yearly": ("M", 12),
+    "annual": ("M", 12),
+    "annually": ("M", 12),
+}
+
+
+class Subscriptions:
+    # One entry per subscription, as column arrays
+    def __init__(self, ids, names, accounts, cents, cycles, next_days):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = list(names)
+        self.accounts = StringPool()
+        self.account_code = np.array([self.accounts.encode(account) for account in accounts], dtype=np.int32)
+        self.cents = np.asarray(cents, dtype=np.int64)
+        self.next_day = np.asarray(next_days, dtype=np.int64)
+        units, steps = zip(*(CYCLES.get(_cycle_key(cycle), ("?", 0)) for cycle in cycles)) if len(cycles) else ((), ())
+        self.monthly = np.array(units, dtype="U1") == "M"
+        self.step = np.array(steps, dtype=np.int64)
+        # Unknown cycles and missing dates never charge
+        self.valid = (self.step > 0) & (self.next_day != NO_DAY)
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows are (id, name, account, amount, billing_cycle, next_billing_date)
+        rows = list(rows)
+        if not rows:
+            return cls([], [], [], [], [], [])
+        ids, names, accounts, amounts, cycles, dates = zip(*rows)
+        cents = np.round(np.asarray(amounts, dtype=np.float64) * 100).astype(np.int64)
+        return cls(ids, names, accounts, cents, cycles, parse_days(np.asarray(dates, dtype=object)))
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Projection:
+    # Every charge in [start, end): day, cents and the subscription's index
+    def __init__(self, subscriptions, start, end, days, cents, index):
+        self.subscriptions = subscriptions
+        self.start, self.end = start, end
+        self.days, self.cents, self.index = days, cents, index
+
+    def __len__(self):
+        return len(self.days)
+
+    def daily(self, account=None):
+        # Cents charged on each day of the horizon
+        days, cents = self.days, self.cents
+        if account is not None:
+            selected = self.subscriptions.account_code[self.index] == self.subscriptions.accounts.code_of.get(account, -1)
+            days, cents = days[selected], cents[selected]
+        totals = np.bincount(days - self.start, weights=cents, minlength=self.end - self.start)
+        return np.rint(totals).astype(np.int64)
+
+    def upcoming(self, limit=20):
+        # The next charges as (day, name, cents)
+        order = np.argsort(self.days, kind="stable")[:limit]
+        return [(int(self.days[i]), self.subscriptions.names[self.index[i]], int(self.cents[i])) for i in order]
+
+
+@traced
+def expand(subscriptions, start, end):
+    # All charges in [start, end) without a per-charge Python loop. Day-based
+    # subscriptions are taken first, so each kind's charges form one block.
+    subscriptions_index = np.flatnonzero(subscriptions.valid)
+    subscriptions_index = subscriptions_index[np.argsort(subscriptions.monthly[subscriptions_index], kind="stable")]
+    anchor = subscriptions.next_day[subscriptions_index]
+    step = subscriptions.step[subscriptions_index]
+    monthly = subscriptions.monthly[subscriptions_index]
+    daily = ~monthly
+    first = np.zeros(len(subscriptions_index), dtype=np.int64)
+    last = np.zeros(len(subscriptions_index), dtype=np.int64)
+
+    # Day-based cycles: charge k falls on anchor + k * step
+    first[daily] = np.maximum(0, -((anchor[daily] - start) // step[daily]))
+    last[daily] = (end - 1 - anchor[daily]) // step[daily]
+
+    # Month-based cycles: charge k falls in month anchor_month + k * step on
+    # the anchor's day of month, clipped to the month's length
+    anchor_month = month_of(anchor[monthly])
+    day_of_month = anchor[monthly] - month_start(anchor_month)
+    month_step = step[monthly]
+    first_month, last_month = int(month_of(start)), int(month_of(end - 1))
+    k = np.maximum(0, -((anchor_month - first_month) // month_step))  # first charge month not before start's
+    first[monthly] = k + (add_months(anchor[monthly], k * month_step) < start)
+    k = (last_month - anchor_month) // month_step  # last charge month not after end's
+    last[monthly] = k - (add_months(anchor[monthly], k * month_step) > end - 1)
+
+    # Charge j of the horizon is charge k = first + (j - block start) of the
+    # subscription whose block holds it
+    counts = np.maximum(last - first + 1, 0)
+    k = np.arange(counts.sum()) + np.repeat(first - (np.cumsum(counts) - counts), counts)
+    k_step = k * np.repeat(step, counts)
+    split = int(counts[daily].sum())
+    days = np.empty(len(k), dtype=np.int64)
+    days[:split] = np.repeat(anchor[daily], counts[daily]) + k_step[:split]
+    # Every charge month lies in the horizon, so month starts come from a
+    # small table instead of a datetime conversion per charge
+    month_starts = month_start(np.arange(first_month, last_month + 2))
+    month = np.repeat(anchor_month - first_month, counts[monthly]) + k_step[split:]
+    days[split:] = month_starts[month] + np.minimum(np.repeat(day_of_month, counts[monthly]),
+                                                    month_starts[month + 1] - month_starts[month] - 1)
+    index = np.repeat(subscriptions_index, counts)
+    return Projection(subscriptions, start, end, days.astype(np.int32), subscriptions.cents[index], index.astype(np.int32))
+
+
+class SubscriptionForecast:
+    # Keeps a user's expanded subscriptions until their subscription_revision
+    # changes or a different horizon is asked for. The connection is opened
+    # lazily, by whichever thread uses the forecast; one thread at a time.
+    def __init__(self, path="instance/finance_app.db", username="local"):
+        self.path = path
+        self.username = username
+        self.conn = None
+        self._subscriptions = None
+        self._projection = None
+        self._key = None
+
+    def projection(self, start, end):
+        revision = self._revision()
+        if self._key != (revision, start, end):
+            if self._subscriptions is None or self._key[0] != revision:
+                self._subscriptions = self._load()
+            self._projection = expand(self._subscriptions, start, end)
+            self._key = (revision, start, end)
+        return self._projection
+
+    def projected_balance(self, days, cents, account=None):
+        # Balances (days, cents) from BalanceIndex.daily over the horizon,
+        # less every subscription charge up to and including each day
+        if not len(days):
+            return days, cents
+        charges = self.projection(int(days[0]), int(days[-1]) + 1).daily(account)
+        return days, cents - np.cumsum(charges)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _connect(self):
+        if self.conn is None and os.path.exists(self.path):
+            self.conn = open_database(self.path)
+        return self.conn
+
+    def _revision(self):
+        conn = self._connect()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT r.revision FROM subscription_revision r JOIN user u ON u.id = r.user_id"
+                           " WHERE u.username = ?", (self.username,)).fetchone()
+        return row[0] if row else 0
+
+    def _load(self):
+        conn = self._connect()
+        if conn is None:
+            return Subscriptions.from_rows([])
+        return Subscriptions.from_rows(conn.execute(
+            "SELECT s.id, s.name, a.account_type, s.amount, s.billing_cycle, s.next_billing_date"
+            " FROM subscription s JOIN account a ON a.id = s.account_id JOIN user u ON u.id = a.user_id"
+            " WHERE u.username = ? ORDER BY s.id", (self.username,)))
+
+
+def _cycle_key(cycle):
+    return "".join(character for character in str(cycle).lower() if character.isalpha())
+
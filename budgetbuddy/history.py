@@ -0,0 +1,76 @@
+from budgetbuddy.profiling import traced
+
+# Undo/redo for the ledger as a stack of deltas. A delta keeps only the rows
+# an operation touched, so history costs memory in proportion to the edits
+# made, never to the ledger, and there is no limit on its depth:
+#
+#   ("insert", ids, rows)             rows were added under ids
+#   ("replace", id, before, after)    a row changed from before to after
+#   ("remove", ids, rows)             the rows with ids were deleted
+#
+# Rows are named by their ledger id, which does not move when other rows
+# are deleted or compacted away. rows are row_values lists and before/after
+# are Ledger.row dicts. Undoing applies the opposite change through the
+# same code path as any other edit, and the delta that produces is what
+# redo later reverses. Removed rows come back under the ids they had, so
+# older deltas still find them.
+
+
+class History:
+    def __init__(self):
+        self.done = []
+        self.undone = []
+        self._replayed = None  # set while undo/redo applies a delta
+
+    def record(self, delta):
+        # Called by every edit once it has been made
+        if self._replayed is not None:
+            self._replayed.append(delta)
+            return
+        self.done.append(delta)
+        self.undone.clear()
+
+    def clear(self):
+        self.done.clear()
+        self.undone.clear()
+
+    def can_undo(self):
+        return bool(self.done)
+
+    def can_redo(self):
+        return bool(self.undone)
+
+    @traced
+    def undo(self, apply):
+        # apply(delta) makes the change through the normal edit path
+        self._push(self.undone, self._replay(apply, inverse(self.done.pop())))
+
+    @traced
+    def redo(self, apply):
+        self._push(self.done, self._replay(apply, inverse(self.undone.pop())))
+
+    def _replay(self, apply, delta):
+        # The delta apply recorded, or None when it found nothing to change
+        self._replayed = []
+        try:
+            apply(delta)
+            replayed = self._replayed
+        finally:
+            self._replayed = None
+        if len(replayed) > 1:
+            raise RuntimeError(f"one delta replayed as {len(replayed)} changes")
+        return replayed[0] if replayed else None
+
+    def _push(self, stack, delta):
+        if delta is not None:
+            stack.append(delta)
+
+
+def inverse(delta):
+    # The change that undoes delta
+    kind = delta[0]
+    if kind == "insert":
+        return ("remove", delta[1], delta[2])
+    if kind == "remove":
+        return ("insert", delta[1], delta[2])
+    return ("replace", delta[1], delta[3], delta[2])
@@ -0,0 +1,485 @@
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from budgetbuddy.columns import COLUMNS
+from budgetbuddy.ledger import NO_DAY, Ledger, format_days, parse_days
+from budgetbuddy.profiling import span, traced
+
+# Bank statement import. A CSV, OFX or QIF export is read in chunks of
+# CHUNK_ROWS records, each validated with array operations into the COLUMNS
+# layout: amounts are made positive, with the sign deciding Income or
+# Expense. Rows that fail go to a rejects report instead. FingerprintIndex
+# tells which rows the ledger already has, so overlapping statements can be
+# imported without doubling anything up.
+#
+#   python -m budgetbuddy.importer statement.csv --account Checking
+#
+# runs the pipeline without touching any ledger and prints its report.
+
+STATEMENT_FILTER = "Statements (*.csv *.ofx *.qfx *.qif);;All Files (*)"
+NEAR_DAYS = 3  # a near duplicate may be dated up to this many days either way
+CHUNK_ROWS = 50_000
+TYPES = ["Income", "Expense"]
+REJECT_COLUMNS = ["Line", "Reason", "Date", "Type", "Account", "Amount", "Source/Category", "Notes"]
+
+NEW, DUPLICATE, NEAR_DUPLICATE = 0, 1, 2
+_WORDS = re.compile(r"[a-z]+")
+
+# Lower-cased CSV headers for each field, in order of preference
+CSV_HEADERS = {
+    "Date": ["date", "transaction date", "posted date", "posting date", "booking date"],
+    "Amount": ["amount", "transaction amount"],
+    "Debit": ["debit", "withdrawal", "withdrawals", "money out"],
+    "Credit": ["credit", "deposit", "deposits", "money in"],
+    "Notes": ["notes", "description", "payee", "name", "memo", "details", "narrative"],
+    "Source/Category": ["source/category", "category"],
+    "Account": ["account"],
+    "Type": ["type"],
+}
+
+
+class StatementImport:
+    # One run of the pipeline. Valid rows collect in batch, a Ledger, with
+    # kinds saying which are NEW, DUPLICATE or NEAR_DUPLICATE; nothing else
+    # is held between chunks, and rejects are written to rejects_path as
+    # they turn up. run() may be on a worker thread; cancel() stops it at
+    # the next chunk.
+    def __init__(self, path, account, categorizer=None, fingerprints=None, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.account = account
+        self.categorizer = categorizer
+        self.fingerprints = fingerprints
+        self.chunk_rows = chunk_rows
+        self.rejects_path = path + ".rejects.csv"  # keeps the extension, so st.csv and st.qif differ
+        self.batch = Ledger()
+        self.kinds = np.empty(0, dtype=np.int8)
+        self.read = self.rejected = 0
+        self.seconds = 0.0
+        self.cancelled = False
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.seconds if self.seconds else 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    @traced
+    def run(self, progress=None):
+        # progress, if given, is called with the rows read after each chunk
+        started = time.perf_counter()
+        if os.path.exists(self.rejects_path):
+            os.remove(self.rejects_path)
+        kinds = []
+        seen = collections.Counter()  # fingerprints of earlier chunks, for copies across them
+        matched = collections.Counter()  # near keys of the ledger rows they matched
+        for raw in iter_statement(self.path, self.chunk_rows):
+            if self.cancelled:
+                break
+            with span("StatementImport.chunk"):
+                raw.index = np.arange(self.read, self.read + len(raw)) + 1  # record number in the file
+                self.read += len(raw)
+                frame, rejects = validate(raw, self.account)
+                if len(rejects):
+                    self.rejected += len(rejects)
+                    rejects.to_csv(self.rejects_path, mode="a", index=False,
+                                   header=not os.path.exists(self.rejects_path))
+                if self.categorizer is not None:
+                    blank = (frame["Source/Category"] == "").to_numpy()
+                    if blank.any():
+                        frame.loc[blank, "Source/Category"] = self.categorizer.categorize(
+                            frame["Notes"][blank], frame["Type"][blank], frame["Amount"][blank])
+                # Parsed into columns once, for both the fingerprints and the batch
+                incoming = Ledger.from_frame(frame)
+                if self.fingerprints is not None:
+                    kinds.append(self.fingerprints.classify(incoming, seen, matched))
+                else:
+                    kinds.append(np.full(len(incoming), NEW, dtype=np.int8))
+                self.batch.append_new(incoming)
+            if progress is not None:
+                progress(self.read)
+        self.kinds = np.concatenate(kinds) if kinds else self.kinds
+        self.seconds = time.perf_counter() - started
+        return self
+
+    def selected(self, kinds):
+        # The batch cut down to rows of the given kinds
+        if np.isin(self.kinds, kinds).all():
+            return self.batch
+        selected = Ledger()
+        selected.append_ledger(self.batch, np.flatnonzero(np.isin(self.kinds, kinds)))
+        return selected
+
+    def report(self):
+        counts = np.bincount(self.kinds, minlength=3)
+        return {"read": self.read, "rejected": self.rejected, "new": int(counts[NEW]),
+                "duplicates": int(counts[DUPLICATE]), "near_duplicates": int(counts[NEAR_DUPLICATE]),
+                "seconds": self.seconds, "rows_per_second": self.rows_per_second,
+                "rejects": self.rejects_path if self.rejected else None}
+
+
+def read_statement(path, account):
+    # The whole statement as one frame, without the rejects
+    frames = [validate(raw, account)[0] for raw in iter_statement(path, CHUNK_ROWS)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+
+
+def iter_statement(path, chunk_rows=CHUNK_ROWS):
+    # Raw records as frames of strings: Date, Amount and Notes, plus Type,
+    # Account and Source/Category where the file has them
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".ofx", ".qfx"):
+        return _chunked(_ofx_records(path), chunk_rows)
+    if extension == ".qif":
+        return _chunked(_qif_records(path), chunk_rows)
+    return _csv_chunks(path, chunk_rows)
+
+
+@traced
+def validate(raw, account):
+    # Splits a raw chunk into a COLUMNS frame of good rows and a rejects
+    # frame saying what was wrong with the others. account is used for
+    # rows whose file does not name one.
+    text = {field: _text(raw, field) for field in ("Date", "Type", "Account", "Amount", "Source/Category", "Notes")}
+    amounts = pd.to_numeric(pd.Series(text["Amount"]), errors="coerce").to_numpy(dtype=np.float64, copy=True)
+    retry = np.isnan(amounts) & (text["Amount"] != "")
+    if retry.any():
+        # Thousands separators and currency signs
+        cleaned = pd.Series(text["Amount"][retry]).str.replace(r"[,$\s]", "", regex=True)
+        amounts[retry] = pd.to_numeric(cleaned, errors="coerce").to_numpy()
+    days = parse_days(text["Date"])
+    types = _text(raw, "Type", str.capitalize)
+    named = np.isin(types, TYPES)
+    accounts = np.where(text["Account"] == "", account or "", text["Account"])
+
+    reasons = np.select([days == NO_DAY, ~np.isfinite(amounts), ~named & (types != ""), accounts == ""],
+                        ["bad date", "bad amount", "bad type", "no account"], default="")
+    good = reasons == ""
+    # Without a Type the sign says which it is; with one, as in this app's
+    # own files, the sign is ignored
+    types = np.where(named, types, np.where(amounts < 0, "Expense", "Income"))
+    frame = pd.DataFrame({
+        "Date": format_days(days[good]),
+        "Type": types[good],
+        "Account": accounts[good],
+        "Amount": np.abs(amounts[good]).round(2),
+        "Source/Category": text["Source/Category"][good],
+        "Notes": text["Notes"][good],
+    }, columns=COLUMNS)
+    rejects = pd.DataFrame({"Line": raw.index[~good], "Reason": reasons[~good],
+                            **{field: values[~good] for field, values in text.items()}},
+                           columns=REJECT_COLUMNS)
+    return frame, rejects
+
+
+def _text(raw, field, clean=str.strip):
+    # A column as stripped strings, "" where missing. Each distinct value is
+    # cleaned once.
+    if field not in raw:
+        return np.full(len(raw), "", dtype=object)
+    codes, uniques = pd.factorize(raw[field].to_numpy(dtype=object))
+    cleaned = np.array([clean(str(value).strip()) for value in uniques] + [""], dtype=object)
+    return cleaned[codes]
+
+
+def _chunked(records, chunk_rows):
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_rows))
+        if not chunk:
+            return
+        yield pd.DataFrame(chunk)
+
+
+def _csv_chunks(path, chunk_rows):
+    with pd.read_csv(path, dtype=str, keep_default_na=False, skipinitialspace=True, chunksize=chunk_rows) as reader:
+        found = None
+        for raw in reader:
+            if found is None:
+                headers = {str(name).strip().lower(): name for name in raw.columns}
+                found = {field: next((headers[name] for name in names if name in headers), None)
+                         for field, names in CSV_HEADERS.items()}
+                if found["Date"] is None:
+                    raise ValueError("no date column")
+                if found["Amount"] is None and found["Debit"] is None and found["Credit"] is None:
+                    raise ValueError("no amount column")
+            frame = pd.DataFrame({field: raw[found[field]] for field in ("Date", "Notes", "Source/Category",
+                                                                         "Account", "Type", "Amount")
+                                  if found[field] is not None}, index=raw.index)
+            if found["Amount"] is None:
+                # Separate columns for money out and in; a row with neither is a bad amount
+                debit, credit = (pd.to_numeric(raw[found[field]].str.replace(r"[,$\s]", "", regex=True)
+                                               .replace("", "0"), errors="coerce").abs()
+                                 if found[field] is not None else pd.Series(0.0, index=raw.index)
+                                 for field in ("Debit", "Credit"))
+                amounts = (credit - debit).where((credit != 0) | (debit != 0))
+                frame["Amount"] = amounts.map(repr).where(amounts.notna(), "")
+            yield frame
+
+
+def _ofx_records(path):
+    # SGML OFX leaves elements unclosed: a value runs to the end of its line
+    # or the next tag
+    fields = None
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            for tag, value in re.findall(r"<(/?\w+)>([^<\r\n]*)", line):
+                tag = tag.upper()
+                if tag == "STMTTRN":
+                    if fields is not None:
+                        yield _ofx_record(fields)
+                    fields = {}
+                elif tag in ("/STMTTRN", "/BANKTRANLIST") and fields is not None:
+                    yield _ofx_record(fields)
+                    fields = None
+                elif fields is not None:
+                    fields[tag] = value.strip()
+    if fields is not None:
+        yield _ofx_record(fields)
+
+
+def _ofx_record(fields):
+    posted = fields.get("DTPOSTED", "")  # YYYYMMDD, maybe with a time after
+    name, memo = fields.get("NAME", ""), fields.get("MEMO", "")
+    return {"Date": f"{posted[:4]}-{posted[4:6]}-{posted[6:8]}" if len(posted) >= 8 else posted,
+            "Amount": fields.get("TRNAMT", ""),
+            "Notes": f"{name} {memo}" if name and memo and memo not in name else name or memo}
+
+
+def _qif_records(path):
+    record = {}
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith("!"):
+                continue
+            code, value = line[0], line[1:].strip()
+            if code == "^":
+                if record:
+                    yield record
+                record = {}
+            elif code == "D":
+                # Month first, as 1/15'24 or 01/15/2024; anything else is rejected
+                record["Date"] = value
+                try:
+                    month, day, year = (int(part) for part in re.split(r"[/'\-.]", value.replace(" ", ""))[:3])
+                    record["Date"] = f"{year + (2000 if year < 100 else 0):04d}-{month:02d}-{day:02d}"
+                except ValueError:
+                    pass
+            elif code in "TU":
+                record["Amount"] = value
+            elif code == "P":
+                record["Notes"] = value
+            elif code == "M":
+                record.setdefault("Notes", value)
+            elif code == "L" and not value.startswith("["):
+                # [Account] is a transfer, not a category
+                record["Source/Category"] = value
+    if record:
+        yield record
+
+
+class FingerprintIndex:
+    # Counts of every live row's fingerprint, kept up to date like the other
+    # indexes. A row's fingerprint hashes its day, amount, type, account and
+    # notes with case and spacing normalized; its near key leaves out the day
+    # and everything in the notes but letters, so reference numbers and dates
+    # printed into descriptions do not matter. Near keys are counted per
+    # day, and a row is a near duplicate when one is found within NEAR_DAYS,
+    # so either check is a few dict lookups however long the ledger is.
+    #
+    # save() writes the counts next to the ledger's storage, stamped with a
+    # digest of the rows they were made from; load() takes them back only
+    # while the ledger still has that digest, so a stale file is rebuilt.
+    FORMAT_VERSION = 1
+
+    def __init__(self, ledger, near_days=NEAR_DAYS):
+        self.ledger = ledger
+        self.near_days = near_days
+        self.exact = collections.Counter()
+        self.near = collections.Counter()
+        self._text_hashes = {}  # (pool name, normalization) -> hash per pool code
+
+    @traced
+    def build(self):
+        self.exact.clear()
+        self.near.clear()
+        self.add_rows(self.ledger.positions())
+
+    @classmethod
+    def open(cls, path, ledger, near_days=NEAR_DAYS):
+        # The index saved at path while it still matches, else a fresh build
+        index = cls.load(path, ledger, near_days)
+        if index is None:
+            index = cls(ledger, near_days)
+            index.build()
+        return index
+
+    @classmethod
+    @traced
+    def load(cls, path, ledger, near_days=NEAR_DAYS):
+        # The saved index if it still matches ledger, else None
+        index = cls(ledger, near_days)
+        try:
+            with np.load(path) as saved:
+                if (int(saved["version"]) != cls.FORMAT_VERSION or int(saved["near_days"]) != near_days
+                        or str(saved["digest"]) != index._digest()):
+                    return None
+                index.exact.update(dict(zip(saved["exact_keys"].tolist(), saved["exact_counts"].tolist())))
+                index.near.update(dict(zip(saved["near_keys"].tolist(), saved["near_counts"].tolist())))
+        except (OSError, KeyError, ValueError):
+            return None
+        return index
+
+    @traced
+    def save(self, path):
+        columns = {"version": self.FORMAT_VERSION, "near_days": self.near_days, "digest": self._digest()}
+        for name, counter in (("exact", self.exact), ("near", self.near)):
+            kept = [(key, count) for key, count in counter.items() if count > 0]
+            columns[name + "_keys"] = np.array([key for key, _ in kept], dtype=np.uint64)
+            columns[name + "_counts"] = np.array([count for _, count in kept], dtype=np.int64)
+        with open(path + ".tmp", "wb") as handle:
+            np.savez(handle, **columns)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(path + ".tmp", path)
+
+    @traced
+    def add_rows(self, positions):
+        exact, near = self._keys(self.ledger, positions, self._text_hashes)
+        self.exact.update(exact.tolist())
+        self.near.update(near.tolist())
+
+    @traced
+    def remove_rows(self, positions):
+        exact, near = self._keys(self.ledger, positions, self._text_hashes)
+        self.exact.subtract(exact.tolist())
+        self.near.subtract(near.tolist())
+
+    @traced
+    def classify(self, incoming, seen=None, matched=None):
+        # NEW, DUPLICATE or NEAR_DUPLICATE for each row of the Ledger
+        # incoming. A statement row only matches as many ledger rows as there
+        # are, so the same purchase made twice in a day still imports the
+        # second time.
+        # A ledger row taken by an exact match is not there to be nearly
+        # matched by later rows either. seen counts the fingerprints of a
+        # statement's earlier chunks and matched the near keys of the ledger
+        # rows they took; both are updated with this chunk's.
+        positions = np.arange(len(incoming))
+        cache = {}
+        exact, own = self._keys(incoming, positions, cache)
+        # The k-th copy of a fingerprint in the statement is a duplicate if
+        # the ledger has more than k
+        copy = pd.Series(exact).groupby(exact).cumcount().to_numpy(dtype=np.int64, copy=True)
+        if seen is not None:
+            copy += _counts(seen, exact)
+            seen.update(exact.tolist())
+        duplicate = copy < _counts(self.exact, exact)
+        # Near keys for every day in the window of each remaining row, looked
+        # up all at once, less the ledger rows exact matches took before it
+        rest = np.flatnonzero(~duplicate)
+        offsets = np.arange(-self.near_days, self.near_days + 1)
+        days = (incoming.day.astype(np.int64)[rest, None] + offsets).ravel()
+        nearby = _mix(np.repeat(self._loose(incoming, rest, cache), len(offsets)), days)
+        left = _counts(self.near, nearby)
+        if matched is not None:
+            left -= _counts(matched, nearby)
+        left -= _taken_before(own[duplicate], np.flatnonzero(duplicate), nearby, np.repeat(rest, len(offsets)))
+        if matched is not None:
+            matched.update(own[duplicate].tolist())
+        near = np.zeros(len(exact), dtype=bool)
+        near[rest] = (left.reshape(len(rest), len(offsets)) > 0).any(axis=1)
+        return np.where(duplicate, DUPLICATE, np.where(near, NEAR_DUPLICATE, NEW)).astype(np.int8)
+
+    def _digest(self):
+        # Identifies the live rows by id and content. Pool codes are left
+        # out, since reloading a ledger may number its strings differently.
+        positions = self.ledger.positions()
+        positions = positions[np.argsort(self.ledger.id[positions], kind="stable")]
+        digest = hashlib.blake2b(self.ledger.id[positions].tobytes(), digest_size=16)
+        digest.update(self._keys(self.ledger, positions, self._text_hashes)[0].tobytes())
+        return digest.hexdigest()
+
+    def _keys(self, ledger, positions, cache):
+        positions = np.asarray(positions, dtype=np.int64)
+        exact = _mix(self._row_hash(ledger, positions, cache),
+                     self._text_hash(ledger, "notes", _exact_text, cache)[ledger.notes_code[positions]],
+                     ledger.day[positions])
+        near = _mix(self._loose(ledger, positions, cache), ledger.day[positions])
+        return exact, near
+
+    def _loose(self, ledger, positions, cache):
+        return _mix(self._row_hash(ledger, positions, cache),
+                    self._text_hash(ledger, "notes", _loose_text, cache)[ledger.notes_code[positions]])
+
+    def _row_hash(self, ledger, positions, cache):
+        return _mix(ledger.cents[positions],
+                    self._text_hash(ledger, "types", _exact_text, cache)[ledger.type_code[positions]],
+                    self._text_hash(ledger, "accounts", _exact_text, cache)[ledger.account_code[positions]])
+
+    def _text_hash(self, ledger, pool_name, normalize, cache):
+        # Pools only grow, so hashes are only worked out for new strings
+        pool = getattr(ledger, pool_name)
+        hashes = cache.get((pool_name, normalize), np.empty(0, dtype=np.uint64))
+        if len(hashes) < len(pool):
+            added = np.array([normalize(value) for value in pool.values[len(hashes):]], dtype=object)
+            hashes = cache[(pool_name, normalize)] = np.concatenate((hashes, pd.util.hash_array(added)))
+        return hashes
+
+
+def _taken_before(keys, rows, queries, before):
+    # For each query key, how many of keys sit at rows before its own row
+    if not len(keys) or not len(queries):
+        return np.zeros(len(queries), dtype=np.int64)
+    codes = np.unique(np.concatenate((keys, queries)), return_inverse=True)[1].astype(np.int64)
+    width = int(max(rows.max(), before.max())) + 1
+    taken = np.sort(codes[:len(keys)] * width + rows)
+    queried = codes[len(keys):] * width
+    return np.searchsorted(taken, queried + before) - np.searchsorted(taken, queried)
+
+
+def _counts(counter, keys):
+    return np.fromiter(map(counter.get, keys.tolist(), itertools.repeat(0)), dtype=np.int64, count=len(keys))
+
+
+def _exact_text(text):
+    return " ".join(text.lower().split())
+
+
+def _loose_text(text):
+    return " ".join(_WORDS.findall(text.lower()))
+
+
+def _mix(*columns):
+    # Order-dependent combination of 64-bit values, FNV style
+    mixed = np.full(len(columns[0]), 0xCBF29CE484222325, dtype=np.uint64)
+    for column in columns:
+        mixed = (mixed ^ np.asarray(column).astype(np.uint64)) * np.uint64(0x100000001B3)
+        mixed ^= mixed >> np.uint64(29)
+    return mixed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m budgetbuddy.importer")
+    parser.add_argument("statement", help="CSV, OFX/QFX or QIF file")
+    parser.add_argument("--account", default="Checking", help="for rows the file does not name one")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+    job = StatementImport(args.statement, args.account, chunk_rows=args.chunk_rows).run()
+    json.dump(job.report(), sys.stdout, indent=1)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+import numpy as np
+
+from budgetbuddy.ledger import NO_DAY
+from budgetbuddy.profiling import traced
+
+INT32_RANGE = (np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+
+
+class BalanceIndex:
+    # Running balance per account. Each account keeps its transactions'
+    # signed amounts (Income adds, Expense subtracts) sorted by day, with a
+    # prefix sum alongside, so the balance on any day is one binary search.
+    # A change rewrites the arrays only from the first affected day on, so
+    # adding today's transaction touches just the end of the index. Undated
+    # rows sort first and count towards every balance.
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.accounts = {}  # account code -> _DayOrdered of (day, cents)
+
+    @traced
+    def build(self):
+        self.accounts = {}
+        self.add_rows(self.ledger.positions())
+
+    @traced
+    def add_rows(self, positions):
+        for code, columns in self._by_account(positions):
+            running = self.accounts.get(code)
+            if running is None:
+                running = self.accounts[code] = _DayOrdered({"cents": np.int64}, summed=["cents"])
+            running.insert(columns)
+
+    @traced
+    def remove_rows(self, positions):
+        # Call before the rows change in (or leave) the ledger
+        for code, columns in self._by_account(positions):
+            self.accounts[code].remove(columns)
+
+    def balance(self, account=None, day=None):
+        # Balance in cents at the end of day (None: including every row), for
+        # one account name or all of them
+        return sum(running.total("cents", running.count_through(day)) for running in self._selected(account))
+
+    def balances(self, day=None):
+        # [(account, cents)] for every account with transactions
+        accounts = self.ledger.accounts
+        return sorted((accounts[code], running.total("cents", running.count_through(day)))
+                      for code, running in self.accounts.items() if running.size)
+
+    def daily(self, start, end, account=None):
+        # End-of-day balances for the days in [start, end), as (days, cents)
+        days = np.arange(start, end, dtype=np.int64)
+        cents = np.zeros(len(days), dtype=np.int64)
+        for running in self._selected(account):
+            cents += running.totals("cents", running.count_through(days))
+        return days, cents
+
+    def day_range(self):
+        # (first, last) dated day across all accounts, or None
+        ranges = [running.day_range() for running in self.accounts.values()]
+        ranges = [day_range for day_range in ranges if day_range is not None]
+        return (min(first for first, _ in ranges), max(last for _, last in ranges)) if ranges else None
+
+    def _selected(self, account):
+        if account is None:
+            return list(self.accounts.values())
+        running = self.accounts.get(self.ledger.accounts.code_of.get(account, -1))
+        return [running] if running is not None else []
+
+    def _by_account(self, positions):
+        ledger = self.ledger
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return
+        codes = ledger.account_code[positions]
+        days = ledger.day[positions]
+        cents = ledger.cents[positions] * _signs(ledger)[ledger.type_code[positions]]
+        for code in np.unique(codes):
+            selected = codes == code
+            yield int(code), {"day": days[selected], "cents": cents[selected]}
+
+
+class DateIndex:
+    # The ledger in day order, with prefix sums of income and expense cents.
+    # Totals for any [start, end) window are two binary searches; the
+    # per-category breakdown of a window reads only the rows inside it.
+    # Maintained under insert, edit and delete like BalanceIndex.
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.rows = _DayOrdered({"type_code": np.int8, "category_code": np.int32, "cents": np.int64,
+                                 "income": np.int64, "expense": np.int64}, summed=["income", "expense"])
+
+    @traced
+    def build(self):
+        self.rows.clear()
+        self.add_rows(self.ledger.positions())
+
+    @traced
+    def add_rows(self, positions):
+        columns = self._columns(positions)
+        if columns is not None:
+            self.rows.insert(columns)
+
+    @traced
+    def remove_rows(self, positions):
+        # Call before the rows change in (or leave) the ledger
+        columns = self._columns(positions)
+        if columns is not None:
+            self.rows.remove(columns)
+
+    def day_range(self):
+        return self.rows.day_range()
+
+    def totals(self, start, end):
+        # (income cents, expense cents, rows) for days in [start, end)
+        low, high = self.rows.count_through(start - 1), self.rows.count_through(end - 1)
+        return (self.rows.total("income", high) - self.rows.total("income", low),
+                self.rows.total("expense", high) - self.rows.total("expense", low), high - low)
+
+    def summary(self, start, end):
+        # Totals for [start, end) plus cents per (type, category) in it
+        income, expense, count = self.totals(start, end)
+        low, high = self.rows.count_through(start - 1), self.rows.count_through(end - 1)
+        types = self.rows.column("type_code")[low:high]
+        categories = self.rows.column("category_code")[low:high]
+        cents = self.rows.column("cents")[low:high]
+        breakdown = {}
+        if count:
+            # (type, category) pairs are few, so count into a dense table
+            width = len(self.ledger.categories)
+            keys = types.astype(np.int64) * width + categories
+            size = len(self.ledger.types) * width
+            sums = np.bincount(keys, weights=cents, minlength=size)
+            for key in np.flatnonzero(np.bincount(keys, minlength=size)):
+                type_code, category_code = divmod(int(key), width)
+                breakdown[(self.ledger.types[type_code], self.ledger.categories[category_code])] = int(round(sums[key]))
+        return {"income": income, "expense": expense, "net": income - expense, "count": count, "categories": breakdown}
+
+    def periods(self, freq, start=None, end=None):
+        # [(label, start, end, income, expense, rows)] for each week ("W",
+        # Monday first), month ("M") or quarter ("Q") overlapping
+        # [start, end), defaulting to the ledger's dated range
+        if start is None or end is None:
+            day_range = self.day_range()
+            if day_range is None:
+                return []
+            start = day_range[0] if start is None else start
+            end = day_range[1] + 1 if end is None else end
+        bounds, labels = period_bounds(freq, start, end)
+        counts = self.rows.count_through(bounds - 1)
+        income = np.diff(self.rows.totals("income", counts))
+        expense = np.diff(self.rows.totals("expense", counts))
+        rows = np.diff(counts)
+        return [(label, int(low), int(high), int(inc), int(exp), int(count))
+                for label, low, high, inc, exp, count in zip(labels, bounds[:-1], bounds[1:], income, expense, rows)]
+
+    def _columns(self, positions):
+        ledger = self.ledger
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return None
+        dated = ledger.day[positions] != NO_DAY
+        positions = positions[dated]
+        cents = ledger.cents[positions]
+        signs = _signs(ledger)[ledger.type_code[positions]]
+        return {"day": ledger.day[positions], "type_code": ledger.type_code[positions],
+                "category_code": ledger.category_code[positions], "cents": cents,
+                "income": np.where(signs > 0, cents, 0), "expense": np.where(signs < 0, cents, 0)}
+
+
+class SortIndex:
+    # The ledger's positions in order of one column, worked out with a
+    # stable argsort the first time that column is sorted and then kept up
+    # to date: appended rows are merged in and an edited row is moved, by
+    # binary search in the sorted keys rather than a new sort. Deleted rows stay in the
+    # order until compaction and are skipped when reading it. Text columns
+    # sort by their pool strings, ignoring case.
+    KEYS = {"Date": ("day", None), "Type": ("type_code", "types"), "Account": ("account_code", "accounts"),
+            "Amount": ("cents", None), "Source/Category": ("category_code", "categories"),
+            "Notes": ("notes_code", "notes")}
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.orders = {}  # column name -> positions in ascending order
+        self._ranks = {}  # pool name -> (pool size, sort rank of each code)
+
+    def sorted(self, column, descending=False, rows=None):
+        # rows (positions, e.g. a search result; None for every live row)
+        # in the column's order
+        order = self.orders.get(column)
+        if order is None:
+            order = self.orders[column] = np.argsort(self._keys(column), kind="stable")
+        if rows is None:
+            shown = order[self.ledger.live[order]] if self.ledger.dead else order
+        else:
+            # Picking rows out of the cached order beats sorting them
+            selected = np.zeros(len(self.ledger), dtype=bool)
+            selected[rows] = True
+            shown = order[selected[order]]
+        return shown[::-1] if descending else shown
+
+    @traced
+    def add_rows(self, positions):
+        # Rows past the end of a cached order are new and merged into it;
+        # revived ones never left
+        for column, order in self.orders.items():
+            added = np.arange(len(order), len(self.ledger))
+            if not len(added):
+                continue
+            keys = self._keys(column)
+            added = added[np.argsort(keys[added], kind="stable")]
+            at = np.searchsorted(keys[order], keys[added], side="right")
+            self.orders[column] = np.insert(order, at, added)
+
+    @traced
+    def update(self, position):
+        # Call after the row at position has changed
+        for column, order in self.orders.items():
+            order = order[order != position]
+            keys = self._keys(column)
+            at = np.searchsorted(keys[order], keys[position], side="right")
+            self.orders[column] = np.insert(order, at, position)
+
+    def compact(self, keep):
+        # Follows Ledger.compact
+        if keep is None:
+            return
+        moved = np.cumsum(keep) - 1
+        for column, order in self.orders.items():
+            self.orders[column] = moved[order[keep[order]]]
+
+    def _keys(self, column):
+        # Sort key of every position for a COLUMNS name
+        name, pool_name = self.KEYS[column]
+        codes = getattr(self.ledger, name)
+        if pool_name is None:
+            return codes
+        pool = getattr(self.ledger, pool_name)
+        size, ranks = self._ranks.get(pool_name, (-1, None))
+        if size != len(pool):
+            # New strings shift the ranks but never reorder the old ones
+            ranks = np.empty(len(pool), dtype=np.int64)
+            ranks[np.argsort(np.array([value.casefold() for value in pool.values], dtype=object), kind="stable")] = \
+                np.arange(len(pool))
+            self._ranks[pool_name] = (len(pool), ranks)
+        return ranks[codes]
+
+
+def period_bounds(freq, start, end):
+    # Boundary days of the periods covering [start, end) and their labels
+    if freq == "W":
+        first = start - (start + 3) % 7  # day 0 was a Thursday
+        bounds = np.arange(first, end + 7, 7, dtype=np.int64)
+        bounds = bounds[:np.searchsorted(bounds, end) + 1]
+        labels = bounds[:-1].astype("datetime64[D]").astype(str).tolist()
+        return bounds, labels
+    step = {"M": 1, "Q": 3}[freq]
+    first_month = int(np.datetime64(int(start), "D").astype("datetime64[M]").astype(np.int64))
+    first_month -= first_month % step
+    last_month = int(np.datetime64(int(end) - 1, "D").astype("datetime64[M]").astype(np.int64))
+    months = np.arange(first_month, last_month + step + 1, step, dtype=np.int64)
+    bounds = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    if freq == "M":
+        labels = months[:-1].astype("datetime64[M]").astype(str).tolist()
+    else:
+        labels = [f"{1970 + month // 12}Q{month % 12 // 3 + 1}" for month in months[:-1]]
+    return bounds, labels
+
+
+def _signs(ledger):
+    # +1 for Income, -1 for Expense, 0 for anything else, by type code
+    signs = np.zeros(max(len(ledger.types), 1), dtype=np.int64)
+    if "Income" in ledger.types.code_of:
+        signs[ledger.types.code_of["Income"]] = 1
+    if "Expense" in ledger.types.code_of:
+        signs[ledger.types.code_of["Expense"]] = -1
+    return signs
+
+
+class _DayOrdered:
+    # Rows kept sorted by day in growable column arrays, with running sums of
+    # the summed columns. Changes rewrite only the tail from the first
+    # affected row on.
+    def __init__(self, dtypes, summed):
+        self.dtypes = {"day": np.int32, **dtypes}
+        self.summed = summed
+        self.clear()
+
+    def clear(self):
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in self.dtypes.items()}
+        self._prefix = {name: np.empty(0, dtype=np.int64) for name in self.summed}
+        self.size = 0
+
+    def column(self, name):
+        return self._columns[name][:self.size]
+
+    def day_range(self):
+        days = self.column("day")
+        dated = days[days != NO_DAY]
+        return (int(dated[0]), int(dated[-1])) if len(dated) else None
+
+    def count_through(self, day):
+        # Rows dated on or before day (None: all rows); day may be an array
+        if day is None:
+            return self.size
+        # Searching with the column's own dtype avoids converting the column
+        day = np.clip(day, *INT32_RANGE).astype(np.int32)
+        counts = np.searchsorted(self.column("day"), day, side="right")
+        return int(counts) if np.ndim(counts) == 0 else counts
+
+    def total(self, name, count):
+        # Sum of the first count rows of a summed column
+        return int(self._prefix[name][count - 1]) if count else 0
+
+    def totals(self, name, counts):
+        if not self.size:
+            return np.zeros(len(counts), dtype=np.int64)
+        return np.where(counts > 0, self._prefix[name][np.maximum(counts - 1, 0)], 0)
+
+    def insert(self, columns):
+        if not len(columns["day"]):
+            return
+        order = np.argsort(columns["day"], kind="stable")
+        columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+        # New rows go after existing rows on the same day
+        at = np.searchsorted(self.column("day"), columns["day"], side="right")
+        start = int(at[0])
+        tail = {name: np.insert(self.column(name)[start:], at - start, columns[name]) for name in self.dtypes}
+        self._reserve(self.size + len(order))
+        self._write_tail(start, tail)
+
+    def remove(self, columns):
+        # Rows with equal values are interchangeable, so the first unclaimed
+        # match on that day is taken
+        days = self.column("day")
+        doomed = set()
+        lows = np.searchsorted(days, columns["day"], side="left")
+        highs = np.searchsorted(days, columns["day"], side="right")
+        for row, (low, high) in enumerate(zip(lows.tolist(), highs.tolist())):
+            matches = np.ones(high - low, dtype=bool)
+            for name in self.dtypes:
+                matches &= self.column(name)[low:high] == columns[name][row]
+            for index in low + np.flatnonzero(matches):
+                if index not in doomed:
+                    doomed.add(int(index))
+                    break
+        if not doomed:
+            return
+        start = min(doomed)
+        keep = np.ones(self.size - start, dtype=bool)
+        keep[np.fromiter(doomed, dtype=np.int64) - start] = False
+        self._write_tail(start, {name: self.column(name)[start:][keep] for name in self.dtypes})
+
+    def _write_tail(self, start, tail):
+        end = start + len(tail["day"])
+        for name, values in tail.items():
+            self._columns[name][start:end] = values
+        for name in self.summed:
+            running = np.cumsum(self._columns[name][start:end])
+            if start:
+                running += self._prefix[name][start - 1]
+            self._prefix[name][start:end] = running
+        self.size = end
+
+    def _reserve(self, size):
+        if size <= len(self._columns["day"]):
+            return
+        capacity = max(2 * len(self._columns["day"]), size, 16)
+        for arrays in (self._columns, self._prefix):
+            for name, array in arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                arrays[name] = grown
@@ -0,0 +1,481 @@
+import sys
+import warnings
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+
+from budgetbuddy.columns import AMOUNT_COLUMN, COLUMNS, DATE_COLUMN, ID_COLUMN
+from budgetbuddy.profiling import traced
+
+EPOCH = np.datetime64("1970-01-01", "D")
+NO_DAY = np.iinfo(np.int32).min  # missing or unparseable date
+COMPACT_MIN_DEAD = 1024  # tombstones tolerated before compaction is due
+
+
+class StringPool:
+    # Dictionary encoding for a text column: each distinct string is stored
+    # (and interned) once, rows hold its integer code. Codes are never reused
+    # or removed, so a pool can be shared by copies of a ledger.
+    def __init__(self, values=None):
+        self.values = [] if values is None else values
+        self._code_of = {} if values is None else None  # built on first use for given values
+
+    @property
+    def code_of(self):
+        if self._code_of is None:
+            self._code_of = {value: code for code, value in enumerate(self.values)}
+        return self._code_of
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def encode(self, value):
+        value = _text(value)
+        code = self.code_of.get(value)
+        if code is None:
+            code = len(self.values)
+            value = sys.intern(value)
+            self.values.append(value)
+            self.code_of[value] = code
+        return code
+
+    def encode_many(self, values):
+        # Batches are factorized first so each distinct value is encoded once
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        mapping = np.array([self.encode(value) for value in uniques] + [self.encode("")], dtype=np.int64)
+        return mapping[codes]  # -1 (missing) picks the trailing ""
+
+
+class Ledger:
+    # Typed, column-oriented ledger. One array per column:
+    #
+    #   day            int32  days since 1970-01-01, NO_DAY if missing
+    #   cents          int64  amount in whole cents
+    #   type_code      int8   code into self.types
+    #   account_code   int16  code into self.accounts
+    #   category_code  int32  code into self.categories
+    #   notes_code     int32  code into self.notes
+    #   id             int64  the row's id for life (transaction.id in sqlite)
+    #   live           bool   False once the row is deleted
+    #
+    # That is ROW_BYTES (32) bytes per row, plus every distinct string once in
+    # its pool; a DataFrame of Python objects needs several hundred. Values
+    # are normalized once on the way in (from_frame/append_*), and arrays grow
+    # by doubling so appends are amortized O(1).
+    #
+    # Deleting a row only tombstones it, so no other row moves and
+    # position_of(id) stays a dict lookup. Positions of dead rows are still
+    # readable until compact() drops them, which callers run once
+    # needs_compaction() says enough have piled up.
+    DTYPES = {
+        "day": np.int32,
+        "cents": np.int64,
+        "type_code": np.int8,
+        "account_code": np.int16,
+        "category_code": np.int32,
+        "notes_code": np.int32,
+        "id": np.int64,
+        "live": np.bool_,
+    }
+    VALUES = list(DTYPES)[:len(COLUMNS)]  # the columns _encode_row fills, in COLUMNS order
+    ROW_BYTES = sum(np.dtype(dtype).itemsize for dtype in DTYPES.values())
+
+    def __init__(self, capacity=0):
+        self.types = StringPool()
+        self.accounts = StringPool()
+        self.categories = StringPool()
+        self.notes = StringPool()
+        self._arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.DTYPES.items()}
+        self.size = 0
+        self.dead = 0
+        self.next_id = 1
+        self._position = None  # id -> position of live rows, built on first use
+        self._tombstones = {}  # id -> position of dead rows not yet compacted
+
+    @classmethod
+    def from_frame(cls, frame, first_id=1):
+        # Frames without an ID column get ids counting up from first_id
+        ledger = cls()
+        ledger.next_id = first_id
+        ledger.append_frame(frame)
+        return ledger
+
+    @classmethod
+    def from_arrays(cls, arrays, pools, next_id):
+        # Wraps existing column arrays, e.g. memory-mapped ones, without
+        # copying them. arrays has every DTYPES column but live; pools are
+        # the types, accounts, categories and notes StringPools.
+        ledger = cls()
+        ledger.types, ledger.accounts, ledger.categories, ledger.notes = pools
+        size = len(arrays["id"])
+        for name, dtype in cls.DTYPES.items():
+            ledger._arrays[name] = np.ones(size, dtype=dtype) if name == "live" else arrays[name]
+        ledger.size = size
+        ledger.next_id = next_id
+        return ledger
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def day(self):
+        return self._arrays["day"][:self.size]
+
+    @property
+    def cents(self):
+        return self._arrays["cents"][:self.size]
+
+    @property
+    def type_code(self):
+        return self._arrays["type_code"][:self.size]
+
+    @property
+    def account_code(self):
+        return self._arrays["account_code"][:self.size]
+
+    @property
+    def category_code(self):
+        return self._arrays["category_code"][:self.size]
+
+    @property
+    def notes_code(self):
+        return self._arrays["notes_code"][:self.size]
+
+    @property
+    def id(self):
+        return self._arrays["id"][:self.size]
+
+    @property
+    def live(self):
+        return self._arrays["live"][:self.size]
+
+    def positions(self):
+        # Positions of the live rows
+        return np.arange(self.size) if not self.dead else np.flatnonzero(self.live)
+
+    def position_of(self, row_id):
+        # Position of a live row, or None
+        if self._position is None:
+            positions = self.positions()
+            self._position = dict(zip(self.id[positions].tolist(), positions.tolist()))
+        return self._position.get(row_id)
+
+    @traced
+    def append_frame(self, frame):
+        # Vectorized normalization of a DataFrame with the COLUMNS layout and
+        # optionally an ID column
+        ids = None
+        if ID_COLUMN in frame.columns:
+            ids = pd.to_numeric(frame[ID_COLUMN], errors="coerce").to_numpy(dtype=np.float64)
+            missing = np.isnan(ids)
+            if missing.any():
+                # Rows added to the CSV by hand get ids after every other
+                first = self.next_id
+                if not missing.all():
+                    first = max(first, int(ids[~missing].max()) + 1)
+                ids[missing] = np.arange(first, first + missing.sum())
+        self._append_columns(
+            id=self._new_ids(len(frame)) if ids is None else ids.astype(np.int64),
+            day=parse_days(frame["Date"].to_numpy()),
+            cents=parse_cents(frame["Amount"].to_numpy()),
+            type_code=self.types.encode_many(frame["Type"].to_numpy()),
+            account_code=self.accounts.encode_many(frame["Account"].to_numpy()),
+            category_code=self.categories.encode_many(frame["Source/Category"].to_numpy()),
+            notes_code=self.notes.encode_many(frame["Notes"].to_numpy()),
+        )
+
+    @traced
+    def append_ledger(self, other, positions=None, ids=None):
+        # Codes are remapped through this ledger's pools. Takes the rows at
+        # positions, by default every live one, under ids, by default theirs.
+        live = positions if positions is not None else other.positions() if other.dead else slice(None)
+        self._append_columns(
+            id=other.id[live] if ids is None else ids,
+            day=other.day[live],
+            cents=other.cents[live],
+            type_code=self.types.encode_many(other.types.values)[other.type_code[live]],
+            account_code=self.accounts.encode_many(other.accounts.values)[other.account_code[live]],
+            category_code=self.categories.encode_many(other.categories.values)[other.category_code[live]],
+            notes_code=self.notes.encode_many(other.notes.values)[other.notes_code[live]],
+        )
+
+    def append_new(self, other):
+        # other's live rows as new rows, numbered after this ledger's
+        self.append_ledger(other, ids=self._new_ids(len(other) - other.dead))
+
+    @traced
+    def append_rows(self, rows, ids=None):
+        # rows are [Date, Type, Account, Amount, Source/Category, Notes] lists
+        encoded = [self._encode_row(row) for row in rows]
+        columns = {name: [row[i] for row in encoded] for i, name in enumerate(self.VALUES)}
+        self._append_columns(id=self._new_ids(len(rows)) if ids is None else ids, **columns)
+
+    @traced
+    def restore(self, ids, rows):
+        # Brings deleted rows back under their old ids: tombstones are
+        # revived in place, rows already compacted away are appended. Returns
+        # their positions.
+        positions = [self._tombstones.pop(row_id, None) for row_id in ids]
+        revived = [position for position in positions if position is not None]
+        self._arrays["live"][revived] = True
+        self.dead -= len(revived)
+        if self._position is not None:
+            self._position.update((int(self._arrays["id"][position]), position) for position in revived)
+        missing = [index for index, position in enumerate(positions) if position is None]
+        if missing:
+            # rows is a list of row_values lists or a Ledger
+            first = self.size
+            if isinstance(rows, Ledger):
+                self.append_ledger(rows, missing, [ids[index] for index in missing])
+            else:
+                self.append_rows([rows[index] for index in missing], [ids[index] for index in missing])
+            for offset, index in enumerate(missing):
+                positions[index] = first + offset
+        return positions
+
+    def assign_ids(self, positions, ids):
+        # Renumbers rows, for storage that hands out its own ids
+        positions = np.asarray(positions, dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        # An id held by another row, live or waiting in a tombstone for undo,
+        # would make the two indistinguishable
+        renumbered = set(self._arrays["id"][positions].tolist())
+        taken = [row_id for row_id in ids.tolist() if row_id in self._tombstones
+                 or (row_id not in renumbered and self.position_of(row_id) is not None)]
+        if taken:
+            raise ValueError(f"ids already in use: {taken[:10]}")
+        if self._position is not None:
+            for old in self._arrays["id"][positions].tolist():
+                self._position.pop(old, None)
+            self._position.update(zip(ids.tolist(), positions.tolist()))
+        self._arrays["id"][positions] = ids
+        if len(ids):
+            self.next_id = max(self.next_id, int(ids.max()) + 1)
+
+    def set_row(self, position, values):
+        # values maps COLUMNS names to display values, like get_updated_data()
+        encoded = self._encode_row([values[name] for name in COLUMNS])
+        for name, value in zip(self.VALUES, encoded):
+            self._arrays[name][position] = value
+
+    @traced
+    def delete(self, positions):
+        # Tombstones the rows; their slots are reclaimed by compact()
+        positions = np.asarray(positions, dtype=np.int64)
+        positions = np.unique(positions[self._arrays["live"][positions]])
+        ids = self._arrays["id"][positions].tolist()
+        # A second tombstone under one id would decide which row restore revives
+        collisions = [row_id for row_id in ids if row_id in self._tombstones]
+        if collisions:
+            raise ValueError(f"ids already deleted: {collisions[:10]}")
+        self._arrays["live"][positions] = False
+        self.dead += len(positions)
+        self._tombstones.update(zip(ids, positions.tolist()))
+        if self._position is not None:
+            for row_id in ids:
+                del self._position[row_id]
+
+    def needs_compaction(self):
+        return self.dead > max(COMPACT_MIN_DEAD, self.size // 4)
+
+    @traced
+    def compact(self):
+        # Drops the dead rows. Returns the mask of rows kept, for anything
+        # else indexed by position, or None when there was nothing to drop.
+        if not self.dead:
+            return None
+        keep = self.live.copy()
+        for name, array in self._arrays.items():
+            self._arrays[name] = array[:self.size][keep]
+        self.size = len(self._arrays["id"])
+        self.dead = 0
+        self._position = None
+        self._tombstones = {}
+        return keep
+
+    def copy(self):
+        # Arrays are copied; the append-only pools are shared
+        other = Ledger.__new__(Ledger)
+        other.types, other.accounts, other.categories, other.notes = self.types, self.accounts, self.categories, self.notes
+        other._arrays = {name: array[:self.size].copy() for name, array in self._arrays.items()}
+        other.size = self.size
+        other.dead = self.dead
+        other.next_id = self.next_id
+        other._position = None
+        other._tombstones = dict(self._tombstones)
+        return other
+
+    def row(self, position):
+        return dict(zip(COLUMNS, self.row_values(position)))
+
+    def row_values(self, position):
+        return [
+            format_day(self._arrays["day"][position]),
+            self.types[self._arrays["type_code"][position]],
+            self.accounts[self._arrays["account_code"][position]],
+            int(self._arrays["cents"][position]) / 100,
+            self.categories[self._arrays["category_code"][position]],
+            self.notes[self._arrays["notes_code"][position]],
+        ]
+
+    def cell_text(self, column, position):
+        if column == DATE_COLUMN:
+            return format_day(self._arrays["day"][position])
+        if column == AMOUNT_COLUMN:
+            return format_cents(self._arrays["cents"][position])
+        pool, codes = self._pooled(column)
+        return pool[codes[position]]
+
+    @traced
+    def to_frame(self):
+        # Display form (ISO dates, float amounts) of the live rows, with their
+        # ids; used to write CSV
+        positions = self.positions()
+        return pd.DataFrame({
+            ID_COLUMN: self.id[positions],
+            "Date": format_days(self.day[positions]),
+            "Type": _decode(self.types, self.type_code[positions]),
+            "Account": _decode(self.accounts, self.account_code[positions]),
+            "Amount": self.cents[positions] / 100,
+            "Source/Category": _decode(self.categories, self.category_code[positions]),
+            "Notes": _decode(self.notes, self.notes_code[positions]),
+        }, columns=[ID_COLUMN] + COLUMNS)
+
+    def nbytes(self):
+        # Column storage for the live rows plus the pooled strings
+        strings = sum(sys.getsizeof(value) for pool in (self.types, self.accounts, self.categories, self.notes)
+                      for value in pool.values)
+        return self.size * self.ROW_BYTES + strings
+
+    def bytes_per_row(self):
+        return self.nbytes() / self.size if self.size else float(self.ROW_BYTES)
+
+    def _pooled(self, column):
+        name = COLUMNS[column]
+        if name == "Type":
+            return self.types, self._arrays["type_code"]
+        if name == "Account":
+            return self.accounts, self._arrays["account_code"]
+        if name == "Source/Category":
+            return self.categories, self._arrays["category_code"]
+        return self.notes, self._arrays["notes_code"]
+
+    def _encode_row(self, row):
+        date, _type, account, amount, category, notes = row
+        return (parse_day(date), parse_amount(amount), self.types.encode(_type), self.accounts.encode(account),
+                self.categories.encode(category), self.notes.encode(notes))
+
+    def _new_ids(self, count):
+        return np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+
+    def _append_columns(self, **columns):
+        count = len(columns["day"])
+        columns["live"] = True
+        if self.size + count > len(self._arrays["day"]):
+            capacity = max(2 * len(self._arrays["day"]), self.size + count, 64)
+            for name, array in self._arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self._arrays[name] = grown
+        for name, values in columns.items():
+            self._arrays[name][self.size:self.size + count] = values
+        ids = self._arrays["id"][self.size:self.size + count]
+        if count:
+            self.next_id = max(self.next_id, int(ids.max()) + 1)
+        if self._position is not None:
+            self._position.update(zip(ids.tolist(), range(self.size, self.size + count)))
+        self.size += count
+
+
+def parse_day(value):
+    try:
+        day = np.datetime64(str(value)[:10], "D")
+    except ValueError:
+        date = pd.to_datetime(value, errors="coerce")
+        return NO_DAY if pd.isna(date) else int(np.datetime64(date.date(), "D").astype(np.int64))
+    return NO_DAY if np.isnat(day) else int(day.astype(np.int64))
+
+
+def parse_days(values):
+    try:
+        # Fast path: everything is already ISO yyyy-mm-dd
+        days = np.asarray(values, dtype="datetime64[D]")
+        if not np.isnat(days).any():
+            return days.astype(np.int64).astype(np.int32)
+    except (TypeError, ValueError):
+        pass
+    # ISO dates among bad ones are still parsed in one pass; whatever is
+    # left is tried again with the format inferred, so a single bad value
+    # does not send the whole column through dateutil
+    values = pd.Series(values)
+    dates = pd.to_datetime(values, format="ISO8601", errors="coerce")
+    retry = dates.isna() & values.notna() & (values.astype(str).str.strip() != "")
+    if retry.any():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            dates[retry] = pd.to_datetime(values[retry], errors="coerce")
+    days = dates.to_numpy().astype("datetime64[D]").astype(np.int64)
+    return np.where(dates.isna().to_numpy(), NO_DAY, days).astype(np.int32)
+
+
+def parse_amount(value):
+    # Exact decimal rounding for single values typed by the user
+    try:
+        return int((Decimal(str(value)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return 0
+
+
+def parse_cents(values):
+    amounts = pd.to_numeric(pd.Series(values), errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+    return np.round(amounts * 100).astype(np.int64)
+
+
+def format_day(day):
+    return "" if day == NO_DAY else str(EPOCH + int(day))
+
+
+def format_days(days):
+    text = (EPOCH + days.astype("timedelta64[D]")).astype(str).astype(object)
+    text[days == NO_DAY] = ""
+    return text
+
+
+def format_cents(cents):
+    cents = int(cents)
+    sign = "-" if cents < 0 else ""
+    whole, part = divmod(abs(cents), 100)
+    return f"{sign}{whole}.{part:02d}"
+
+
+def month_of(days):
+    # Months since 1970-01 of day numbers
+    return np.asarray(days).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def month_start(months):
+    # Day number of the first of each month
+    return np.asarray(months).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+
+
+def add_months(days, months):
+    # The same day of the month some months on, or that month's last day when
+    # it is shorter
+    days = np.asarray(days, dtype=np.int64)
+    target = month_of(days) + months
+    first = month_start(target)
+    return first + np.minimum(days - month_start(month_of(days)), month_start(target + 1) - first - 1)
+
+
+def _decode(pool, codes):
+    return np.array(pool.values, dtype=object)[codes] if len(pool) else np.empty(len(codes), dtype=object)
+
+
+def _text(value):
+    if value is None or value != value:  # None / NaN
+        return ""
+    return str(value)
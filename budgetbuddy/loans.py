@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+
+from budgetbuddy.ledger import NO_DAY, add_months, parse_days
+from budgetbuddy.profiling import traced
+from budgetbuddy.storage import open_database
+
+# Amortization schedules for the loan table. A loan is repaid in level
+# monthly payments, plus any extra payment on top, starting a month after
+# its start_date. The balance after k payments has a closed form, so the
+# schedules of all loans are computed together as flat arrays with one
+# entry per payment, grouped by loan.
+
+
+class Loans:
+    # One entry per loan as column arrays. interest_rate is the annual rate in
+    # percent; extra is paid on top of every payment, in cents
+    def __init__(self, ids, accounts, cents, rates, terms, start_days, extra=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.accounts = list(accounts)
+        self.cents = np.asarray(cents, dtype=np.int64)
+        self.rates = np.asarray(rates, dtype=np.float64)
+        self.terms = np.asarray(terms, dtype=np.int64)
+        self.start_day = np.asarray(start_days, dtype=np.int64)
+        self.extra = np.zeros(len(self.ids), dtype=np.int64) if extra is None else np.asarray(extra, dtype=np.int64)
+        self.valid = (self.cents > 0) & (self.terms > 0) & (self.rates >= 0) & (self.start_day != NO_DAY)
+
+    @classmethod
+    def from_rows(cls, rows, extra=None):
+        # rows are (id, account, amount, interest_rate, term_months, start_date)
+        rows = list(rows)
+        if not rows:
+            return cls([], [], [], [], [], [])
+        ids, accounts, amounts, rates, terms, dates = zip(*rows)
+        cents = np.round(np.asarray(amounts, dtype=np.float64) * 100).astype(np.int64)
+        extra = None if extra is None else [extra.get(loan_id, 0) for loan_id in ids]
+        return cls(ids, accounts, cents, rates, terms, parse_days(np.asarray(dates, dtype=object)), extra)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Schedule:
+    # Every payment of every loan; loan i's are offsets[i]:offsets[i + 1], in
+    # order. Amounts are cents and balance is what is owed after the payment.
+    def __init__(self, loans, offsets, level, number, day, payment, interest, principal, balance):
+        self.loans = loans
+        self.offsets = offsets
+        self.level = level
+        self.number, self.day = number, day
+        self.payment, self.interest, self.principal, self.balance = payment, interest, principal, balance
+
+    def __len__(self):
+        return len(self.day)
+
+    def of(self, index):
+        # One loan's schedule as a dict of column arrays
+        rows = slice(self.offsets[index], self.offsets[index + 1])
+        return {"level": int(self.level[index]), "number": self.number[rows], "day": self.day[rows],
+                "payment": self.payment[rows], "interest": self.interest[rows],
+                "principal": self.principal[rows], "balance": self.balance[rows]}
+
+
+@traced
+def amortize(loans):
+    # Schedules for all loans at once; invalid loans get no payments
+    count = len(loans)
+    valid = loans.valid
+    rate = np.where(valid, loans.rates, 0) / 1200
+    owed = np.where(valid, loans.cents, 0).astype(np.float64)
+    terms = np.where(valid, loans.terms, 1)
+
+    # Level payment that clears the loan in term_months, rounded up to a
+    # whole cent so the last payment is never more than the others
+    with np.errstate(divide="ignore", invalid="ignore"):
+        level = np.ceil(np.where(rate > 0, owed * rate / -np.expm1(-terms * np.log1p(rate)), owed / terms))
+    paid = level + np.where(valid, loans.extra, 0)
+    # Payments until nothing is owed, fewer than the term with extra paid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        months = np.where(rate > 0, -np.log1p(-owed * rate / paid) / np.log1p(rate), owed / paid)
+    counts = np.where(valid, np.minimum(np.ceil(np.nan_to_num(months) - 1e-9), terms), 0).astype(np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    # After k payments of paid the balance is owed * growth**k - paid * f,
+    # where f = (growth**k - 1) / rate, or just k without interest
+    loan = np.repeat(np.arange(count), counts)
+    number = np.arange(offsets[-1]) - offsets[:-1][loan] + 1
+    monthly = rate[loan]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = np.where(monthly > 0, np.expm1(number * np.log1p(monthly)) / monthly, number)
+    balance = np.maximum(np.round(owed[loan] * (1 + monthly * factor) - paid[loan] * factor), 0)
+    paying = counts > 0
+    balance[offsets[1:][paying] - 1] = 0  # the last payment settles any rounding
+    before = np.empty_like(balance)
+    before[1:] = balance[:-1]
+    before[offsets[:-1][paying]] = owed[paying]
+    interest = np.round(before * monthly)
+    principal = before - balance
+    day = add_months(loans.start_day[loan], number)
+    return Schedule(loans, offsets, level.astype(np.int64), number.astype(np.int32), day.astype(np.int32),
+                    (interest + principal).astype(np.int64), interest.astype(np.int64),
+                    principal.astype(np.int64), balance.astype(np.int64))
+
+
+class LoanBook:
+    # A user's loans with their schedules cached per loan. loan_revision says
+    # whether anything changed without reading the table; when it did, only
+    # the loans that were added or edited are amortized again. Changing a
+    # loan's extra payment counts as an edit of that loan.
+    def __init__(self, path="instance/finance_app.db", username="local"):
+        self.path = path
+        self.username = username
+        self.conn = None
+        self.extra = {}  # loan id -> extra cents per month
+        self._revision = None
+        self._rows = {}  # loan id -> (row, extra) its schedule was made from
+        self._schedules = {}  # loan id -> Schedule.of dict
+        self._status = None  # (day, rows) from the last status call
+
+    def set_extra(self, loan_id, cents):
+        self.extra[loan_id] = max(int(cents), 0)
+        self._revision = None
+
+    def schedules(self):
+        # {loan id: schedule dict}, up to date with the loan table
+        self._refresh()
+        return self._schedules
+
+    def status(self, day):
+        # One row per loan as of day: (id, account, amount, rate, term, level
+        # payment, extra, payments made, balance, interest paid, interest
+        # still to pay, payoff day), amounts in cents
+        self._refresh()
+        if self._status is not None and self._status[0] == day:
+            return self._status[1]
+        rows = []
+        for loan_id, ((_, account, amount, rate, term, _), extra) in self._rows.items():
+            schedule = self._schedules[loan_id]
+            made = int(np.searchsorted(schedule["day"], day, side="right"))
+            owed = int(schedule["balance"][made - 1]) if made else int(round(amount * 100))
+            paid_interest = int(schedule["interest"][:made].sum())
+            left_interest = int(schedule["interest"][made:].sum())
+            payoff = int(schedule["day"][-1]) if len(schedule["day"]) else NO_DAY
+            rows.append((loan_id, account, int(round(amount * 100)), rate, term, schedule["level"], extra, made,
+                         owed, paid_interest, left_interest, payoff))
+        self._status = (day, rows)
+        return rows
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _refresh(self):
+        conn = self._connect()
+        if conn is None:
+            return
+        row = conn.execute("SELECT r.revision FROM loan_revision r JOIN user u ON u.id = r.user_id"
+                           " WHERE u.username = ?", (self.username,)).fetchone()
+        revision = row[0] if row else 0
+        if revision == self._revision:
+            return
+        rows = {row[0]: (row, self.extra.get(row[0], 0)) for row in conn.execute(
+            "SELECT l.id, a.account_type, l.amount, l.interest_rate, l.term_months, l.start_date"
+            " FROM loan l JOIN account a ON a.id = l.account_id JOIN user u ON u.id = a.user_id"
+            " WHERE u.username = ? ORDER BY l.id", (self.username,))}
+        stale = [loan_id for loan_id, key in rows.items() if self._rows.get(loan_id) != key]
+        if stale:
+            loans = Loans.from_rows([rows[loan_id][0] for loan_id in stale], self.extra)
+            schedule = amortize(loans)
+            for index, loan_id in enumerate(stale):
+                self._schedules[loan_id] = schedule.of(index)
+        for loan_id in self._rows.keys() - rows.keys():
+            del self._schedules[loan_id]
+        self._rows = rows
+        self._revision = revision
+        self._status = None
+
+    def _connect(self):
+        if self.conn is None and os.path.exists(self.path):
+            self.conn = open_database(self.path)
+        return self.conn
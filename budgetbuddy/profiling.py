@@ -0,0 +1,150 @@
+import atexit
+import inspect
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+# Named timing spans around the hot paths (FinanceTracker operations,
+# storage calls, search/rollup updates, chart drawing). Off unless the
+# environment variable is set when this module is first imported:
+#
+#   BUDGETBUDDY_TRACE=trace.json python main.py
+#
+# On exit the spans are written to that file in Chrome trace format (open it
+# in chrome://tracing or https://ui.perfetto.dev), with per-span counts and
+# latency histograms under "otherData". "{pid}" in the path is replaced by
+# the process id, for runs that fork workers.
+#
+# When tracing is off, traced() returns the function itself and span()
+# returns a shared do-nothing context manager, so the cost is one call.
+
+TRACE_ENV = "BUDGETBUDDY_TRACE"
+MAX_EVENTS = 500_000  # past this only counts and histograms are kept
+
+
+class Recorder:
+    def __init__(self, path):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = {}
+        self.stats = {}  # name -> [count, total seconds, max seconds, {bucket: count}]
+        self.dropped = 0
+
+    def record(self, name, start, end):
+        duration = end - start
+        # Bucket b holds spans shorter than 2**b microseconds
+        bucket = int(duration * 1e6).bit_length()
+        thread = threading.get_ident()
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = [0, 0.0, 0.0, {}]
+            stat[0] += 1
+            stat[1] += duration
+            stat[2] = max(stat[2], duration)
+            stat[3][bucket] = stat[3].get(bucket, 0) + 1
+            if thread not in self.threads:
+                self.threads[thread] = threading.current_thread().name
+            if len(self.events) < MAX_EVENTS:
+                self.events.append((name, start, duration, thread))
+            else:
+                self.dropped += 1
+
+    def summary(self):
+        with self.lock:
+            stats = {name: (count, total, longest, dict(histogram))
+                     for name, (count, total, longest, histogram) in self.stats.items()}
+        return {
+            name: {
+                "count": count,
+                "total_ms": total * 1000,
+                "mean_ms": total * 1000 / count,
+                "max_ms": longest * 1000,
+                "histogram_us": {str(2 ** bucket): histogram[bucket] for bucket in sorted(histogram)},
+            }
+            for name, (count, total, longest, histogram) in sorted(stats.items())
+        }
+
+    def trace(self):
+        pid = os.getpid()
+        with self.lock:
+            events, threads, dropped = list(self.events), dict(self.threads), self.dropped
+        trace_events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}}
+                        for thread, name in threads.items()]
+        trace_events += [{"name": name, "ph": "X", "pid": pid, "tid": thread,
+                          "ts": (start - self.origin) * 1e6, "dur": duration * 1e6}
+                         for name, start, duration, thread in events]
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms",
+                "otherData": {"spans": self.summary(), "dropped_events": dropped}}
+
+    def write(self, path=None):
+        path = (path or self.path).replace("{pid}", str(os.getpid()))
+        with open(path, "w") as handle:
+            json.dump(self.trace(), handle)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _recorder.record(self.name, self.start, time.perf_counter())
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_recorder = Recorder(os.environ[TRACE_ENV]) if os.environ.get(TRACE_ENV) else None
+if _recorder is not None:
+    atexit.register(_recorder.write)
+
+
+def enabled():
+    return _recorder is not None
+
+
+def span(name):
+    return _NULL_SPAN if _recorder is None else _Span(name)
+
+
+def traced(function):
+    # Decorator: one span per call, named after the function's qualified name
+    if _recorder is None:
+        return function
+    name = function.__qualname__
+    code = function.__code__
+    # Qt hands every signal argument to a connected slot and only drops the
+    # extras when it can see the slot's own signature, so the wrapper drops
+    # them the same way
+    positional = None if code.co_flags & inspect.CO_VARARGS else code.co_argcount
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args[:positional], **kwargs)
+        finally:
+            _recorder.record(name, start, time.perf_counter())
+    return wrapper
+
+
+def summary():
+    return {} if _recorder is None else _recorder.summary()
@@ -0,0 +1,154 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from budgetbuddy.indexes import period_bounds
+from budgetbuddy.ledger import NO_DAY, format_cents
+from budgetbuddy.storage import CsvStorage
+
+# Headless weekly/monthly statements, one per transactions.csv:
+#
+#   python -m budgetbuddy.report students/ --format json --output reports.json
+#
+# Directories are searched recursively for transactions.csv. Each ledger is
+# summarized by its own task in a process pool and only the small summary
+# comes back to the parent, which writes everything as CSV or JSON.
+
+PERIODS = ("weekly", "monthly")
+PERIOD_FREQS = {"weekly": "W", "monthly": "M"}  # as period_bounds names them
+CSV_FIELDS = ["ledger", "section", "key", "income", "expense", "net", "count"]
+
+
+def summarize_ledger(ledger, periods=PERIODS):
+    income = ledger.type_code == ledger.types.code_of.get("Income", -1)
+    expense = ledger.type_code == ledger.types.code_of.get("Expense", -1)
+    dated = ledger.day != NO_DAY
+    days = ledger.day[dated]
+    summary = {"rows": len(ledger)}
+    for period in periods:
+        summary[period] = []
+        if len(days):
+            # Periods are cut the same way as the window's summary table
+            bounds, labels = period_bounds(PERIOD_FREQS[period], int(days.min()), int(days.max()) + 1)
+            keys = np.searchsorted(bounds, days, side="right") - 1
+            summary[period] = _group(keys, income[dated], expense[dated], ledger.cents[dated], labels.__getitem__)
+    summary["categories"] = _group(ledger.category_code, income, expense, ledger.cents, ledger.categories.__getitem__)
+    summary["balances"] = _group(ledger.account_code, income, expense, ledger.cents, ledger.accounts.__getitem__)
+    summary["balance"] = _totals(income, expense, ledger.cents)
+    return summary
+
+
+def summarize_file(path, periods=PERIODS):
+    # Process pool task; errors are reported per ledger so one bad file does
+    # not stop the run
+    try:
+        return {"ledger": path, **summarize_ledger(CsvStorage(path).load(), periods)}
+    except Exception as error:
+        return {"ledger": path, "error": f"{type(error).__name__}: {error}"}
+
+
+def find_ledgers(paths, name="transactions.csv"):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                if name in files:
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def run(paths, periods=PERIODS, workers=None, chunksize=None):
+    # Returns (summaries in input order, seconds taken)
+    paths = list(paths)
+    start = time.perf_counter()
+    if workers == 1:
+        summaries = [summarize_file(path, periods) for path in paths]
+    else:
+        workers = workers or os.cpu_count() or 1
+        chunksize = chunksize or max(1, len(paths) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            summaries = list(pool.map(summarize_file, paths, [periods] * len(paths), chunksize=chunksize))
+    return summaries, time.perf_counter() - start
+
+
+def write_json(summaries, handle):
+    json.dump(summaries, handle, indent=1)
+    handle.write("\n")
+
+
+def write_csv(summaries, handle):
+    writer = csv.DictWriter(handle, fieldnames=CSV_FIELDS + ["error"], extrasaction="ignore")
+    writer.writeheader()
+    for summary in summaries:
+        if "error" in summary:
+            writer.writerow({"ledger": summary["ledger"], "section": "error", "error": summary["error"]})
+            continue
+        for section in PERIODS + ("categories", "balances"):
+            for entry in summary.get(section, ()):
+                writer.writerow({"ledger": summary["ledger"], "section": section, **entry})
+        writer.writerow({"ledger": summary["ledger"], "section": "balance", "key": "", **summary["balance"]})
+
+
+WRITERS = {"json": write_json, "csv": write_csv}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m budgetbuddy.report",
+                                     description="Weekly/monthly summaries, category breakdowns and balances")
+    parser.add_argument("paths", nargs="+", help="ledger CSV files or directories holding transactions.csv")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--output", "-o", help="output file (default: stdout)")
+    parser.add_argument("--period", choices=PERIODS, action="append", help="periods to summarize (default: both)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, help="ledgers handed to a worker at a time")
+    args = parser.parse_args(argv)
+
+    periods = tuple(args.period) if args.period else PERIODS
+    summaries, elapsed = run(find_ledgers(args.paths), periods, args.workers, args.chunksize)
+    if args.output:
+        with open(args.output, "w", newline="") as handle:
+            WRITERS[args.format](summaries, handle)
+    else:
+        WRITERS[args.format](summaries, sys.stdout)
+
+    failed = sum("error" in summary for summary in summaries)
+    rate = len(summaries) / elapsed if elapsed else 0.0
+    print(f"{len(summaries)} ledgers in {elapsed:.2f}s ({rate:.1f} ledgers/s), {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _group(keys, income, expense, cents, label):
+    if not len(keys):
+        return []
+    groups, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    income_cents = _sum(inverse, np.where(income, cents, 0), len(groups))
+    expense_cents = _sum(inverse, np.where(expense, cents, 0), len(groups))
+    counts = np.bincount(inverse, minlength=len(groups))
+    return [{"key": label(key), **_amounts(int(inc), int(exp)), "count": int(count)}
+            for key, inc, exp, count in zip(groups, income_cents, expense_cents, counts)]
+
+
+def _totals(income, expense, cents):
+    return {**_amounts(int(cents[income].sum()), int(cents[expense].sum())), "count": int(len(cents))}
+
+
+def _sum(inverse, cents, size):
+    totals = np.zeros(size, dtype=np.int64)
+    np.add.at(totals, inverse, cents)
+    return totals
+
+
+def _amounts(income, expense):
+    return {"income": format_cents(income), "expense": format_cents(expense), "net": format_cents(income - expense)}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import numpy as np
+
+from budgetbuddy.ledger import NO_DAY
+from budgetbuddy.profiling import traced
+
+NO_MONTH = np.iinfo(np.int64).min
+
+
+class Rollups:
+    # Running totals in cents per (type, month), (type, category) and
+    # (type, account). Built once from the ledger; after that every
+    # add/edit/delete applies its delta directly so the charts never regroup
+    # the whole ledger. Totals are reported in dollars.
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.by_month = {}
+        self.by_category = {}
+        self.by_account = {}
+
+    @traced
+    def build(self):
+        self.by_month, self.by_category, self.by_account = {}, {}, {}
+        self.add_rows(self.ledger.positions())
+
+    @traced
+    def add_rows(self, positions):
+        self._apply(np.asarray(positions, dtype=np.int64), 1)
+
+    @traced
+    def remove_rows(self, positions):
+        self._apply(np.asarray(positions, dtype=np.int64), -1)
+
+    def monthly(self, _type):
+        return self._report(self.by_month, _type)
+
+    def categories(self, _type):
+        return self._report(self.by_category, _type)
+
+    def accounts(self, _type):
+        return self._report(self.by_account, _type)
+
+    def _report(self, totals, _type):
+        return sorted((key, cents / 100) for (kind, key), (cents, _) in totals.items() if kind == _type)
+
+    def _apply(self, positions, sign):
+        if not len(positions):
+            return
+        ledger = self.ledger
+        types = ledger.type_code[positions].astype(np.int64)
+        cents = ledger.cents[positions]
+        days = ledger.day[positions]
+        months = np.where(days == NO_DAY, NO_MONTH, days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64))
+        for totals, keys, label in ((self.by_month, months, _month_label),
+                                    (self.by_category, ledger.category_code[positions], ledger.categories.__getitem__),
+                                    (self.by_account, ledger.account_code[positions], ledger.accounts.__getitem__)):
+            # Group the batch by (type, key) first, then touch one dict entry per group
+            distinct_keys, key_index = np.unique(keys, return_inverse=True)
+            groups, inverse = np.unique(types * len(distinct_keys) + key_index.ravel(), return_inverse=True)
+            inverse = inverse.ravel()
+            sums = np.zeros(len(groups), dtype=np.int64)
+            np.add.at(sums, inverse, cents)
+            counts = np.bincount(inverse, minlength=len(groups))
+            for combined, total, count in zip(groups, sums, counts):
+                type_code, key = divmod(int(combined), len(distinct_keys))
+                key = distinct_keys[key]
+                group = (ledger.types[type_code], label(key))
+                entry = totals.setdefault(group, [0, 0])
+                entry[0] += sign * int(total)
+                entry[1] += sign * int(count)
+                if entry[1] == 0:
+                    del totals[group]
+
+
+def _month_label(month):
+    return "" if month == NO_MONTH else str(np.datetime64(int(month), "M"))
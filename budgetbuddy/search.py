@@ -0,0 +1,169 @@
+import numpy as np
+
+from budgetbuddy.ledger import format_cents, format_day
+from budgetbuddy.profiling import traced
+
+
+class _PooledColumn:
+    # Text columns are already dictionary-encoded by the ledger, so the index
+    # only keeps the lowered text of each pool entry and reads the ledger's
+    # own codes.
+    def __init__(self, ledger, codes, pool):
+        self.ledger = ledger
+        self.name = codes
+        self.pool = pool
+        self._texts = []
+
+    @property
+    def texts(self):
+        if len(self._texts) < len(self.pool):
+            self._texts.extend(value.lower() for value in self.pool.values[len(self._texts):])
+        return self._texts
+
+    @property
+    def codes(self):
+        return getattr(self.ledger, self.name)
+
+    @traced
+    def build(self):
+        pass
+
+    def append(self, count):
+        pass
+
+    def set(self, position):
+        pass
+
+    def compact(self, keep):
+        pass
+
+
+class _ValueColumn:
+    # Date and Amount get codes of their own into the distinct values'
+    # display text, so a query is still matched once per distinct value.
+    def __init__(self, ledger, name, format_value):
+        self.ledger = ledger
+        self.name = name
+        self.format_value = format_value
+        self.texts = []
+        self.code_of = {}
+        self._codes = np.empty(0, dtype=np.int32)
+        self.size = 0
+
+    @property
+    def codes(self):
+        return self._codes[:self.size]
+
+    @traced
+    def build(self):
+        self.texts, self.code_of = [], {}
+        self._codes = np.empty(0, dtype=np.int32)
+        self.size = 0
+        self.append(len(self.ledger))
+
+    def append(self, count):
+        values = getattr(self.ledger, self.name)[len(self.ledger) - count:]
+        if self.size + count > len(self._codes):
+            grown = np.empty(max(2 * len(self._codes), self.size + count, 64), dtype=np.int32)
+            grown[:self.size] = self._codes[:self.size]
+            self._codes = grown
+        uniques, inverse = np.unique(values, return_inverse=True)
+        mapping = np.array([self._encode(value) for value in uniques], dtype=np.int32)
+        self._codes[self.size:self.size + count] = mapping[inverse]
+        self.size += count
+
+    def set(self, position):
+        self._codes[position] = self._encode(getattr(self.ledger, self.name)[position])
+
+    def compact(self, keep):
+        # Follows Ledger.compact; dead rows keep their codes until then
+        self._codes = self._codes[:self.size][keep]
+        self.size = len(self._codes)
+
+    def _encode(self, value):
+        value = int(value)
+        code = self.code_of.get(value)
+        if code is None:
+            code = len(self.texts)
+            self.texts.append(self.format_value(value).lower())
+            self.code_of[value] = code
+        return code
+
+
+class SearchIndex:
+    # Substring search over every column of the ledger, kept up to date on
+    # add/edit/delete. A query is matched against distinct cell texts only and
+    # expanded to rows with a vectorized lookup on the codes; when it extends
+    # the previous query, only the previous hits are re-checked.
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.columns = [
+            _ValueColumn(ledger, "day", format_day),
+            _PooledColumn(ledger, "type_code", ledger.types),
+            _PooledColumn(ledger, "account_code", ledger.accounts),
+            _ValueColumn(ledger, "cents", format_cents),
+            _PooledColumn(ledger, "category_code", ledger.categories),
+            _PooledColumn(ledger, "notes_code", ledger.notes),
+        ]
+        self._last_query = None
+        self._last_hits = None
+        self._last_codes = None
+
+    @traced
+    def build(self):
+        for index in self.columns:
+            index.build()
+        self._forget()
+
+    def append(self, count):
+        for index in self.columns:
+            index.append(count)
+        self._forget()
+
+    def update(self, position):
+        for index in self.columns:
+            index.set(position)
+        self._forget()
+
+    def remove(self, positions):
+        # Deleted rows stay in the ledger as tombstones and are skipped
+        self._forget()
+
+    def restore(self, positions):
+        self._forget()
+
+    def compact(self, keep):
+        for index in self.columns:
+            index.compact(keep)
+        self._forget()
+
+    @traced
+    def search(self, query):
+        query = query.lower()
+        narrowing = self._last_query is not None and query.startswith(self._last_query)
+        hits = self._last_hits if narrowing else None
+        matched_codes = []
+        match = np.zeros(len(self.ledger) if hits is None else len(hits), dtype=bool)
+        for column, index in enumerate(self.columns):
+            texts = index.texts
+            candidates = self._last_codes[column] if narrowing else range(len(texts))
+            codes = [code for code in candidates if query in texts[code]]
+            matched_codes.append(codes)
+            if not codes:
+                continue
+            column_codes = index.codes if hits is None else index.codes[hits]
+            match |= _lookup(codes, len(texts))[column_codes]
+        hits = np.flatnonzero(match) if hits is None else hits[match]
+        if self.ledger.dead:
+            hits = hits[self.ledger.live[hits]]
+        self._last_query, self._last_hits, self._last_codes = query, hits, matched_codes
+        return hits
+
+    def _forget(self):
+        self._last_query = self._last_hits = self._last_codes = None
+
+
+def _lookup(codes, size):
+    table = np.zeros(size, dtype=bool)
+    table[codes] = True
+    return table
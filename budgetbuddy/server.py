@@ -0,0 +1,491 @@
+import argparse
+import asyncio
+import base64
+import getpass
+import hashlib
+import hmac
+import json
+import math
+import secrets
+import string
+import sys
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from budgetbuddy.columns import COLUMNS, ID_COLUMN
+from budgetbuddy.indexes import BalanceIndex, DateIndex
+from budgetbuddy.ledger import NO_DAY, Ledger, format_cents, parse_day
+from budgetbuddy.storage import SqliteStorage, open_database
+
+# Local multi-user HTTP API over instance/finance_app.db:
+#
+#   python -m budgetbuddy.server --port 8765
+#   python -m budgetbuddy.server --create-user alice
+#
+# Every request authenticates with HTTP Basic against the user table
+# (werkzeug-style pbkdf2/scrypt hashes). Endpoints, all JSON:
+#
+#   GET  /api/transactions?start=&end=&type=&account=&search=&limit=&offset=
+#        streamed as a chunked JSON array, one indexed keyset query per page
+#   POST /api/transactions   {"date", "type", "account", "amount", "category", "notes"}
+#   GET  /api/balances?date=  per-account and total balance at the end of date
+#   GET  /api/summary?period=weekly|monthly|quarterly|custom&start=&end=
+#
+# Balances and summaries come from a per-user Ledger with BalanceIndex and
+# DateIndex, cached until that user's ledger_revision changes. Database work
+# runs on worker threads through a bounded connection pool so the event loop
+# only ever waits on sockets.
+
+POOL_SIZE = 4
+STREAM_BATCH = 500
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+AUTH_CACHE_SECONDS = 300
+PERIODS = {"weekly": "W", "monthly": "M", "quarterly": "Q"}
+TYPES = ("Income", "Expense")
+SALT_CHARS = string.ascii_letters + string.digits
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ConnectionPool:
+    # At most size connections, opened on demand; callers queue for a free one
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.opened = 0
+        self._idle = asyncio.Queue()
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._idle.empty() and self.opened < self.size:
+            self.opened += 1
+            try:
+                conn = await asyncio.to_thread(open_database, self.path)
+            except BaseException:
+                self.opened -= 1
+                raise
+        else:
+            conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    async def run(self, function, *args):
+        # function(conn, *args) on a worker thread
+        async with self.connection() as conn:
+            return await asyncio.to_thread(function, conn, *args)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+            self.opened -= 1
+
+
+class UserAggregates:
+    # One user's ledger with its balance and date indexes, tagged with the
+    # ledger_revision it was built at
+    def __init__(self, revision, ledger):
+        self.revision = revision
+        self.ledger = ledger
+        self.balances = BalanceIndex(ledger)
+        self.balances.build()
+        self.dates = DateIndex(ledger)
+        self.dates.build()
+
+    def append(self, revision, row, row_id):
+        self.ledger.append_rows([row], [row_id])
+        self.balances.add_rows([len(self.ledger) - 1])
+        self.dates.add_rows([len(self.ledger) - 1])
+        self.revision = revision
+
+
+class LedgerServer:
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.pool = ConnectionPool(path, pool_size)
+        self.aggregates = {}  # user_id -> UserAggregates
+        self._building = {}  # user_id -> lock, so concurrent misses build once
+        self._users = {}  # (username, sha256 of password) -> (user_id, verified at)
+        self.routes = {
+            ("GET", "/api/transactions"): self.list_transactions,
+            ("POST", "/api/transactions"): self.add_transaction,
+            ("GET", "/api/balances"): self.get_balances,
+            ("GET", "/api/summary"): self.get_summary,
+        }
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                keep_alive = request["headers"].get("connection", "").lower() != "close"
+                await self.respond(request, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except HTTPError as error:
+            await send_json(writer, error.status, {"error": error.message}, keep_alive=False)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, request, writer, keep_alive):
+        try:
+            handler = self.routes.get((request["method"], request["path"]))
+            if handler is None:
+                if any(path == request["path"] for _, path in self.routes):
+                    raise HTTPError(405, "method not allowed")
+                raise HTTPError(404, "not found")
+            user_id = await self.authenticate(request["headers"].get("authorization"))
+            await handler(user_id, request, writer, keep_alive)
+        except HTTPError as error:
+            headers = {"WWW-Authenticate": 'Basic realm="BudgetBuddy"'} if error.status == 401 else {}
+            await send_json(writer, error.status, {"error": error.message}, keep_alive, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as error:
+            await send_json(writer, 500, {"error": f"{type(error).__name__}: {error}"}, keep_alive)
+
+    async def authenticate(self, authorization):
+        if not authorization or not authorization.startswith("Basic "):
+            raise HTTPError(401, "authentication required")
+        try:
+            username, password = base64.b64decode(authorization[6:]).decode("utf-8").split(":", 1)
+        except (ValueError, UnicodeDecodeError):
+            raise HTTPError(401, "malformed credentials")
+        # Password hashes are deliberately slow, so a verified login is
+        # remembered for a while under a digest of the password
+        key = (username, hashlib.sha256(password.encode("utf-8")).digest())
+        cached = self._users.get(key)
+        if cached is not None and time.monotonic() - cached[1] < AUTH_CACHE_SECONDS:
+            return cached[0]
+        row = await self.pool.run(
+            lambda conn: conn.execute("SELECT id, password_hash FROM user WHERE username = ?", (username,)).fetchone())
+        if row is None or not await asyncio.to_thread(verify_password, row[1], password):
+            raise HTTPError(401, "invalid username or password")
+        self._users[key] = (row[0], time.monotonic())
+        return row[0]
+
+    async def user_aggregates(self, user_id):
+        revision = await self.pool.run(_revision, user_id)
+        cached = self.aggregates.get(user_id)
+        if cached is not None and cached.revision == revision:
+            return cached
+        lock = self._building.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            cached = self.aggregates.get(user_id)
+            if cached is None or cached.revision != revision:
+                cached = self.aggregates[user_id] = await self.pool.run(_build_aggregates, user_id)
+        return cached
+
+    async def list_transactions(self, user_id, request, writer, keep_alive):
+        # Streamed a page at a time. Each page is one keyset query on a pooled
+        # connection that goes back to the pool before the page is sent, so
+        # slow clients never hold a connection while the socket drains.
+        where, params, limit, offset = _transactions_sql(user_id, request["query"])
+        # Fetching and encoding both happen off the event loop
+        body, after, count = await self.pool.run(_fetch_page, where, params, None, _page_size(limit), offset)
+        await start_chunked(writer, 200, keep_alive)
+        try:
+            separator = b"["
+            while body:
+                await write_chunk(writer, separator + body)
+                separator = b","
+                if limit is not None:
+                    limit -= count
+                if count < STREAM_BATCH or limit == 0:
+                    break
+                body, after, count = await self.pool.run(_fetch_page, where, params, after, _page_size(limit), 0)
+            await write_chunk(writer, b"[]" if separator == b"[" else b"]")
+            await end_chunked(writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as error:
+            # The status line is already out, so the error cannot be reported;
+            # cutting the connection tells the client the body is incomplete
+            writer.transport.abort()
+            raise ConnectionAbortedError(f"transaction stream failed: {error}") from error
+
+    async def add_transaction(self, user_id, request, writer, keep_alive):
+        try:
+            record = json.loads(request["body"] or b"{}")
+            row = [record["date"], record["type"], record["account"], float(record["amount"]),
+                   record.get("category", ""), record.get("notes", "")]
+        except (ValueError, KeyError, TypeError) as error:
+            raise HTTPError(400, f"bad transaction: {error}")
+        if parse_day(row[0]) == NO_DAY:
+            raise HTTPError(400, "bad transaction: date must be YYYY-MM-DD")
+        if row[1] not in TYPES:
+            raise HTTPError(400, f"bad transaction: type must be one of {', '.join(TYPES)}")
+        if not math.isfinite(row[3]) or row[3] < 0:
+            raise HTTPError(400, "bad transaction: amount must be a finite number, not negative")
+        transaction_id, before, after = await self.pool.run(_insert_transaction, user_id, row)
+        cached = self.aggregates.get(user_id)
+        if cached is not None and cached.revision == before and after == before + 1:
+            # Nobody else wrote in between, so extend the cache instead of dropping it
+            cached.append(after, row, transaction_id)
+        await send_json(writer, 201, {"id": transaction_id}, keep_alive)
+
+    async def get_balances(self, user_id, request, writer, keep_alive):
+        day = _query_day(request["query"], "date")
+        aggregates = await self.user_aggregates(user_id)
+        accounts = {account: format_cents(cents) for account, cents in aggregates.balances.balances(day)}
+        total = format_cents(aggregates.balances.balance(day=day))
+        await send_json(writer, 200, {"date": request["query"].get("date"), "total": total, "accounts": accounts},
+                        keep_alive)
+
+    async def get_summary(self, user_id, request, writer, keep_alive):
+        query = request["query"]
+        period = query.get("period", "monthly")
+        start, end = _query_day(query, "start"), _query_day(query, "end")
+        aggregates = await self.user_aggregates(user_id)
+        if period == "custom":
+            if start is None or end is None:
+                raise HTTPError(400, "custom summaries need start and end")
+            summary = aggregates.dates.summary(start, end)
+            result = {**_amounts(summary["income"], summary["expense"]), "count": summary["count"],
+                      "categories": [{"type": _type, "category": category, "amount": format_cents(cents)}
+                                     for (_type, category), cents in sorted(summary["categories"].items())]}
+        elif period in PERIODS:
+            result = {"periods": [{"period": label, **_amounts(income, expense), "count": count}
+                                  for label, _, _, income, expense, count
+                                  in aggregates.dates.periods(PERIODS[period], start, end)]}
+        else:
+            raise HTTPError(400, f"unknown period {period!r}")
+        await send_json(writer, 200, {"period": period, **result}, keep_alive)
+
+
+async def read_request(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as error:
+        if not error.partial.strip():
+            return None  # client closed between requests
+        raise
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "request header too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length") or "0"
+    if not (length.isascii() and length.isdigit()):
+        raise HTTPError(400, "Content-Length must be a whole number of bytes")
+    length = int(length)
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "request body too large")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+    return {"method": method, "path": url.path, "query": query, "headers": headers, "body": body}
+
+
+async def send_json(writer, status, document, keep_alive=True, headers=None):
+    body = json.dumps(document).encode("utf-8")
+    head = _head(status, keep_alive, {"Content-Type": "application/json", "Content-Length": str(len(body)),
+                                      **(headers or {})})
+    writer.write(head + body)
+    await writer.drain()
+
+
+async def start_chunked(writer, status, keep_alive):
+    writer.write(_head(status, keep_alive, {"Content-Type": "application/json", "Transfer-Encoding": "chunked"}))
+
+
+async def write_chunk(writer, data):
+    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+    await writer.drain()  # back-pressure from slow clients
+
+
+async def end_chunked(writer):
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def _head(status, keep_alive, headers):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def verify_password(stored, password):
+    # werkzeug.security hashes: "pbkdf2:sha256:600000$salt$hex" or
+    # "scrypt:32768:8:1$salt$hex"; anything else (like "!") never matches
+    try:
+        method, salt, expected = stored.split("$", 2)
+        name, *params = method.split(":")
+        if name == "pbkdf2":
+            hash_name = params[0] if params else "sha256"
+            iterations = int(params[1]) if len(params) > 1 else 600000
+            actual = hashlib.pbkdf2_hmac(hash_name, password.encode("utf-8"), salt.encode("utf-8"), iterations)
+        elif name == "scrypt":
+            n, r, p = (int(value) for value in params) if params else (32768, 8, 1)
+            actual = hashlib.scrypt(password.encode("utf-8"), salt=salt.encode("utf-8"), n=n, r=r, p=p,
+                                    maxmem=132 * n * r * p)
+        else:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual.hex(), expected)
+
+
+def hash_password(password, iterations=600000):
+    salt = "".join(secrets.choice(SALT_CHARS) for _ in range(16))
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), iterations).hex()
+    return f"pbkdf2:sha256:{iterations}${salt}${digest}"
+
+
+def create_user(path, username, password):
+    conn = open_database(path)
+    with conn:
+        conn.execute("INSERT INTO user (username, password_hash) VALUES (?, ?) "
+                     "ON CONFLICT (username) DO UPDATE SET password_hash = excluded.password_hash",
+                     (username, hash_password(password)))
+    conn.close()
+
+
+def _revision(conn, user_id):
+    row = conn.execute("SELECT revision FROM ledger_revision WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def _build_aggregates(conn, user_id):
+    # Read in one transaction so the rows match the revision
+    with conn:
+        conn.execute("BEGIN")
+        revision = _revision(conn, user_id)
+        rows = conn.execute(SqliteStorage.SELECT_ROWS + " WHERE a.user_id = ? ORDER BY t.id", (user_id,)).fetchall()
+    ledger = Ledger.from_frame(pd.DataFrame(rows, columns=[ID_COLUMN] + COLUMNS)) if rows else Ledger()
+    return UserAggregates(revision, ledger)
+
+
+def _insert_transaction(conn, user_id, row):
+    date, _type, account, amount, category, notes = row
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        before = _revision(conn, user_id)
+        account_row = conn.execute("SELECT id FROM account WHERE user_id = ? AND account_type = ?",
+                                   (user_id, account)).fetchone()
+        if account_row is None:
+            account_id = conn.execute("INSERT INTO account (user_id, account_type, name, balance) VALUES (?, ?, ?, 0)",
+                                      (user_id, account, account)).lastrowid
+        else:
+            account_id = account_row[0]
+        transaction_id = conn.execute(
+            'INSERT INTO "transaction" (account_id, amount, date, description, transaction_type, category) VALUES (?, ?, ?, ?, ?, ?)',
+            (account_id, amount, str(date)[:10], notes, _type, category)).lastrowid
+        after = _revision(conn, user_id)
+    return transaction_id, before, after
+
+
+def _transactions_sql(user_id, query):
+    # (where clause, its params, limit or None, offset) for a listing
+    where, params = ["a.user_id = ?"], [user_id]
+    for name, clause in (("type", "t.transaction_type = ?"), ("account", "a.account_type = ?"),
+                         ("start", "t.date >= ?"), ("end", "t.date < ?")):
+        if query.get(name):
+            where.append(clause)
+            params.append(query[name])
+    if query.get("search"):
+        # The text is matched literally, so % and _ in it are escaped
+        where.append("(t.description LIKE ? ESCAPE '\\' OR t.category LIKE ? ESCAPE '\\')")
+        params += [f"%{_escape_like(query['search'])}%"] * 2
+    try:
+        limit = int(query["limit"]) if query.get("limit") else None
+        offset = int(query.get("offset") or 0)
+    except ValueError:
+        raise HTTPError(400, "limit and offset must be integers")
+    if (limit is not None and limit < 0) or offset < 0:
+        raise HTTPError(400, "limit and offset must not be negative")
+    return " AND ".join(where), params, limit, offset
+
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _page_size(limit):
+    return STREAM_BATCH if limit is None else min(STREAM_BATCH, limit)
+
+
+def _fetch_page(conn, where, params, after, size, offset):
+    # Up to size rows ordered by (date, id) after the key after, as JSON
+    # objects separated by commas, with the last row's key and the row count
+    if after is not None:
+        where, params = f"{where} AND (t.date, t.id) > (?, ?)", params + list(after)
+    batch = conn.execute(SqliteStorage.SELECT_ROWS + f" WHERE {where} ORDER BY t.date, t.id LIMIT ? OFFSET ?",
+                         params + [size, offset]).fetchall()
+    if not batch:
+        return b"", after, 0
+    document = [{"id": transaction_id, "date": date, "type": _type, "account": account, "amount": amount,
+                 "category": category, "notes": notes}
+                for transaction_id, date, _type, account, amount, category, notes in batch]
+    return json.dumps(document)[1:-1].encode("utf-8"), (batch[-1][1], batch[-1][0]), len(batch)
+
+
+def _query_day(query, name):
+    if not query.get(name):
+        return None
+    day = parse_day(query[name])
+    if day == NO_DAY:
+        raise HTTPError(400, f"{name} must be YYYY-MM-DD")
+    return day
+
+
+def _amounts(income, expense):
+    return {"income": format_cents(income), "expense": format_cents(expense), "net": format_cents(income - expense)}
+
+
+async def _main(args):
+    server = LedgerServer(args.db, args.pool_size)
+    listener = await server.serve(args.host, args.port)
+    print(f"serving {args.db} on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m budgetbuddy.server")
+    parser.add_argument("--db", default="instance/finance_app.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE, help="SQLite connections shared by all requests")
+    parser.add_argument("--create-user", metavar="USERNAME", help="add a user (or reset their password) and exit")
+    args = parser.parse_args(argv)
+
+    if args.create_user:
+        create_user(args.db, args.create_user, getpass.getpass(f"Password for {args.create_user}: "))
+        return 0
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
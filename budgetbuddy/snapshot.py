@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from budgetbuddy.ledger import Ledger, StringPool
+from budgetbuddy.profiling import traced
+
+# Binary columnar snapshot of a ledger, so reopening it parses nothing. A
+# snapshot is a directory holding
+#
+#   <column>.npy            one file per Ledger column, live rows only
+#   <pool>.blob             a string pool's values, UTF-8, joined by NUL
+#   <pool>.offsets.npy      int64 start of each value in the blob, plus one
+#                           past the end of the last
+#   meta.json               format version, row count and next id
+#
+# Columns are opened with np.load(mmap_mode="c"): nothing is read until a
+# page is touched, and writes stay private to the process. The blobs are
+# small beside the columns since each distinct string is stored once.
+# Snapshots are written to <path>.tmp and renamed into place, so a path that
+# exists always holds a complete snapshot.
+
+FORMAT_VERSION = 1
+SNAPSHOT_COLUMNS = [name for name in Ledger.DTYPES if name != "live"]
+POOLS = ["types", "accounts", "categories", "notes"]
+
+
+@traced
+def write_snapshot(ledger, path):
+    partial = path + ".tmp"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    positions = ledger.positions()
+    for name in SNAPSHOT_COLUMNS:
+        _write(os.path.join(partial, name + ".npy"), lambda handle: np.save(handle, getattr(ledger, name)[positions]))
+    for name in POOLS:
+        encoded = [value.encode("utf-8") for value in getattr(ledger, name).values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) + 1 for value in encoded], out=offsets[1:])
+        _write(os.path.join(partial, name + ".blob"), lambda handle: handle.write(b"\0".join(encoded)))
+        _write(os.path.join(partial, name + ".offsets.npy"), lambda handle: np.save(handle, offsets))
+    meta = {"version": FORMAT_VERSION, "rows": len(positions), "next_id": ledger.next_id}
+    _write(os.path.join(partial, "meta.json"), lambda handle: handle.write(json.dumps(meta).encode("utf-8")))
+    os.replace(partial, path)
+
+
+@traced
+def read_snapshot(path):
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as handle:
+        meta = json.load(handle)
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported snapshot version {meta.get('version')!r}")
+    # Empty files cannot be mapped
+    mode = "c" if meta["rows"] else None
+    arrays = {}
+    for name in SNAPSHOT_COLUMNS:
+        array = np.load(os.path.join(path, name + ".npy"), mmap_mode=mode)
+        if array.dtype != Ledger.DTYPES[name] or len(array) != meta["rows"]:
+            raise ValueError(f"{path}: {name} column does not match the ledger layout")
+        arrays[name] = array
+    pools = [StringPool(_read_pool(path, name)) for name in POOLS]
+    return Ledger.from_arrays(arrays, pools, meta["next_id"])
+
+
+def _read_pool(path, name):
+    offsets = np.load(os.path.join(path, name + ".offsets.npy"))
+    if len(offsets) < 2:
+        return []
+    with open(os.path.join(path, name + ".blob"), "rb") as handle:
+        blob = handle.read()
+    # One split is much faster than slicing per value; it is only wrong when
+    # a value itself holds a NUL, which the count gives away
+    values = blob.decode("utf-8").split("\0")
+    if len(values) != len(offsets) - 1:
+        values = [blob[start:end - 1].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    return values
+
+
+def _write(path, write):
+    with open(path, "wb") as handle:
+        write(handle)
+        handle.flush()
+        os.fsync(handle.fileno())
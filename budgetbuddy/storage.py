@@ -0,0 +1,783 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from budgetbuddy.columns import COLUMNS, ID_COLUMN
+from budgetbuddy.indexes import period_bounds
+from budgetbuddy.ledger import NO_DAY, Ledger, format_day, parse_days
+from budgetbuddy.profiling import span, traced
+from budgetbuddy.snapshot import read_snapshot, write_snapshot
+
+FIRST_CHUNK_ROWS = 2000
+CHUNK_ROWS = 25000
+WRITE_DELAY = 0.5  # seconds CsvStorage waits for more changes before writing
+
+
+class CsvStorage:
+    # The original format: the whole ledger in one CSV. An ID column is
+    # written ahead of the others; files without one get ids numbered from
+    # their first row.
+    #
+    # Changes are written by a BackgroundWriter, so the GUI thread only pays
+    # for copying the ledger's arrays. Edits within write_delay of each other
+    # become one write, and the file is replaced atomically, so a crash
+    # leaves either the old ledger or the new one, never half of either.
+    def __init__(self, path="transactions.csv", write_delay=WRITE_DELAY):
+        self.path = path
+        self.writer = BackgroundWriter(self._write, write_delay)
+
+    @traced
+    def load(self):
+        return Ledger.from_frame(pd.read_csv(self.path))
+
+    def iter_chunks(self, first_rows=FIRST_CHUNK_ROWS, rows=CHUNK_ROWS):
+        # Yields (ledger, fraction of the file read); a small first chunk gets
+        # something on screen quickly
+        size = os.path.getsize(self.path)
+        with open(self.path, "rb") as handle:
+            reader = pd.read_csv(handle, iterator=True)
+            chunk_rows = first_rows
+            read = 0
+            while True:
+                with span("CsvStorage.read_chunk"):
+                    try:
+                        chunk = Ledger.from_frame(reader.get_chunk(chunk_rows), first_id=read + 1)
+                    except StopIteration:
+                        break
+                read += len(chunk)
+                yield chunk, handle.tell() / size if size else 1.0
+                chunk_rows = rows
+
+    @traced
+    def save(self, ledger):
+        self.writer.submit(ledger.copy())
+
+    def add(self, ledger, count):
+        self.save(ledger)
+
+    def restore(self, ledger, positions):
+        self.save(ledger)
+
+    def edit(self, ledger, position):
+        self.save(ledger)
+
+    def delete(self, ledger, positions):
+        self.save(ledger)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def sidecar_path(self, name):
+        # Where a file derived from this ledger, such as an index, is kept
+        return os.path.splitext(self.path)[0] + "." + name
+
+    @traced
+    def _write(self, ledger):
+        write_atomically(self.path, lambda handle: ledger.to_frame().to_csv(handle, index=False))
+
+
+class BackgroundWriter:
+    # Runs write(state) on a thread of its own. submit() hands over the
+    # latest state and returns at once; whatever is submitted while an
+    # earlier state waits out delay replaces it, so a burst of changes is
+    # written once. flush() blocks until everything submitted is on disk, or
+    # raises why it could not be written; a state that failed to write is
+    # kept and tried again on the next submit or flush.
+    def __init__(self, write, delay=WRITE_DELAY):
+        self.write = write
+        self.delay = delay
+        self._condition = threading.Condition()
+        self._pending = None
+        self._due = None  # monotonic time the pending state is written at; None waits for a flush
+        self._writing = False
+        self._error = None
+        self._closed = False
+        self._thread = None
+
+    def submit(self, state):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            if self._pending is None or self._due is None:
+                # The window runs from the first change, so steady edits
+                # still reach the disk every delay seconds
+                self._due = time.monotonic() + self.delay
+            self._pending = state
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="BackgroundWriter", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    @traced
+    def flush(self):
+        with self._condition:
+            self._error = None
+            self._due = time.monotonic()
+            self._condition.notify_all()
+            while (self._pending is not None or self._writing) and self._error is None:
+                self._condition.wait()
+            error = self._error
+        if error is not None:
+            raise error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            if self._thread is not None:
+                self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None or self._due is None or time.monotonic() < self._due:
+                    if self._closed:
+                        return
+                    waiting = self._pending is None or self._due is None
+                    self._condition.wait(None if waiting else self._due - time.monotonic())
+                state, self._pending = self._pending, None
+                self._writing = True
+            try:
+                self.write(state)
+            except Exception as error:
+                with self._condition:
+                    self._error = error
+                    if self._pending is None:
+                        # Parked until the next change or flush rather than retried in a loop
+                        self._pending, self._due = state, None
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+def write_atomically(path, write):
+    # write(handle) fills a temporary file next to path, which is synced and
+    # then renamed over path
+    partial = path + ".tmp"
+    with open(partial, "w", encoding="utf-8", newline="") as handle:
+        write(handle)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(partial, path)
+
+
+class JournalStorage:
+    # Appends one record per add/edit/delete instead of rewriting the ledger.
+    # Records name rows by id; journals from before ids were kept name them
+    # by position and still replay.
+    #
+    # The directory holds snapshot-<gen>.cols directories (see snapshot.py)
+    # and journal-<gen>.jsonl segments. Snapshot <gen> contains every change
+    # from segments older than <gen>, so loading is the newest snapshot plus a
+    # replay of the segments from its generation on. Once the live segment
+    # grows past compact_every records a new segment is started and the
+    # snapshot is written on a background thread; older files are removed
+    # only after it is in place.
+    #
+    # Snapshots are memory-mapped on load, so reopening costs the same
+    # however long the ledger is. snapshot-<gen>.csv files from before the
+    # binary format still load, and a ledger read from CSV is snapshotted
+    # straight away so the next start does not parse it again.
+    def __init__(self, directory="transactions.journal", legacy_csv="transactions.csv", compact_every=5000):
+        self.directory = directory
+        self.legacy_csv = legacy_csv
+        self.compact_every = compact_every
+        self.generation = 0
+        self.records = 0
+        self._journal = None
+        self._compaction = None
+
+    @traced
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots = self._snapshots()
+        segments = self._generations("journal-", ".jsonl")
+        parsed = False
+        if snapshots:
+            base, path = snapshots[-1]
+            if path.endswith(".csv"):
+                ledger = Ledger.from_frame(pd.read_csv(path))
+                parsed = True
+            else:
+                ledger = read_snapshot(path)
+            self._remove_older(base)
+        elif os.path.exists(self.legacy_csv):
+            base = 0
+            ledger = Ledger.from_frame(pd.read_csv(self.legacy_csv))
+            parsed = True
+        elif segments:
+            base = 0
+            ledger = Ledger()
+        else:
+            raise FileNotFoundError(self.directory)
+
+        self.records = 0
+        for generation in segments:
+            if generation >= base:
+                self.records = _replay(ledger, self._journal_path(generation))
+        self.generation = max([base] + segments)
+        self._open_journal()
+        if parsed:
+            self._compact(ledger)
+        return ledger
+
+    def iter_chunks(self, first_rows=FIRST_CHUNK_ROWS, rows=CHUNK_ROWS):
+        # Journal replay needs the whole snapshot in memory anyway
+        yield self.load(), 1.0
+
+    @traced
+    def save(self, ledger):
+        # A full save is a compaction that doesn't wait for the threshold
+        self._compact(ledger)
+
+    @traced
+    def add(self, ledger, count):
+        positions = range(len(ledger) - count, len(ledger))
+        self._append({"op": "add", "ids": ledger.id[positions].tolist(),
+                      "rows": [ledger.row_values(position) for position in positions]}, ledger)
+
+    @traced
+    def restore(self, ledger, positions):
+        self._append({"op": "restore", "ids": ledger.id[positions].tolist(),
+                      "rows": [ledger.row_values(position) for position in positions]}, ledger)
+
+    @traced
+    def edit(self, ledger, position):
+        self._append({"op": "edit", "id": int(ledger.id[position]), "row": ledger.row_values(position)}, ledger)
+
+    @traced
+    def delete(self, ledger, positions):
+        self._append({"op": "delete", "ids": ledger.id[positions].tolist()}, ledger)
+
+    def flush(self):
+        # Records are written as they come; make sure the segment is on disk
+        if self._journal is not None:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def sidecar_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _append(self, record, ledger):
+        if self._journal is None:
+            # A first change to a journal that did not exist when loaded
+            self._open_journal()
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        self.records += 1
+        if self.records >= self.compact_every:
+            self._compact(ledger)
+
+    @traced
+    def _compact(self, ledger):
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        # Everything up to here belongs to the snapshot; later records go to
+        # a fresh segment so the writer thread never races the UI.
+        snapshot = ledger.copy()
+        self.generation += 1
+        if self._journal is not None:
+            self._journal.close()
+        self._open_journal()
+        self.records = 0
+        self._compaction = threading.Thread(target=self._write_snapshot, args=(snapshot, self.generation), daemon=True)
+        self._compaction.start()
+
+    @traced
+    def _write_snapshot(self, snapshot, generation):
+        write_snapshot(snapshot, self._snapshot_path(generation))
+        self._remove_older(generation)
+
+    def _remove_older(self, generation):
+        # Files the snapshot of generation makes redundant. One the loaded
+        # ledger still maps cannot be removed on Windows; it is tried again
+        # after the next snapshot.
+        try:
+            for old, path in self._snapshots():
+                if old < generation:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+            for old in self._generations("journal-", ".jsonl"):
+                if old < generation:
+                    os.remove(self._journal_path(old))
+        except OSError:
+            pass
+
+    def _snapshots(self):
+        # (generation, path) of binary and legacy CSV snapshots, oldest first
+        snapshots = [(generation, self._snapshot_path(generation)) for generation in self._generations("snapshot-", ".cols")]
+        snapshots += [(generation, os.path.join(self.directory, f"snapshot-{generation:06d}.csv"))
+                      for generation in self._generations("snapshot-", ".csv")]
+        return sorted(snapshots)
+
+    def _open_journal(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._journal_path(self.generation)
+        # Records appended after a torn line would be glued onto it and lost
+        # with it on the next replay
+        _drop_torn_line(path)
+        self._journal = open(path, "a", encoding="utf-8")
+
+    def _generations(self, prefix, suffix):
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                generations.append(int(name[len(prefix):-len(suffix)]))
+        return sorted(generations)
+
+    def _snapshot_path(self, generation):
+        return os.path.join(self.directory, f"snapshot-{generation:06d}.cols")
+
+    def _journal_path(self, generation):
+        return os.path.join(self.directory, f"journal-{generation:06d}.jsonl")
+
+
+@traced
+def _replay(ledger, path):
+    # Consecutive adds are batched so replaying a long run of them is one append
+    pending, pending_ids = [], []
+    records = 0
+    with open(path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # torn final line from a crash mid-append
+            records += 1
+            if record["op"] == "add":
+                # Adds from before ids were kept get the ids appending gives
+                first = ledger.next_id + len(pending)
+                pending.extend(record["rows"])
+                pending_ids.extend(record.get("ids", range(first, first + len(record["rows"]))))
+                continue
+            if pending:
+                ledger.append_rows(pending, pending_ids)
+                pending, pending_ids = [], []
+            # A record naming a row the ledger does not have (a hand-edited or
+            # mismatched segment) is skipped; applying it at position None
+            # would write every row
+            if record["op"] == "edit":
+                if "id" in record:
+                    position = ledger.position_of(record["id"])
+                    if position is None:
+                        _unknown_ids(path, records, "edit", [record["id"]])
+                        continue
+                else:
+                    position = _legacy_positions(ledger, record["position"])
+                ledger.set_row(position, dict(zip(COLUMNS, record["row"])))
+            elif record["op"] == "delete":
+                if "ids" in record:
+                    positions = [ledger.position_of(row_id) for row_id in record["ids"]]
+                    missing = [row_id for row_id, position in zip(record["ids"], positions) if position is None]
+                    if missing:
+                        _unknown_ids(path, records, "delete", missing)
+                        positions = [position for position in positions if position is not None]
+                else:
+                    positions = _legacy_positions(ledger, record["positions"])
+                ledger.delete(positions)
+            elif record["op"] == "restore":
+                ledger.restore(record["ids"], record["rows"])
+    if pending:
+        ledger.append_rows(pending, pending_ids)
+    ledger.compact()
+    return records
+
+
+def _drop_torn_line(path, block=64 * 1024):
+    # Truncates a segment to its last complete record
+    try:
+        handle = open(path, "r+b")
+    except FileNotFoundError:
+        return
+    with handle:
+        size = end = handle.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - block)
+            handle.seek(start)
+            newline = handle.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            handle.truncate(end)
+
+
+def _unknown_ids(path, record, op, ids):
+    warnings.warn(f"{path}: record {record} ({op}) names unknown ids {ids[:10]}; skipped")
+
+
+def _legacy_positions(ledger, positions):
+    # Records written before ids were kept give positions in a ledger
+    # without tombstones
+    ledger.compact()
+    return positions
+
+
+class SqliteStorage:
+    # Writes every change straight through to the "transaction" table of
+    # instance/finance_app.db. The schema there has no category column, so
+    # one is added; Notes live in "description" and Type in "transaction_type".
+    # Ledger ids are the rows' transaction.id.
+    #
+    # query(), summary() and periods() answer filters and summaries with
+    # indexed SQL, a page or one row per day at a time, without loading the
+    # table; the window uses them in place of its in-memory indexes when this
+    # backend is chosen. Dates are compared as the ISO text the ledger writes.
+    SELECT_ROWS = """
+        SELECT t.id, t.date, t.transaction_type, a.account_type, t.amount, t.category, t.description
+        FROM "transaction" t JOIN account a ON a.id = t.account_id
+    """
+
+    def __init__(self, path="instance/finance_app.db", username="local", legacy_csv="transactions.csv"):
+        self.path = path
+        self.username = username
+        self.legacy_csv = legacy_csv
+        self.conn = None
+        self.user_id = None
+        self._accounts = {}
+
+    def connect(self):
+        if self.conn is not None:
+            return self.conn
+        # The ledger is loaded on a worker thread and then used from the GUI
+        # thread; never concurrently
+        self.conn = open_database(self.path)
+        with self.conn:
+            row = self.conn.execute("SELECT id FROM user WHERE username = ?", (self.username,)).fetchone()
+            if row is None:
+                # Local desktop user; "!" is never a valid password hash
+                row = (self.conn.execute("INSERT INTO user (username, password_hash) VALUES (?, '!')", (self.username,)).lastrowid,)
+            self.user_id = row[0]
+        for account_id, account_type in self.conn.execute("SELECT id, account_type FROM account WHERE user_id = ?", (self.user_id,)):
+            self._accounts[account_type] = account_id
+        return self.conn
+
+    @traced
+    def load(self):
+        conn = self.connect()
+        rows = conn.execute(self.SELECT_ROWS + " WHERE a.user_id = ? ORDER BY t.id", (self.user_id,)).fetchall()
+        if not rows and os.path.exists(self.legacy_csv):
+            # First run against the database: move the CSV ledger over in one batch
+            ledger = Ledger.from_frame(pd.read_csv(self.legacy_csv))
+            ledger.assign_ids(ledger.positions(), self._insert(ledger.to_frame()[COLUMNS].to_numpy().tolist()))
+            return ledger
+        if not rows:
+            raise FileNotFoundError(self.path)
+        return Ledger.from_frame(pd.DataFrame(rows, columns=[ID_COLUMN] + COLUMNS))
+
+    def iter_chunks(self, first_rows=FIRST_CHUNK_ROWS, rows=CHUNK_ROWS):
+        conn = self.connect()
+        total = conn.execute('SELECT COUNT(*) FROM "transaction" t JOIN account a ON a.id = t.account_id WHERE a.user_id = ?',
+                             (self.user_id,)).fetchone()[0]
+        if not total:
+            yield self.load(), 1.0
+            return
+        cursor = conn.execute(self.SELECT_ROWS + " WHERE a.user_id = ? ORDER BY t.id", (self.user_id,))
+        chunk_rows = first_rows
+        read = 0
+        while True:
+            with span("SqliteStorage.read_chunk"):
+                batch = cursor.fetchmany(chunk_rows)
+                if not batch:
+                    break
+                chunk = Ledger.from_frame(pd.DataFrame(batch, columns=[ID_COLUMN] + COLUMNS))
+            read += len(batch)
+            yield chunk, read / total
+            chunk_rows = rows
+
+    @traced
+    def save(self, ledger):
+        # The old rows go in the same transaction as the new ones, so a failed
+        # save leaves the table as it was
+        frame = ledger.to_frame()
+        self._insert(frame[COLUMNS].to_numpy().tolist(), frame[ID_COLUMN].tolist(), replace=True)
+
+    @traced
+    def add(self, ledger, count):
+        # The database hands out the ids, never below the ones the ledger has
+        # given out: a deleted row's id stays with it for undo
+        positions = range(len(ledger) - count, len(ledger))
+        ledger.assign_ids(positions, self._insert([ledger.row_values(position) for position in positions],
+                                                  first_id=int(ledger.id[positions[0]]) if count else 1))
+
+    @traced
+    def restore(self, ledger, positions):
+        # Deleted rows go back under their old ids unless another writer has
+        # taken one since, in which case they get new ones
+        rows = [ledger.row_values(position) for position in positions]
+        try:
+            self._insert(rows, ledger.id[positions].tolist())
+        except sqlite3.IntegrityError:
+            ledger.assign_ids(positions, self._insert(rows, first_id=ledger.next_id))
+
+    @traced
+    def edit(self, ledger, position):
+        date, _type, account, amount, category, notes = ledger.row_values(position)
+        with self.connect():
+            self.conn.execute(
+                'UPDATE "transaction" SET date = ?, transaction_type = ?, account_id = ?, amount = ?, category = ?, description = ? WHERE id = ?',
+                (_sql_date(date), _type, self._account_id(account), amount, _sql_text(category), _sql_text(notes),
+                 int(ledger.id[position])))
+
+    @traced
+    def delete(self, ledger, positions):
+        with self.connect():
+            self.conn.executemany('DELETE FROM "transaction" WHERE id = ?', [(int(i),) for i in ledger.id[positions]])
+
+    def flush(self):
+        pass  # every change is committed as it is made
+
+    def sidecar_path(self, name):
+        # One database holds every user's rows, so the user is in the name
+        return os.path.join(os.path.dirname(self.path), f"{self.username}.{name}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    @traced
+    def query(self, transaction_type=None, account=None, start=None, end=None, rows=CHUNK_ROWS):
+        # The user's rows matching the filters, in (date, id) order, as
+        # Ledgers of up to rows rows. Each page is one keyset query, so only
+        # that page is ever in memory.
+        where, params = self._where(transaction_type, account, start, end)
+        after = []
+        while True:
+            batch = self.connect().execute(
+                self.SELECT_ROWS + " WHERE " + " AND ".join(where + ["(t.date, t.id) > (?, ?)"] * bool(after)) +
+                " ORDER BY t.date, t.id LIMIT ?", params + after + [rows]).fetchall()
+            if batch:
+                yield Ledger.from_frame(pd.DataFrame(batch, columns=[ID_COLUMN] + COLUMNS))
+            if len(batch) < rows:
+                return
+            after = [batch[-1][1], batch[-1][0]]
+
+    @traced
+    def summary(self, start, end):
+        # Same as DateIndex.summary, from one row per day, type and category
+        totals = self._day_totals(start, end, by_category=True)
+        income = int(totals["cents"][totals["type"] == "Income"].sum())
+        expense = int(totals["cents"][totals["type"] == "Expense"].sum())
+        breakdown = totals.groupby(["type", "category"])["cents"].sum()
+        return {"income": income, "expense": expense, "net": income - expense, "count": int(totals["rows"].sum()),
+                "categories": {key: int(cents) for key, cents in breakdown.items()}}
+
+    @traced
+    def periods(self, freq, start=None, end=None):
+        # Same as DateIndex.periods, from one row per day and type. Periods
+        # cover whole weeks, months or quarters, past start and end.
+        if start is None or end is None:
+            totals = self._day_totals(None, None)
+            if totals.empty:
+                return []
+            start = int(totals["day"].min()) if start is None else start
+            end = int(totals["day"].max()) + 1 if end is None else end
+            bounds, labels = period_bounds(freq, start, end)
+        else:
+            bounds, labels = period_bounds(freq, start, end)
+            totals = self._day_totals(int(bounds[0]), int(bounds[-1]))
+        totals = totals.sort_values("day", kind="stable")
+        # Days are sorted, so each period's total is a difference of running sums
+        cuts = np.searchsorted(totals["day"].to_numpy(), bounds)
+        cents = totals["cents"].to_numpy()
+        sums = {name: np.diff(np.concatenate([[0], np.cumsum(values)])[cuts]) for name, values in (
+            ("income", np.where(totals["type"] == "Income", cents, 0)),
+            ("expense", np.where(totals["type"] == "Expense", cents, 0)),
+            ("rows", totals["rows"].to_numpy()))}
+        return [(label, int(low), int(high), int(inc), int(exp), int(count))
+                for label, low, high, inc, exp, count
+                in zip(labels, bounds[:-1], bounds[1:], sums["income"], sums["expense"], sums["rows"])]
+
+    def _where(self, transaction_type, account, start, end):
+        # Clauses the (account_id, date) and transaction_type indexes answer
+        self.connect()
+        where, params = ["t.account_id IN (SELECT id FROM account WHERE user_id = ?)"], [self.user_id]
+        if account is not None:
+            where[0] = "t.account_id IN (SELECT id FROM account WHERE user_id = ? AND account_type = ?)"
+            params.append(account)
+        if transaction_type is not None:
+            where.append("t.transaction_type = ?")
+            params.append(transaction_type)
+        if start is not None:
+            where.append("t.date >= ?")
+            params.append(format_day(start))
+        if end is not None:
+            where.append("t.date < ?")
+            params.append(format_day(end))
+        return where, params
+
+    def _day_totals(self, start, end, by_category=False):
+        # Cents and row counts per day and type (and category) in [start,
+        # end); undated rows are left out, as DateIndex leaves them out
+        keys = "t.transaction_type, COALESCE(t.category, '')" if by_category else "t.transaction_type"
+        where, params = self._where(None, None, start, end)
+        grouped = self.conn.execute(
+            f"SELECT t.date, {keys}, SUM(CAST(ROUND(t.amount * 100) AS INTEGER)), COUNT(*)"
+            f' FROM "transaction" t WHERE {" AND ".join(where)} GROUP BY t.date, {keys}', params).fetchall()
+        totals = pd.DataFrame(grouped, columns=["day", "type", "category", "cents", "rows"] if by_category
+                              else ["day", "type", "cents", "rows"])
+        totals["day"] = parse_days(totals["day"].astype(str).to_numpy()) if len(totals) else np.array([], dtype=np.int32)
+        return totals[totals["day"] != NO_DAY]
+
+    @traced
+    def _insert(self, rows, ids=None, replace=False, first_id=1):
+        # Returns the rows' ids; given ids are used as they are, new ones are
+        # numbered from past the table's highest id and first_id. replace
+        # deletes the user's other rows first, in the same transaction.
+        conn = self.connect()
+        accounts = dict(self._accounts)
+        try:
+            with conn:
+                # IMMEDIATE holds the write lock, so nobody takes the new ids meanwhile
+                conn.execute("BEGIN IMMEDIATE")
+                if replace:
+                    conn.execute('DELETE FROM "transaction" WHERE account_id IN (SELECT id FROM account WHERE user_id = ?)',
+                                 (self.user_id,))
+                records = [(self._account_id(account), amount, _sql_date(date), _sql_text(notes), _type,
+                            _sql_text(category)) for date, _type, account, amount, category, notes in rows]
+                if ids is None:
+                    first = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM "transaction"').fetchone()[0]
+                    ids = range(max(first, first_id), max(first, first_id) + len(records))
+                conn.executemany(
+                    'INSERT INTO "transaction" (account_id, amount, date, description, transaction_type, category, id)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?)', [record + (int(i),) for record, i in zip(records, ids)])
+        except Exception:
+            self._accounts = accounts  # accounts made in the rolled back transaction are gone
+            raise
+        return list(ids)
+
+    def _account_id(self, account_type):
+        account_id = self._accounts.get(account_type)
+        if account_id is None:
+            account_id = self.conn.execute(
+                "INSERT INTO account (user_id, account_type, name, balance) VALUES (?, ?, ?, 0)",
+                (self.user_id, account_type, account_type)).lastrowid
+            self._accounts[account_type] = account_id
+        return account_id
+
+
+# account.balance is kept up to date by triggers, whoever writes the rows, and
+# ledger_revision.revision goes up on every change to a user's transactions
+# (subscription_revision and loan_revision likewise for subscriptions and loans)
+SIGNED_AMOUNT = "(CASE {row}.transaction_type WHEN 'Income' THEN {row}.amount WHEN 'Expense' THEN -{row}.amount ELSE 0 END)"
+BUMP_REVISION = """
+    INSERT INTO {table} (user_id, revision) SELECT user_id, 1 FROM account WHERE id = {row}.account_id
+    ON CONFLICT (user_id) DO UPDATE SET revision = revision + 1;"""
+TRIGGERS = {
+    "tr_transaction_balance_insert": f"""
+        AFTER INSERT ON "transaction" BEGIN
+            UPDATE account SET balance = ROUND(COALESCE(balance, 0) + {SIGNED_AMOUNT.format(row="NEW")}, 2) WHERE id = NEW.account_id;
+            {BUMP_REVISION.format(table="ledger_revision", row="NEW")}
+        END""",
+    "tr_transaction_balance_delete": f"""
+        AFTER DELETE ON "transaction" BEGIN
+            UPDATE account SET balance = ROUND(COALESCE(balance, 0) - {SIGNED_AMOUNT.format(row="OLD")}, 2) WHERE id = OLD.account_id;
+            {BUMP_REVISION.format(table="ledger_revision", row="OLD")}
+        END""",
+    "tr_transaction_balance_update": f"""
+        AFTER UPDATE ON "transaction" BEGIN
+            UPDATE account SET balance = ROUND(COALESCE(balance, 0) - {SIGNED_AMOUNT.format(row="OLD")}, 2) WHERE id = OLD.account_id;
+            UPDATE account SET balance = ROUND(COALESCE(balance, 0) + {SIGNED_AMOUNT.format(row="NEW")}, 2) WHERE id = NEW.account_id;
+            {BUMP_REVISION.format(table="ledger_revision", row="NEW")}
+        END""",
+    "tr_subscription_revision_insert": f"""
+        AFTER INSERT ON subscription BEGIN
+            {BUMP_REVISION.format(table="subscription_revision", row="NEW")}
+        END""",
+    "tr_subscription_revision_delete": f"""
+        AFTER DELETE ON subscription BEGIN
+            {BUMP_REVISION.format(table="subscription_revision", row="OLD")}
+        END""",
+    "tr_subscription_revision_update": f"""
+        AFTER UPDATE ON subscription BEGIN
+            {BUMP_REVISION.format(table="subscription_revision", row="OLD")}
+            {BUMP_REVISION.format(table="subscription_revision", row="NEW")}
+        END""",
+    "tr_loan_revision_insert": f"""
+        AFTER INSERT ON loan BEGIN
+            {BUMP_REVISION.format(table="loan_revision", row="NEW")}
+        END""",
+    "tr_loan_revision_delete": f"""
+        AFTER DELETE ON loan BEGIN
+            {BUMP_REVISION.format(table="loan_revision", row="OLD")}
+        END""",
+    "tr_loan_revision_update": f"""
+        AFTER UPDATE ON loan BEGIN
+            {BUMP_REVISION.format(table="loan_revision", row="OLD")}
+            {BUMP_REVISION.format(table="loan_revision", row="NEW")}
+        END""",
+}
+
+
+def open_database(path, timeout=5.0):
+    # Connection to finance_app.db with the columns, indexes and triggers the
+    # ledger code relies on. The connection may be handed between threads,
+    # but must only be used by one at a time.
+    conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    columns = [row[1] for row in conn.execute('PRAGMA table_info("transaction")')]
+    with conn:
+        if "category" not in columns:
+            conn.execute('ALTER TABLE "transaction" ADD COLUMN category VARCHAR(100)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_transaction_account_date ON "transaction" (account_id, date)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_transaction_type ON "transaction" (transaction_type)')
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_account_user ON account (user_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_subscription_account ON subscription (account_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_loan_account ON loan (account_id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS ledger_revision (user_id INTEGER PRIMARY KEY, revision INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS subscription_revision (user_id INTEGER PRIMARY KEY, revision INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS loan_revision (user_id INTEGER PRIMARY KEY, revision INTEGER NOT NULL)")
+        triggers = {row[0]: row[1] for row in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")}
+        if any(triggers.get(name) != f"CREATE TRIGGER {name} {body}" for name, body in TRIGGERS.items()):
+            had_balances = "tr_transaction_balance_insert" in triggers
+            for name, body in TRIGGERS.items():
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                conn.execute(f"CREATE TRIGGER {name} {body}")
+            if not had_balances:
+                # Balances were never maintained before; bring them up to date once
+                conn.execute(
+                    f'UPDATE account SET balance = ROUND((SELECT COALESCE(SUM({SIGNED_AMOUNT.format(row="t")}), 0)'
+                    ' FROM "transaction" t WHERE t.account_id = account.id), 2)')
+    return conn
+
+
+def _sql_date(value):
+    return str(value)[:10]
+
+
+def _sql_text(value):
+    return None if value is None or value != value else str(value)
+
+
+STORAGE_BACKENDS = {
+    "csv": CsvStorage,
+    "journal": JournalStorage,
+    "sqlite": SqliteStorage,
+}
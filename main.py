@@ -1,3 +1,6 @@
+import time
+START_TIME = time.perf_counter()  # reported by --profile-startup
+
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -8,23 +11,263 @@ from PyQt5.QtWidgets import (
     QDateEdit,
     QComboBox,
     QPushButton,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
+    QAbstractItemView,
     QFileDialog,
     QInputDialog,
     QDialog,
     QHeaderView,
     QMessageBox,
-    QTabWidget
+    QTabWidget,
+    QSizePolicy,
+    QProgressBar,
+    QTableWidget,
+    QTableWidgetItem,
+    QShortcut
+)
+from PyQt5.QtCore import (
+    QDate,
+    Qt,
+    QSettings,
+    QAbstractTableModel,
+    QModelIndex,
+    QObject,
+    QRunnable,
+    QThreadPool,
+    QTimer,
+    QThread,
+    QSemaphore,
+    pyqtSignal
 )
-from PyQt5.QtCore import QDate, Qt, QSettings
-from PyQt5.QtGui import QIcon, QFont
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
+from PyQt5.QtGui import QIcon, QFont, QImage, QPixmap, QKeySequence
+import numpy as np
+import argparse
+import math
 import sys
 
+from budgetbuddy.columns import COLUMNS, AMOUNT_COLUMN
+from budgetbuddy.history import History
+from budgetbuddy.profiling import traced
+
+# pandas, Matplotlib and the storage/index modules that pull them in are
+# imported on first use, after the window has painted.
+STORAGE_NAMES = ["csv", "journal", "sqlite"]
+STARTUP_TARGET_MS = 300
+SUMMARY_PERIODS = {"Weekly": "W", "Monthly": "M", "Quarterly": "Q", "Custom": None}
+FORECAST_DAYS = 365
+FINGERPRINTS_FILE = "fingerprints.npz"  # duplicate-detection index, kept beside the ledger
+LOAN_COLUMNS = ["Loan", "Account", "Amount", "Rate %", "Term", "Payment", "Extra / Month", "Paid", "Balance",
+                "Interest Paid", "Interest Left", "Payoff"]
+LOAN_EXTRA_COLUMN = LOAN_COLUMNS.index("Extra / Month")
+RULE_COLUMNS = ["Kind", "Pattern", "Type", "Low", "High", "Category"]
+
+
+class TransactionTableModel(QAbstractTableModel):
+    # Reads cells straight out of the ledger's column arrays. Qt only asks
+    # for the rows that are on screen, so nothing is formatted up front.
+    # Header clicks sort through a SortIndex, which keeps each column's
+    # order cached, so sorting or flipping direction never sorts the rows.
+    def __init__(self, ledger=None, parent=None):
+        super().__init__(parent)
+        self._ledger = ledger
+        self._rows = None  # positions into the ledger, None means every row
+        self._filtered = False
+        self._shown = None  # the rows set_ledger was given, before sorting
+        self._sort_index = None
+        self._sort_column = None  # COLUMNS name, None keeps ledger order
+        self._descending = False
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self._ledger is None:
+            return 0
+        if self._rows is None:
+            return len(self._ledger)
+        return len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = index.column()
+        if role == Qt.TextAlignmentRole and column == AMOUNT_COLUMN:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role != Qt.DisplayRole:
+            return None
+        return self._ledger.cell_text(column, self.source_row(index.row()))
+
+    def source_row(self, row):
+        # Map a view row to its position in the ledger
+        return row if self._rows is None else int(self._rows[row])
+
+    @traced
+    def set_ledger(self, ledger, rows=None):
+        # rows None shows every live row; deleted rows waiting for compaction
+        # are left out
+        self.beginResetModel()
+        self._ledger = ledger
+        self._filtered = rows is not None
+        self._shown = rows
+        self._arrange()
+        self.endResetModel()
+
+    def set_sort_index(self, sort_index):
+        # Takes effect with the next set_ledger
+        self._sort_index = sort_index
+
+    @traced
+    def sort(self, column, order=Qt.AscendingOrder):
+        # Called by the view on a header click; column -1 restores ledger order
+        self.beginResetModel()
+        self._sort_column = COLUMNS[column] if 0 <= column < len(COLUMNS) else None
+        self._descending = order == Qt.DescendingOrder
+        self._arrange()
+        self.endResetModel()
+
+    @traced
+    def append_rows(self, count):
+        # Called after the ledger grew by count rows. Only valid for the
+        # unfiltered, unsorted view; other views are re-queried.
+        first = self.rowCount()
+        self.beginInsertRows(QModelIndex(), first, first + count - 1)
+        if self._rows is not None:
+            self._rows = np.concatenate((self._rows, np.arange(len(self._ledger) - count, len(self._ledger))))
+        self.endInsertRows()
+
+    def is_filtered(self):
+        return self._filtered
+
+    def is_sorted(self):
+        return self._sort_column is not None
+
+    def _arrange(self):
+        ledger, rows = self._ledger, self._shown
+        if ledger is not None and self._sort_column is not None and self._sort_index is not None:
+            self._rows = self._sort_index.sorted(self._sort_column, self._descending, rows)
+        else:
+            self._rows = ledger.positions() if rows is None and ledger is not None and ledger.dead else rows
+
+
+class ChartView(QLabel):
+    # Shows a chart that was rasterized off the GUI thread
+    resized = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.setAlignment(Qt.AlignCenter)
+        # Don't let the pixmap drive the layout, or every render would resize us
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.setMinimumSize(1, 1)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized.emit()
+
+
+def render_balance_forecast(items, width, height):
+    # Runs on the chart thread, the only user of the forecast's connection
+    from budgetbuddy import charts
+
+    forecast, days, cents = items
+    _, projected = forecast.projected_balance(days, cents)
+    return charts.render_balance_forecast((days, cents, projected), width, height)
+
+
+class ChartRenderSignals(QObject):
+    finished = pyqtSignal(int, object, QImage)
+
+
+class ChartRenderTask(QRunnable):
+    # Draws one chart with Matplotlib's Agg backend on a worker thread and
+    # hands the finished image back to the GUI thread.
+    def __init__(self, generation, view, render, items, width, height):
+        super().__init__()
+        self.generation = generation
+        self.view = view
+        self.render = render
+        self.items = items
+        self.width = width
+        self.height = height
+        self.signals = ChartRenderSignals()
+
+    def run(self):
+        pixels, width, height = self.render(self.items, self.width, self.height)
+        image = QImage(pixels, width, height, QImage.Format_RGBA8888).copy()
+        self.signals.finished.emit(self.generation, self.view, image)
+
+
+class LedgerLoader(QThread):
+    # Streams the ledger in from storage in chunks; the GUI thread adds each
+    # chunk to the table and indexes as it arrives. Only one chunk is handed
+    # over at a time (see chunk_done) so the event loop gets to paint and
+    # handle input between chunks instead of draining a backlog of them.
+    chunk_loaded = pyqtSignal(object, float)
+    failed = pyqtSignal(str)
+
+    def __init__(self, storage, parent=None):
+        super().__init__(parent)
+        self.storage = storage
+        self.missing = False
+        self.error = None
+        self.ready = QSemaphore(1)
+
+    def chunk_done(self):
+        self.ready.release()
+
+    def run(self):
+        import sqlite3
+
+        from budgetbuddy.storage import STORAGE_BACKENDS
+
+        try:
+            if isinstance(self.storage, str):
+                self.storage = STORAGE_BACKENDS[self.storage]()
+            for chunk, progress in self.storage.iter_chunks():
+                while not self.ready.tryAcquire(1, 100):
+                    if self.isInterruptionRequested():
+                        return
+                self.chunk_loaded.emit(chunk, progress)
+        except FileNotFoundError:
+            self.missing = True
+        except KeyError as error:
+            self.error = f"no {error} column"
+            self.failed.emit(self.error)
+        except (OSError, ValueError, sqlite3.DatabaseError) as error:
+            # Unreadable, corrupt or locked data; the window says so
+            self.error = str(error) or type(error).__name__
+            self.failed.emit(self.error)
+
+
+class StatementImporter(QThread):
+    # Runs a StatementImport off the GUI thread, loading or building the
+    # fingerprint index first if there is none yet. The ledger must not
+    # change until it finishes; the window treats the import like a load.
+    rows_read = pyqtSignal(int)
+
+    def __init__(self, job, ledger, index_path, parent=None):
+        super().__init__(parent)
+        self.job = job
+        self.ledger = ledger
+        self.index_path = index_path
+        self.error = None
+
+    def run(self):
+        from budgetbuddy.importer import FingerprintIndex
+
+        try:
+            if self.job.fingerprints is None:
+                self.job.fingerprints = FingerprintIndex.open(self.index_path, self.ledger)
+            self.job.run(self.rows_read.emit)
+        except (OSError, ValueError) as error:
+            self.error = error
+
+
 class EditTransactionDialog(QDialog):
     def __init__(self, row):
         super().__init__()
@@ -71,20 +314,103 @@ class EditTransactionDialog(QDialog):
             "Notes": self.notes_edit.text()
         }
 
+class CategoryRulesDialog(QDialog):
+    # Edits the auto-categorization rules; the first rule that matches wins,
+    # so order matters
+    def __init__(self, rules, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Category Rules")
+        self.rules = rules
+        self.layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(RULE_COLUMNS))
+        self.table.setHorizontalHeaderLabels(RULE_COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        for rule in rules:
+            record = rule.to_dict()
+            self.add_rule([record["kind"], record.get("pattern", ""), record.get("type", ""),
+                           record.get("low", ""), record.get("high", ""), record["category"]])
+
+        self.add_button = QPushButton("Add Rule")
+        self.add_button.clicked.connect(lambda: self.add_rule(["keyword", "", "", "", "", ""]))
+        self.remove_button = QPushButton("Remove Rule")
+        self.remove_button.clicked.connect(self.remove_rules)
+        self.save_button = QPushButton("Save")
+        self.save_button.clicked.connect(self.save)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.add_button)
+        button_layout.addWidget(self.remove_button)
+        button_layout.addStretch()
+        button_layout.addWidget(self.save_button)
+
+        self.layout.addWidget(QLabel("Kinds: keyword, prefix, regex (match Notes) and amount (Low to High). "
+                                     "Type may be left blank to match both."))
+        self.layout.addWidget(self.table)
+        self.layout.addLayout(button_layout)
+        self.setLayout(self.layout)
+        self.resize(700, 400)
+
+    def add_rule(self, values):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        for column, value in enumerate(values):
+            self.table.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def remove_rules(self):
+        for row in sorted({index.row() for index in self.table.selectedIndexes()}, reverse=True):
+            self.table.removeRow(row)
+
+    def save(self):
+        from budgetbuddy.categorize import Rule
+
+        rules = []
+        for row in range(self.table.rowCount()):
+            kind, pattern, _type, low, high, category = (
+                self.table.item(row, column).text().strip() if self.table.item(row, column) else ""
+                for column in range(len(RULE_COLUMNS)))
+            try:
+                rules.append(Rule(kind.lower(), category, pattern, _type, low, high))
+            except ValueError as error:
+                QMessageBox.warning(self, "Invalid Rule", f"Rule {row + 1}: {error}")
+                return
+        self.rules = rules
+        self.accept()
+
+
 class FinanceTracker(QWidget):
-    def __init__(self):
+    first_painted = pyqtSignal()
+    data_loaded = pyqtSignal()
+
+    def __init__(self, storage="journal"):
         super().__init__()
-        # Initialize data with default columns
-        self.data = pd.DataFrame(columns=["Date", "Type", "Account", "Amount", "Source/Category", "Notes"])
+        # The ledger, its indexes and the storage backend are set up by
+        # load_data, which runs once the window has painted
+        self.ledger = None
+        self.storage = storage  # backend name or storage object
+        self.search_index = None
+        self.sort_index = None
+        self.rollups = None
+        self.balances = None
+        self.dates = None
+        self.fingerprints = None  # loaded or built the first time a statement is imported
+        self.history = History()
+        self.categorizer = None  # compiled category rules, loaded on first use
+        self.loader = None
+        self.importer = None
+        self.loading = False
+        self.painted = False
         self.setWindowTitle("PhD Finance Tracker Pro")
         self.setWindowIcon(QIcon('finance_icon.png'))
         self.layout = QVBoxLayout()
+        self.settings = QSettings("MyCompany", "FinanceTracker")
         self.init_ui()
-        
-        # Load data empty
-        self.load_data()
 
-        self.settings = QSettings("MyCompany", "FinanceTracker")
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            self.first_painted.emit()
+            QTimer.singleShot(0, self.load_data)
 
     def init_ui(self):
         # Input Fields
@@ -99,6 +425,22 @@ class FinanceTracker(QWidget):
         self.notes_edit = QLineEdit()
         self.add_button = QPushButton("Add Transaction")
         self.add_button.clicked.connect(self.add_transaction)
+        self.add_button.setEnabled(False)  # until the ledger is loaded
+        self.undo_button = QPushButton("Undo")
+        self.undo_button.clicked.connect(self.undo)
+        self.redo_button = QPushButton("Redo")
+        self.redo_button.clicked.connect(self.redo)
+        self.rules_button = QPushButton("Rules")
+        self.rules_button.clicked.connect(self.edit_category_rules)
+        self.import_button = QPushButton("Import")
+        self.import_button.clicked.connect(self.import_statement)
+        self.import_button.setEnabled(False)  # until the ledger is loaded
+        self.export_button = QPushButton("Export CSV")
+        self.export_button.clicked.connect(self.export_csv)
+        self.export_button.setEnabled(False)
+        QShortcut(QKeySequence.Undo, self, self.undo)
+        QShortcut(QKeySequence.Redo, self, self.redo)
+        self.update_history_buttons()
 
         # Input Layout
         input_layout = QHBoxLayout()
@@ -115,14 +457,45 @@ class FinanceTracker(QWidget):
         input_layout.addWidget(QLabel("Notes:"))
         input_layout.addWidget(self.notes_edit)
         input_layout.addWidget(self.add_button)
+        input_layout.addWidget(self.undo_button)
+        input_layout.addWidget(self.redo_button)
+        input_layout.addWidget(self.rules_button)
+        input_layout.addWidget(self.import_button)
+        input_layout.addWidget(self.export_button)
 
         # Table
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(["Date", "Type", "Account", "Amount", "Source/Category", "Notes"])
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table_model = TransactionTableModel(parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.table_model)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.table.doubleClicked.connect(self.edit_transaction)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        # Unsorted until a header is clicked
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        # Fixed row heights so the view never measures rows it isn't showing
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+
+        # Balance as of a day, today unless another one is picked
+        self.balance_date_edit = QDateEdit()
+        self.balance_date_edit.setDate(QDate.currentDate())
+        self.balance_date_edit.setCalendarPopup(True)
+        self.balance_date_edit.dateChanged.connect(self.update_balance_display)
+        self.balance_label = QLabel()
+        balance_layout = QHBoxLayout()
+        balance_layout.addWidget(QLabel("Balance as of:"))
+        balance_layout.addWidget(self.balance_date_edit)
+        balance_layout.addWidget(self.balance_label)
+        balance_layout.addStretch()
+
+        # Transactions Tab
+        self.transactions_tab = QWidget()
+        transactions_layout = QVBoxLayout()
+        transactions_layout.addLayout(input_layout)
+        transactions_layout.addLayout(balance_layout)
+        transactions_layout.addWidget(self.table)
+        self.transactions_tab.setLayout(transactions_layout)
 
         # Search/Filter
         self.search_bar = QLineEdit()
@@ -139,144 +512,481 @@ class FinanceTracker(QWidget):
         filter_layout.addWidget(QLabel("Type:"))
         filter_layout.addWidget(self.type_filter_combo)
 
-        # Analysis Tab
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.setFormat("Loading %p%")
+        self.progress_bar.hide()
+        filter_layout.addWidget(self.progress_bar)
+
+        # Analysis Tab, filled in the first time it is opened
         self.analysis_tab = QWidget()
         self.analysis_layout = QVBoxLayout()
         self.analysis_tab.setLayout(self.analysis_layout)
-        self.create_analysis_tab()
+        self.charts_dirty = True
+        self.chart_timer = None
+
+        # Loans Tab, likewise filled in the first time it is opened
+        self.loans_tab = QWidget()
+        self.loans_layout = QVBoxLayout()
+        self.loans_tab.setLayout(self.loans_layout)
+        self.loan_book = None
 
         # Tab Widget
         self.tabs = QTabWidget()
-        self.tabs.addTab(self, "Transactions")
+        self.tabs.addTab(self.transactions_tab, "Transactions")
         self.tabs.addTab(self.analysis_tab, "Analysis")
+        self.tabs.addTab(self.loans_tab, "Loans")
+        self.tabs.currentChanged.connect(self.schedule_chart_render)
+        self.tabs.currentChanged.connect(self.update_loans)
 
         # Layout
         self.layout.addLayout(filter_layout)
         self.layout.addWidget(self.tabs)
         self.setLayout(self.layout)
 
-        # Load Data
-        self.update_table()
         self.load_settings()
 
     def create_analysis_tab(self):
+        # Period Summaries
+        self.summary_period_combo = QComboBox()
+        self.summary_period_combo.addItems(list(SUMMARY_PERIODS))
+        self.summary_period_combo.setCurrentText("Monthly")
+        self.summary_period_combo.currentIndexChanged.connect(self.update_period_summary)
+        self.summary_start_edit = QDateEdit()
+        self.summary_start_edit.setCalendarPopup(True)
+        self.summary_start_edit.setDate(QDate.currentDate().addMonths(-1))
+        self.summary_start_edit.dateChanged.connect(self.update_period_summary)
+        self.summary_end_edit = QDateEdit()
+        self.summary_end_edit.setCalendarPopup(True)
+        self.summary_end_edit.setDate(QDate.currentDate())
+        self.summary_end_edit.dateChanged.connect(self.update_period_summary)
+        summary_layout = QHBoxLayout()
+        summary_layout.addWidget(QLabel("Summary:"))
+        summary_layout.addWidget(self.summary_period_combo)
+        summary_layout.addWidget(QLabel("From:"))
+        summary_layout.addWidget(self.summary_start_edit)
+        summary_layout.addWidget(QLabel("To (exclusive):"))
+        summary_layout.addWidget(self.summary_end_edit)
+        summary_layout.addStretch()
+        self.analysis_layout.addLayout(summary_layout)
+
+        self.summary_table = QTableWidget(0, 5)
+        self.summary_table.setHorizontalHeaderLabels(["Period", "Income", "Expense", "Net", "Transactions"])
+        self.summary_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.summary_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.summary_table.verticalHeader().hide()
+        self.summary_table.setMaximumHeight(200)
+        self.analysis_layout.addWidget(self.summary_table)
+
         # Monthly Spending Chart
-        self.monthly_spending_figure = Figure()
-        self.monthly_spending_canvas = FigureCanvas(self.monthly_spending_figure)
-        self.analysis_layout.addWidget(self.monthly_spending_canvas)
+        self.monthly_spending_view = ChartView()
+        self.monthly_spending_view.resized.connect(self.update_analysis_charts)
+        self.analysis_layout.addWidget(self.monthly_spending_view)
 
         # Category Pie Chart
-        self.category_pie_figure = Figure()
-        self.category_pie_canvas = FigureCanvas(self.category_pie_figure)
-        self.analysis_layout.addWidget(self.category_pie_canvas)
+        self.category_pie_view = ChartView()
+        self.category_pie_view.resized.connect(self.update_analysis_charts)
+        self.analysis_layout.addWidget(self.category_pie_view)
 
-        self.update_analysis_charts()
+        # Daily Balance Chart
+        self.balance_view = ChartView()
+        self.balance_view.resized.connect(self.update_analysis_charts)
+        self.analysis_layout.addWidget(self.balance_view)
+
+        # Balance Forecast Chart, less upcoming subscription charges
+        self.forecast_view = ChartView()
+        self.forecast_view.resized.connect(self.update_analysis_charts)
+        self.analysis_layout.addWidget(self.forecast_view)
+        from budgetbuddy.forecast import SubscriptionForecast
+        self.forecast = SubscriptionForecast()
+
+        # Charts are redrawn at most once per burst of changes, one at a time
+        # on a worker thread, and only while the Analysis tab is showing
+        self.chart_generation = 0
+        self.chart_pool = QThreadPool(self)
+        self.chart_pool.setMaxThreadCount(1)
+        self.chart_timer = QTimer(self)
+        self.chart_timer.setSingleShot(True)
+        self.chart_timer.setInterval(150)
+        self.chart_timer.timeout.connect(self.render_analysis_charts)
+
+    def create_loans_tab(self):
+        from budgetbuddy.loans import LoanBook
+
+        self.loan_book = LoanBook()
 
+        # Every loan's status as of today; the extra payment is editable
+        self.loans_table = QTableWidget(0, len(LOAN_COLUMNS))
+        self.loans_table.setHorizontalHeaderLabels(LOAN_COLUMNS)
+        self.loans_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.loans_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.loans_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.loans_table.verticalHeader().hide()
+        self.loans_table.itemChanged.connect(self.set_loan_extra)
+        self.loans_table.itemSelectionChanged.connect(self.show_loan_schedule)
+        self.loans_layout.addWidget(self.loans_table)
+
+        # Payment schedule of the selected loan
+        self.loan_schedule_table = QTableWidget(0, 6)
+        self.loan_schedule_table.setHorizontalHeaderLabels(["Payment", "Date", "Amount", "Interest", "Principal",
+                                                            "Balance"])
+        self.loan_schedule_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.loan_schedule_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.loan_schedule_table.verticalHeader().hide()
+        self.loans_layout.addWidget(self.loan_schedule_table)
+
+    @traced
     def add_transaction(self):
         date = self.date_edit.date().toString("yyyy-MM-dd")
         _type = self.type_combo.currentText()
         account = self.account_combo.currentText()
         amount = float(self.amount_edit.text())
-        source_category = self.source_category_edit.text()
         notes = self.notes_edit.text()
+        source_category = self.source_category_edit.text() or self.suggest_category(notes, _type, amount)
 
-        new_row = pd.Series([date, _type, account, amount, source_category, notes], index=self.data.columns)
-        self.data = self.data.append(new_row, ignore_index=True)
-        self.save_data()
-        self.update_table()
-        self.update_analysis_charts()  # Update charts after adding transaction
+        self.insert_rows([[date, _type, account, amount, source_category, notes]])
         self.clear_input_fields()
 
     def edit_transaction(self, index):
-        row = index.row()
-        selected_row = self.data.iloc[row]
+        if self.loading:
+            return
+        row = self.table_model.source_row(index.row())
+        selected_row = self.ledger.row(row)
 
         # Create a dialog for editing
         edit_dialog = EditTransactionDialog(selected_row)
         if edit_dialog.exec_() == QDialog.Accepted:
-            self.data.iloc[row] = edit_dialog.get_updated_data()
-            self.save_data()
-            self.update_table()
-            self.update_analysis_charts()  # Update charts after editing transaction
+            updated = edit_dialog.get_updated_data()
+            if not updated["Source/Category"]:
+                updated["Source/Category"] = self.suggest_category(updated["Notes"], updated["Type"], updated["Amount"])
+            self.replace_row(row, updated)
 
     def delete_transaction(self):
-        selected_rows = sorted(set(index.row() for index in self.table.selectedIndexes()))
+        if self.loading:
+            return
+        selected_rows = sorted(self.table_model.source_row(index.row()) for index in self.table.selectionModel().selectedRows())
         if not selected_rows:
             QMessageBox.warning(self, "Warning", "No transaction selected.")
             return
 
         confirm = QMessageBox.question(self, "Confirm Deletion", "Are you sure you want to delete the selected transactions?", QMessageBox.Yes | QMessageBox.No)
         if confirm == QMessageBox.Yes:
-            self.data.drop(selected_rows, inplace=True)
-            self.data.reset_index(drop=True, inplace=True)
-            self.save_data()
-            self.update_table()
-            self.update_analysis_charts()  # Update charts after deleting transaction
-
-    def update_table(self, data=None):
-        if data is None:
-            data = self.data
-        self.table.setRowCount(len(data))
-        for i, row in data.iterrows():
-            self.table.setItem(i, 0, QTableWidgetItem(row["Date"]))
-            self.table.setItem(i, 1, QTableWidgetItem(row["Type"]))
-            self.table.setItem(i, 2, QTableWidgetItem(row["Account"]))
-            self.table.setItem(i, 3, QTableWidgetItem(f"{row['Amount']:.2f}"))
-            self.table.setItem(i, 4, QTableWidgetItem(row["Source/Category"]))
-            self.table.setItem(i, 5, QTableWidgetItem(row["Notes"]))
-        self.table.resizeColumnsToContents()
+            self.remove_rows(selected_rows)
 
+    # Every change to the ledger goes through these three so the indexes,
+    # storage, table, charts and undo history all see it.
+    @traced
+    def insert_rows(self, rows, ids=None):
+        # rows are row_values lists, or a Ledger for bulk imports. ids bring
+        # deleted rows back under the ids they had, for undo; otherwise the
+        # rows are new and go on the end
+        first = len(self.ledger)
+        if ids is None:
+            if isinstance(rows, list):
+                self.ledger.append_rows(rows)
+            else:
+                self.ledger.append_new(rows)
+            positions = list(range(first, len(self.ledger)))
+        else:
+            positions = self.ledger.restore(ids, rows)
+        if len(self.ledger) > first:
+            self.search_index.append(len(self.ledger) - first)
+        if ids is not None:
+            self.search_index.restore(positions)
+        self.sort_index.add_rows(positions)
+        self.rollups.add_rows(positions)
+        self.balances.add_rows(positions)
+        self.dates.add_rows(positions)
+        if self.fingerprints is not None:
+            self.fingerprints.add_rows(positions)
+        if ids is None:
+            self.storage.add(self.ledger, len(positions))
+            self.append_to_table(len(positions))
+        else:
+            self.storage.restore(self.ledger, positions)
+            self.filter_table()
+        # Storage may have given the rows their ids
+        self.history.record(("insert", self.ledger.id[positions].tolist(), rows))
+        self.update_balance_display()
+        self.update_analysis_charts()
+        self.update_history_buttons()
+
+    @traced
+    def replace_row(self, position, updated):
+        self.rollups.remove_rows([position])
+        self.balances.remove_rows([position])
+        self.dates.remove_rows([position])
+        if self.fingerprints is not None:
+            self.fingerprints.remove_rows([position])
+        before = self.ledger.row(position)
+        self.ledger.set_row(position, updated)
+        self.history.record(("replace", int(self.ledger.id[position]), before, self.ledger.row(position)))
+        self.rollups.add_rows([position])
+        self.balances.add_rows([position])
+        self.dates.add_rows([position])
+        if self.fingerprints is not None:
+            self.fingerprints.add_rows([position])
+        self.search_index.update(position)
+        self.sort_index.update(position)
+        self.storage.edit(self.ledger, position)
+        self.filter_table()
+        self.update_balance_display()
+        self.update_analysis_charts()
+        self.update_history_buttons()
+
+    @traced
+    def remove_rows(self, positions):
+        self.rollups.remove_rows(positions)
+        self.balances.remove_rows(positions)
+        self.dates.remove_rows(positions)
+        if self.fingerprints is not None:
+            self.fingerprints.remove_rows(positions)
+        removed = sorted(set(int(position) for position in positions))
+        self.history.record(("remove", self.ledger.id[removed].tolist(),
+                             [self.ledger.row_values(position) for position in removed]))
+        self.ledger.delete(removed)
+        self.search_index.remove(removed)
+        self.storage.delete(self.ledger, removed)
+        if self.ledger.needs_compaction():
+            keep = self.ledger.compact()
+            self.search_index.compact(keep)
+            self.sort_index.compact(keep)
+        self.filter_table()
+        self.update_balance_display()
+        self.update_analysis_charts()
+        self.update_history_buttons()
+
+    def apply_delta(self, delta):
+        # Makes a History delta's change through the three methods above,
+        # finding the rows by id
+        kind = delta[0]
+        if kind == "insert":
+            self.insert_rows(delta[2], delta[1])
+        elif kind == "remove":
+            positions = [self.ledger.position_of(row_id) for row_id in delta[1]]
+            self.remove_rows([position for position in positions if position is not None])
+        else:
+            # A row that is gone has nothing to change back
+            position = self.ledger.position_of(delta[1])
+            if position is not None:
+                self.replace_row(position, delta[3])
+
+    def undo(self):
+        if not self.loading and self.history.can_undo():
+            self.history.undo(self.apply_delta)
+
+    def redo(self):
+        if not self.loading and self.history.can_redo():
+            self.history.redo(self.apply_delta)
+
+    def update_history_buttons(self):
+        self.undo_button.setEnabled(not self.loading and self.history.can_undo())
+        self.redo_button.setEnabled(not self.loading and self.history.can_redo())
+
+    @traced
+    def update_table(self, rows=None):
+        # rows are ledger positions to show, None shows the whole ledger
+        self.table_model.set_ledger(self.ledger, rows)
+
+    @traced
+    def append_to_table(self, count):
+        # New rows go on the end of the ledger, so the unfiltered view only
+        # needs to hear about those rows. A filtered or sorted view is re-queried.
+        if self.table_model.is_filtered() or self.table_model.is_sorted():
+            self.filter_table()
+        else:
+            self.table_model.append_rows(count)
+
+    def sql_storage(self):
+        # The storage, when it answers filters and summaries in SQL and no
+        # worker thread is using its connection
+        from budgetbuddy.storage import SqliteStorage
+
+        return self.storage if isinstance(self.storage, SqliteStorage) and not self.loading else None
+
+    @traced
     def filter_table(self):
+        if self.ledger is None:
+            return
         search_text = self.search_bar.text().lower()
         selected_type = self.type_filter_combo.currentText()
-        filtered_data = self.data.copy()
-
+        if not search_text and selected_type == "All":
+            self.update_table()
+            return
         if search_text:
-            filtered_data = filtered_data[filtered_data.apply(lambda row: row.astype(str).str.lower().str.contains(search_text).any(), axis=1)]
+            rows = self.search_index.search(search_text)
+        else:
+            rows = self.ledger.positions()
 
-        if selected_type != "All":
-            filtered_data = filtered_data[filtered_data["Type"] == selected_type]
+        if selected_type != "All" and self.sql_storage() is not None:
+            # The transaction_type index finds the rows; the ledger only maps their ids
+            pages = [page.id for page in self.sql_storage().query(transaction_type=selected_type)]
+            rows = rows[np.isin(self.ledger.id[rows], np.concatenate(pages) if pages else [])]
+        elif selected_type != "All":
+            rows = rows[self.ledger.type_code[rows] == self.ledger.types.code_of.get(selected_type, -1)]
 
-        self.update_table(filtered_data)
+        self.update_table(rows)
 
+    def update_balance_display(self):
+        from budgetbuddy.ledger import format_cents, parse_day
+
+        if self.balances is None:
+            return
+        # Binary searches in the balance index; nothing is summed here
+        day = parse_day(self.balance_date_edit.date().toString("yyyy-MM-dd"))
+        parts = [f"Total {format_cents(self.balances.balance(day=day))}"]
+        parts += [f"{account} {format_cents(cents)}" for account, cents in self.balances.balances(day)]
+        self.balance_label.setText("   |   ".join(parts))
+
+    @traced
     def update_analysis_charts(self):
-        # Convert Date column to datetime for easier date-based analysis
-        self.data["Date"] = pd.to_datetime(self.data["Date"], errors='coerce')
-
-        # Ensure Amount column is numeric
-        self.data["Amount"] = pd.to_numeric(self.data["Amount"], errors='coerce')
-
-        # Drop rows with NaN in Amount after conversion
-        valid_data = self.data.dropna(subset=["Amount"])  
-        
-        # Check if there is any valid data to plot
-        reply = QMessageBox.question(self, "No Data to Plot", 
-                                     "No data available for analysis. Would you like to add transactions now?", 
-                                     QMessageBox.Yes | QMessageBox.No)
-        if reply == QMessageBox.Yes:
-            self.add_transaction_interactively()  # Trigger the add transaction process
-        return
-          
-        # Monthly Spending Chart
-        self.monthly_spending_figure.clear()
-        ax = self.monthly_spending_figure.add_subplot(111)
-        monthly_spending = self.data[self.data["Type"] == "Expense"].groupby(pd.Grouper(key="Date", freq="M"))["Amount"].sum()
-        monthly_spending.plot(kind="bar", ax=ax)
-        ax.set_title("Monthly Spending")
-        ax.set_xlabel("Month")
-        ax.set_ylabel("Amount")
-        self.monthly_spending_canvas.draw()
+        self.charts_dirty = True
+        self.schedule_chart_render()
 
-        # Category Pie Chart
-        self.category_pie_figure.clear()
-        ax = self.category_pie_figure.add_subplot(111)
-        category_spending = self.data[self.data["Type"] == "Expense"].groupby("Source/Category")["Amount"].sum()
-        category_spending.plot(kind="pie", ax=ax, autopct='%1.1f%%', startangle=90)
-        ax.set_title("Expense Categories")
-        self.category_pie_canvas.draw()
+    def schedule_chart_render(self):
+        if not self.analysis_tab.isVisible():
+            return
+        if self.chart_timer is None:
+            self.create_analysis_tab()
+        if self.charts_dirty and self.rollups is not None:
+            self.chart_timer.start()
 
+    @traced
+    def render_analysis_charts(self):
+        from budgetbuddy import charts
+
+        if not self.analysis_tab.isVisible():
+            return  # picked up again when the tab is shown
+        self.charts_dirty = False
+        self.chart_generation += 1
+        self.update_period_summary()
+
+        # Charts read the running totals kept by self.rollups, never the ledger
+        monthly_spending = self.rollups.monthly("Expense")
+        category_spending = [(category, total) for category, total in self.rollups.categories("Expense") if total > 0]
+        # and the balance index, read once per day shown
+        day_range = self.balances.day_range()
+        daily_balance = self.balances.daily(day_range[0], day_range[1] + 1) if day_range else None
+        # The forecast starts from today's balance; subscriptions are expanded
+        # on the chart thread and cached until one of them changes
+        today = int(np.datetime64("today", "D").astype(np.int64))
+        forecast = (self.forecast, *self.balances.daily(today, today + FORECAST_DAYS))
+
+        for view, render, items in ((self.monthly_spending_view, charts.render_monthly_spending, monthly_spending),
+                                    (self.category_pie_view, charts.render_category_pie, category_spending),
+                                    (self.balance_view, charts.render_daily_balance, daily_balance),
+                                    (self.forecast_view, render_balance_forecast, forecast)):
+            task = ChartRenderTask(self.chart_generation, view, render, items, view.width(), view.height())
+            task.signals.finished.connect(self.show_chart)
+            self.chart_pool.start(task)
+
+    @traced
+    def update_period_summary(self):
+        from budgetbuddy.ledger import format_cents, parse_day
+
+        if self.dates is None:
+            return
+        freq = SUMMARY_PERIODS[self.summary_period_combo.currentText()]
+        self.summary_start_edit.setEnabled(freq is None)
+        self.summary_end_edit.setEnabled(freq is None)
+        # Both come from the date index, touching at most the rows in range,
+        # or from grouped SQL when the database can answer them itself
+        summaries = self.sql_storage() or self.dates
+        if freq is None:
+            start = parse_day(self.summary_start_edit.date().toString("yyyy-MM-dd"))
+            end = parse_day(self.summary_end_edit.date().toString("yyyy-MM-dd"))
+            summary = summaries.summary(start, end)
+            rows = [("Total", summary["income"], summary["expense"], summary["count"])]
+            rows += [(f"{_type}: {category or '(none)'}", cents if _type == "Income" else 0,
+                      cents if _type == "Expense" else 0, "")
+                     for (_type, category), cents in sorted(summary["categories"].items())]
+        else:
+            rows = [(label, income, expense, count)
+                    for label, _, _, income, expense, count in reversed(summaries.periods(freq))]
+
+        self.summary_table.setRowCount(len(rows))
+        for row, (label, income, expense, count) in enumerate(rows):
+            values = [label, format_cents(income), format_cents(expense), format_cents(income - expense), str(count)]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.summary_table.setItem(row, column, item)
+
+    @traced
+    def update_loans(self):
+        from budgetbuddy.ledger import format_cents, format_day
+
+        if not self.loans_tab.isVisible():
+            return
+        if self.loan_book is None:
+            self.create_loans_tab()
+        # Schedules are cached per loan, so this only amortizes loans that
+        # changed since the tab was last shown
+        today = int(np.datetime64("today", "D").astype(np.int64))
+        rows = self.loan_book.status(today)
+        self.loans_table.blockSignals(True)
+        self.loans_table.setRowCount(len(rows))
+        for row, (loan_id, account, amount, rate, term, payment, extra, made, balance, interest_paid, interest_left,
+                  payoff) in enumerate(rows):
+            values = [str(loan_id), account, format_cents(amount), f"{rate:g}", str(term), format_cents(payment),
+                      format_cents(extra), f"{made}/{term}", format_cents(balance), format_cents(interest_paid),
+                      format_cents(interest_left), format_day(payoff)]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column != LOAN_EXTRA_COLUMN:
+                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+                if column > 1:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                item.setData(Qt.UserRole, loan_id)
+                self.loans_table.setItem(row, column, item)
+        self.loans_table.blockSignals(False)
+        self.show_loan_schedule()
+
+    def set_loan_extra(self, item):
+        from budgetbuddy.ledger import parse_amount
+
+        if item.column() != LOAN_EXTRA_COLUMN:
+            return
+        text = item.text().strip() or "0"  # a cleared cell means no extra
+        try:
+            valid = math.isfinite(float(text)) and float(text) >= 0
+        except ValueError:
+            valid = False
+        if valid:
+            self.loan_book.set_extra(item.data(Qt.UserRole), parse_amount(text))
+        else:
+            QMessageBox.warning(self, "Invalid Input", "Extra payment must be a number, not negative.")
+        # Redrawn from the loan book, which puts back the old value if this one was refused
+        self.update_loans()
+
+    @traced
+    def show_loan_schedule(self):
+        from budgetbuddy.ledger import format_cents, format_days
+
+        selected = self.loans_table.selectedItems()
+        schedule = self.loan_book.schedules().get(selected[0].data(Qt.UserRole)) if selected else None
+        if schedule is None:
+            self.loan_schedule_table.setRowCount(0)
+            return
+        columns = [schedule["number"].astype(str), format_days(schedule["day"])]
+        columns += [[format_cents(cents) for cents in schedule[name].tolist()]
+                    for name in ("payment", "interest", "principal", "balance")]
+        self.loan_schedule_table.setRowCount(len(schedule["day"]))
+        for column, values in enumerate(columns):
+            for row, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.loan_schedule_table.setItem(row, column, item)
+
+    @traced
+    def show_chart(self, generation, view, image):
+        if generation == self.chart_generation:
+            view.setPixmap(QPixmap.fromImage(image))
+
+    @traced
     def save_data(self):
-        self.data.to_csv("transactions.csv", index=False)
+        self.storage.save(self.ledger)
     '''
     def load_data(self):
         try:
@@ -286,16 +996,93 @@ class FinanceTracker(QWidget):
             self.data = pd.DataFrame(columns=["Date", "Type", "Account", "Amount", "Source/Category", "Notes"])
     '''
     def load_data(self):
-        try:
-            self.data = pd.read_csv("./transactions.csv")
-            print(self.data.head())
-            if self.data.empty:
-                QMessageBox.information(self, "No Data", "No transactions found. Please add your first transaction.")
-                self.add_transaction_interactively()
-        except FileNotFoundError:
-            self.data = pd.DataFrame(columns=["Date", "Type", "Account", "Amount", "Source/Category", "Notes"])
+        # Loading runs on a worker thread; rows show up as each chunk arrives
+        self.set_busy(True, "Loading %p%")
+        self.loader = LedgerLoader(self.storage, self)
+        self.loader.chunk_loaded.connect(self.add_loaded_chunk)
+        self.loader.failed.connect(self.show_load_error)
+        self.loader.finished.connect(self.finish_loading)
+        self.loader.start()
+
+    @traced
+    def add_loaded_chunk(self, chunk, progress):
+        if self.ledger is None:
+            self.reset_ledger(chunk)
+        else:
+            self.ledger.append_ledger(chunk)
+            self.search_index.append(len(chunk))
+            self.rollups.add_rows(np.arange(len(self.ledger) - len(chunk), len(self.ledger)))
+            self.balances.add_rows(np.arange(len(self.ledger) - len(chunk), len(self.ledger)))
+            self.dates.add_rows(np.arange(len(self.ledger) - len(chunk), len(self.ledger)))
+            self.sort_index.add_rows(np.arange(len(self.ledger) - len(chunk), len(self.ledger)))
+            self.append_to_table(len(chunk))
+            self.update_balance_display()
+        self.update_analysis_charts()
+        self.progress_bar.setValue(int(progress * 100))
+        self.loader.chunk_done()
+
+    def finish_loading(self):
+        from budgetbuddy.ledger import Ledger
+
+        self.storage = self.loader.storage
+        if self.ledger is None:
+            self.reset_ledger(Ledger())
+        if self.loader.error is not None:
+            # Edits would be written over the data that failed to load, so
+            # they stay turned off, as while loading
+            self.progress_bar.setVisible(False)
+            return
+        self.set_busy(False)
+        self.data_loaded.emit()
+
+        if self.loader.missing:
             QMessageBox.information(self, "No Data File", "No transactions file found. Please add your first transaction.")
             self.add_transaction_interactively()
+        elif not len(self.ledger):
+            QMessageBox.information(self, "No Data", "No transactions found. Please add your first transaction.")
+            self.add_transaction_interactively()
+
+    def show_load_error(self, message):
+        QMessageBox.critical(self, "Could Not Load Data",
+                             f"The transactions could not be loaded: {message}\n\n"
+                             "Nothing can be changed until the problem is fixed and the app is restarted.")
+
+    def set_busy(self, busy, progress_format=None):
+        # While a worker thread is loading or importing, the ledger must not
+        # change, so everything that edits it is turned off
+        self.loading = busy
+        if busy:
+            self.progress_bar.setFormat(progress_format)
+            self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(busy)
+        self.add_button.setEnabled(not busy)
+        self.import_button.setEnabled(not busy)
+        self.export_button.setEnabled(not busy)
+        self.update_history_buttons()
+
+    @traced
+    def reset_ledger(self, ledger):
+        # Replace the whole ledger and rebuild everything derived from it
+        from budgetbuddy.indexes import BalanceIndex, DateIndex, SortIndex
+        from budgetbuddy.rollups import Rollups
+        from budgetbuddy.search import SearchIndex
+
+        self.ledger = ledger
+        self.history.clear()
+        self.search_index = SearchIndex(self.ledger)
+        self.search_index.build()
+        self.rollups = Rollups(self.ledger)
+        self.rollups.build()
+        self.balances = BalanceIndex(self.ledger)
+        self.balances.build()
+        self.dates = DateIndex(self.ledger)
+        self.dates.build()
+        self.fingerprints = None
+        self.sort_index = SortIndex(self.ledger)  # column orders are worked out on first sort
+        self.table_model.set_sort_index(self.sort_index)
+        self.filter_table()
+        self.update_balance_display()
+        self.update_analysis_charts()
 
     def add_transaction_interactively(self):
         dialog = QDialog(self)
@@ -347,16 +1134,119 @@ class FinanceTracker(QWidget):
         if amount:
             try:
                 amount = float(amount)
-                new_row = pd.DataFrame([[date, _type, account, amount, source_category, notes]], columns=self.data.columns)
-                self.data = pd.concat([self.data, new_row], ignore_index=True)
-                self.save_data()
-                self.update_table()
+                source_category = source_category or self.suggest_category(notes, _type, amount)
+                self.insert_rows([[date, _type, account, amount, source_category, notes]])
                 dialog.accept()
             except ValueError:
                 QMessageBox.warning(self, "Invalid Input", "Amount must be a valid number.")
         else:
             QMessageBox.warning(self, "Missing Input", "Please enter an amount.")
 
+    def category_rules(self):
+        from budgetbuddy.categorize import Categorizer, load_rules
+
+        if self.categorizer is None:
+            try:
+                self.categorizer = Categorizer(load_rules())
+            except (ValueError, KeyError, TypeError) as error:
+                QMessageBox.warning(self, "Category Rules", f"Could not read the category rules: {error}")
+                self.categorizer = Categorizer([])
+        return self.categorizer
+
+    def suggest_category(self, notes, _type, amount):
+        # Source/Category from the rules for a transaction left without one
+        return self.category_rules().category_for(notes, _type, amount)
+
+    def edit_category_rules(self):
+        from budgetbuddy.categorize import Categorizer, save_rules
+
+        dialog = CategoryRulesDialog(self.category_rules().rules, self)
+        if dialog.exec_() == QDialog.Accepted:
+            save_rules(dialog.rules)
+            self.categorizer = Categorizer(dialog.rules)
+
+    @traced
+    def import_statement(self):
+        from budgetbuddy.importer import STATEMENT_FILTER, StatementImport
+
+        if self.loading:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Import Statement", "", STATEMENT_FILTER)
+        if not path:
+            return
+        account, ok = QInputDialog.getItem(self, "Import Statement", "Account for rows the file does not name:",
+                                           ["Checking", "Savings", "Credit Card"], 0, False)
+        if not ok:
+            return
+        # The statement is read on a worker thread; edits wait until it is done,
+        # and the fingerprint index saved at the last close is used if it still matches
+        self.set_busy(True, "Importing")
+        job = StatementImport(path, account, self.category_rules(), self.fingerprints)
+        self.importer = StatementImporter(job, self.ledger, self.storage.sidecar_path(FINGERPRINTS_FILE), self)
+        self.importer.rows_read.connect(self.show_rows_read)
+        self.importer.finished.connect(self.finish_import)
+        self.importer.start()
+
+    def show_rows_read(self, rows):
+        self.progress_bar.setFormat(f"Importing {rows:,} rows")
+
+    @traced
+    def finish_import(self):
+        from budgetbuddy.importer import NEAR_DUPLICATE, NEW
+
+        importer, self.importer = self.importer, None
+        job = importer.job
+        self.fingerprints = job.fingerprints
+        self.set_busy(False)
+        if job.cancelled:
+            return
+        if importer.error is not None:
+            QMessageBox.warning(self, "Import Failed", f"Could not read {job.path}: {importer.error}")
+            return
+
+        report = job.report()
+        summary = (f"Read {report['read']} rows in {report['seconds']:.1f} s "
+                   f"({report['rows_per_second']:,.0f} rows/s).")
+        if report["rejected"]:
+            summary += f" {report['rejected']} could not be read; see {report['rejects']}."
+        if not report["new"] and not report["near_duplicates"]:
+            QMessageBox.information(self, "Import Statement",
+                                    f"{summary} Nothing new: every valid row is already in the ledger.")
+            return
+
+        # Exact duplicates are always skipped; near ones are the user's call
+        box = QMessageBox(self)
+        box.setWindowTitle("Import Statement")
+        box.setText(f"{summary} {report['new']} new transactions, {report['duplicates']} already in the ledger "
+                    f"(skipped) and {report['near_duplicates']} possible duplicates: same amount and description "
+                    f"within a few days of one already there.")
+        new_button = box.addButton("Import New", QMessageBox.AcceptRole)
+        all_button = box.addButton("Import New and Possible Duplicates", QMessageBox.AcceptRole) \
+            if report["near_duplicates"] else None
+        box.addButton(QMessageBox.Cancel)
+        box.exec_()
+        if box.clickedButton() == new_button:
+            batch = job.selected([NEW])
+        elif all_button is not None and box.clickedButton() == all_button:
+            batch = job.selected([NEW, NEAR_DUPLICATE])
+        else:
+            return
+        if len(batch):
+            self.insert_rows(batch)
+
+    @traced
+    def export_csv(self):
+        # CSV is for other programs; the ledger itself stays in the storage backend
+        if self.loading:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export CSV", "transactions-export.csv", "CSV Files (*.csv)")
+        if not path:
+            return
+        try:
+            self.ledger.to_frame().to_csv(path, index=False)
+        except OSError as error:
+            QMessageBox.warning(self, "Export Failed", f"Could not write {path}: {error}")
+
     def clear_input_fields(self):
         self.date_edit.setDate(QDate.currentDate())
         self.type_combo.setCurrentIndex(0)
@@ -372,11 +1262,74 @@ class FinanceTracker(QWidget):
 
     def closeEvent(self, event):
         self.settings.setValue("windowGeometry", self.saveGeometry())
+        if self.loader is not None:
+            self.loader.requestInterruption()
+            self.loader.wait()
+            self.storage = self.loader.storage
+        if self.importer is not None:
+            self.importer.job.cancel()
+            self.importer.wait()
+            self.fingerprints = self.importer.job.fingerprints
+        if not isinstance(self.storage, str):
+            # Writes still waiting on the storage's writer thread go out now
+            try:
+                self.storage.flush()
+            except OSError as error:
+                answer = QMessageBox.question(self, "Save Failed",
+                                              f"Could not save the ledger: {error}\n\n"
+                                              "Close anyway and lose the latest changes?")
+                if answer != QMessageBox.Yes:
+                    event.ignore()
+                    return
+            if self.fingerprints is not None:
+                try:
+                    self.fingerprints.save(self.storage.sidecar_path(FINGERPRINTS_FILE))
+                except OSError:
+                    pass  # rebuilt from the ledger on the next import
+        if self.chart_timer is not None:
+            self.chart_timer.stop()
+            self.chart_pool.waitForDone()
+            self.forecast.close()
+        if self.loan_book is not None:
+            self.loan_book.close()
+        if not isinstance(self.storage, str):
+            try:
+                self.storage.close()
+            except OSError:
+                pass  # reported above, and the user chose to close anyway
         event.accept()
 
+class StartupProfiler(QObject):
+    # Reports time from process start to the window's first paint, and to
+    # the ledger being loaded, against STARTUP_TARGET_MS
+    def __init__(self, window):
+        super().__init__(window)
+        window.first_painted.connect(self.report_first_paint)
+        window.data_loaded.connect(self.report_data_loaded)
+
+    def report_first_paint(self):
+        elapsed = (time.perf_counter() - START_TIME) * 1000
+        verdict = "ok" if elapsed <= STARTUP_TARGET_MS else "over target"
+        print(f"startup: first paint after {elapsed:.0f} ms (target {STARTUP_TARGET_MS} ms, {verdict})", file=sys.stderr)
+
+    def report_data_loaded(self):
+        elapsed = (time.perf_counter() - START_TIME) * 1000
+        print(f"startup: ledger loaded after {elapsed:.0f} ms", file=sys.stderr)
+
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--storage", choices=STORAGE_NAMES, default="journal",
+                        help="how transactions are persisted (journal appends one record per change to a "
+                             "memory-mapped binary snapshot; csv rewrites transactions.csv)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print time to first paint and to ledger loaded")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setStyle("Fusion")
-    finance_tracker = FinanceTracker()
+    finance_tracker = FinanceTracker(args.storage)
+    if args.profile_startup:
+        StartupProfiler(finance_tracker)
     finance_tracker.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
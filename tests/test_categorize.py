@@ -0,0 +1,17 @@
+import pytest
+
+from budgetbuddy.categorize import Categorizer, Rule
+
+
+@pytest.mark.parametrize("low, high", [("ten", None), (None, "1,000"), ("nan", None), (None, "inf"), ("5", "1")])
+def test_bad_amount_bounds_are_refused(low, high):
+    with pytest.raises(ValueError):
+        Rule("amount", "Big", low=low, high=high)
+
+
+def test_amount_bounds_are_inclusive():
+    rules = [Rule("amount", "Small", low="", high="9.99"), Rule("amount", "Big", low=" 10 ", high=100)]
+    assert (rules[0].low, rules[0].high, rules[1].low, rules[1].high) == (None, 999, 1000, 10000)
+    categorizer = Categorizer(rules)
+    assert [categorizer.category_for("", "Expense", amount) for amount in (9.99, 10, 100, 100.01)] == \
+        ["Small", "Big", "Big", ""]
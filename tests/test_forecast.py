@@ -0,0 +1,65 @@
+import calendar
+import datetime
+
+import numpy as np
+
+from budgetbuddy.forecast import CYCLES, Subscriptions, expand
+from budgetbuddy.ledger import parse_day
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def naive_charges(rows, start, end):
+    # (day, subscription index, cents) for every charge in [start, end),
+    # stepping through each subscription's dates one at a time
+    charges = []
+    for index, (_, _, _, amount, cycle, date) in enumerate(rows):
+        unit, step = CYCLES.get(cycle.strip().lower(), ("?", 0))
+        try:
+            anchor = datetime.date.fromisoformat(date)
+        except ValueError:
+            continue
+        if not step:
+            continue
+        number = 0
+        while True:
+            if unit == "D":
+                charge = anchor + datetime.timedelta(days=number * step)
+            else:
+                month = anchor.month - 1 + number * step
+                year, month = anchor.year + month // 12, month % 12 + 1
+                charge = datetime.date(year, month, min(anchor.day, calendar.monthrange(year, month)[1]))
+            day = (charge - EPOCH).days
+            if day >= end:
+                break
+            if day >= start:
+                charges.append((day, index, round(amount * 100)))
+            number += 1
+    return sorted(charges)
+
+
+def random_subscriptions(count, seed):
+    rng = np.random.default_rng(seed)
+    cycles = list(CYCLES) + ["Monthly", " weekly ", "never"]
+    return [(number, f"sub{number}", "Checking", int(rng.integers(1, 10000)) / 100, str(rng.choice(cycles)),
+             f"{rng.integers(2015, 2030)}-{rng.integers(1, 13):02d}-{rng.choice([1, 15, 28, 29, 30, 31]):02d}")
+            for number in range(count)]
+
+
+def test_expand_matches_naive_loop():
+    rows = random_subscriptions(300, seed=1)
+    for start, end in (("2020-01-15", "2024-03-10"), ("2024-02-29", "2024-03-01"), ("2031-01-01", "2032-01-01")):
+        start, end = parse_day(start), parse_day(end)
+        projection = expand(Subscriptions.from_rows(rows), start, end)
+        expanded = sorted(zip(projection.days.tolist(), projection.index.tolist(), projection.cents.tolist()))
+        assert expanded == naive_charges(rows, start, end)
+
+
+def test_daily_totals_match_charges():
+    rows = random_subscriptions(50, seed=2)
+    start, end = parse_day("2024-01-01"), parse_day("2025-01-01")
+    projection = expand(Subscriptions.from_rows(rows), start, end)
+    totals = np.zeros(end - start, dtype=np.int64)
+    for day, _, cents in naive_charges(rows, start, end):
+        totals[day - start] += cents
+    assert projection.daily().tolist() == totals.tolist()
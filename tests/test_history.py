@@ -0,0 +1,58 @@
+from benchmarks.synthetic import generate_frame
+from budgetbuddy.history import History
+from budgetbuddy.ledger import Ledger
+
+
+def editor(ledger, history):
+    # The window's edit path, in miniature: every change is recorded, and
+    # a delta naming a row that is gone changes nothing
+    def replace(position, values):
+        history.record(("replace", int(ledger.id[position]), ledger.row(position), values))
+        ledger.set_row(position, values)
+
+    def remove(positions):
+        history.record(("remove", ledger.id[positions].tolist(), [ledger.row_values(p) for p in positions]))
+        ledger.delete(positions)
+
+    def apply(delta):
+        if delta[0] == "replace":
+            position = ledger.position_of(delta[1])
+            if position is not None:
+                replace(position, delta[3])
+        elif delta[0] == "remove":
+            remove([p for p in map(ledger.position_of, delta[1]) if p is not None])
+        else:
+            history.record(("insert", delta[1], delta[2]))
+            ledger.restore(delta[1], delta[2])
+
+    return replace, remove, apply
+
+
+def test_undo_of_an_edit_to_a_missing_row_is_dropped():
+    ledger = Ledger.from_frame(generate_frame(10, seed=13))
+    history = History()
+    replace, remove, apply = editor(ledger, history)
+    replace(3, {**ledger.row(3), "Notes": "edited"})
+    remove([3])
+    # Another writer's reload lost the row, so the remove's undo never ran
+    history.done.pop()
+    history.undo(apply)
+    assert not history.can_undo() and not history.can_redo()
+    assert ledger.position_of(int(ledger.id[3])) is None
+
+
+def test_undo_and_redo_round_trip():
+    ledger = Ledger.from_frame(generate_frame(10, seed=14))
+    history = History()
+    replace, remove, apply = editor(ledger, history)
+    before = ledger.to_frame()
+    replace(2, {**ledger.row(2), "Amount": 1.5})
+    remove([4, 5])
+    after = ledger.to_frame()
+    history.undo(apply)
+    history.undo(apply)
+    assert ledger.to_frame().equals(before)
+    history.redo(apply)
+    history.redo(apply)
+    assert ledger.to_frame().equals(after)
+    assert len(history.done) == 2 and not history.can_redo()
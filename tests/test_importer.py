@@ -0,0 +1,147 @@
+import collections
+import re
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_frame
+from budgetbuddy.columns import COLUMNS
+from budgetbuddy.importer import DUPLICATE, NEAR_DAYS, NEAR_DUPLICATE, NEW, FingerprintIndex, StatementImport
+from budgetbuddy.ledger import Ledger
+
+
+def naive_kinds(ledger, batch):
+    # What classify should say, by comparing every statement row against
+    # every ledger row
+    def exact(row):
+        return row.Date, row.Amount, row.Type, row.Account, " ".join(row.Notes.lower().split())
+
+    def loose(row):
+        return row.Amount, row.Type, row.Account, " ".join(re.findall(r"[a-z]+", row.Notes.lower()))
+
+    rows = list(ledger.to_frame().itertuples())
+    have = collections.Counter(exact(row) for row in rows)
+    near = collections.defaultdict(list)
+    for row in rows:
+        near[loose(row)].append(pd.Timestamp(row.Date))
+    copies = collections.Counter()
+    kinds = []
+    for row in batch.to_frame().itertuples():
+        key = exact(row)
+        if copies[key] < have[key]:
+            kinds.append(DUPLICATE)
+            near[loose(row)].remove(pd.Timestamp(row.Date))  # that ledger row is taken
+        elif any(abs((day - pd.Timestamp(row.Date)).days) <= NEAR_DAYS for day in near[loose(row)]):
+            kinds.append(NEAR_DUPLICATE)
+        else:
+            kinds.append(NEW)
+        copies[key] += 1
+    return kinds
+
+
+def write_statement(path, frame):
+    # A bank export: signed amounts, the payee in Description, no Type or Account
+    signed = np.where(frame["Type"] == "Income", frame["Amount"], -frame["Amount"])
+    pd.DataFrame({"Date": frame["Date"], "Description": frame["Notes"], "Amount": signed}).to_csv(path, index=False)
+
+
+def overlapping_statement(ledger_frame, seed):
+    # Exact copies, copies made twice, near copies a day or two off and with
+    # different punctuation, and rows that are new
+    rng = np.random.default_rng(seed)
+    copies = ledger_frame.sample(60, random_state=seed)
+    twice = ledger_frame.sample(10, random_state=seed + 1)
+    near = ledger_frame.sample(40, random_state=seed + 2).copy()
+    near["Date"] = (pd.to_datetime(near["Date"]) + pd.to_timedelta(rng.choice([-4, -2, 1, 3], len(near)), unit="D"))
+    near["Date"] = near["Date"].dt.strftime("%Y-%m-%d")
+    near["Notes"] = near["Notes"].str.replace(" #", " - #")
+    new = generate_frame(40, seed + 3, distinct_notes=10)
+    statement = pd.concat([copies, twice, twice, near, new], ignore_index=True)
+    statement["Account"] = "Checking"
+    return statement.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def checking_ledger(rows, seed):
+    frame = generate_frame(rows, seed, distinct_notes=20)
+    frame["Account"] = "Checking"
+    return frame, Ledger.from_frame(frame)
+
+
+def run_import(tmp_path, statement, fingerprints, chunk_rows=25):
+    path = str(tmp_path / "statement.csv")
+    write_statement(path, statement)
+    return StatementImport(path, "Checking", fingerprints=fingerprints, chunk_rows=chunk_rows).run()
+
+
+def test_import_classifies_like_naive_scan(tmp_path):
+    frame, ledger = checking_ledger(500, seed=5)
+    index = FingerprintIndex(ledger)
+    index.build()
+    job = run_import(tmp_path, overlapping_statement(frame, seed=6), index)
+    assert job.rejected == 0
+    assert job.kinds.tolist() == naive_kinds(ledger, job.batch)
+    report = job.report()
+    assert report["duplicates"] >= 60 and report["near_duplicates"] > 0 and report["new"] > 0
+
+
+def test_reimport_finds_every_row(tmp_path):
+    frame, ledger = checking_ledger(200, seed=7)
+    index = FingerprintIndex(ledger)
+    index.build()
+    first = run_import(tmp_path, overlapping_statement(frame, seed=8), index)
+    new = first.selected([NEW, NEAR_DUPLICATE])
+    start = len(ledger)
+    ledger.append_new(new)
+    index.add_rows(np.arange(start, len(ledger)))
+    again = run_import(tmp_path, overlapping_statement(frame, seed=8), index)
+    assert (again.kinds == DUPLICATE).all()
+
+
+def test_index_follows_deletes(tmp_path):
+    frame, ledger = checking_ledger(200, seed=9)
+    index = FingerprintIndex(ledger)
+    index.build()
+    removed = np.arange(0, 200, 2)
+    index.remove_rows(removed)
+    ledger.delete(removed)
+    job = run_import(tmp_path, overlapping_statement(frame, seed=10), index)
+    assert job.kinds.tolist() == naive_kinds(ledger, job.batch)
+
+
+def test_saved_index_is_used_until_the_ledger_changes(tmp_path):
+    frame, ledger = checking_ledger(200, seed=11)
+    index = FingerprintIndex(ledger)
+    index.build()
+    path = str(tmp_path / "fingerprints.npz")
+    index.save(path)
+    # Reloading renumbers the pooled strings; the saved index still applies
+    reloaded = Ledger.from_frame(ledger.to_frame())
+    loaded = FingerprintIndex.load(path, reloaded)
+    assert loaded is not None
+    assert +loaded.exact == +index.exact and +loaded.near == +index.near
+    reloaded.set_row(3, {**reloaded.row(3), "Amount": 0.01})
+    assert FingerprintIndex.load(path, reloaded) is None
+    assert FingerprintIndex.load(str(tmp_path / "missing.npz"), reloaded) is None
+
+
+def test_rejects_are_named_after_the_whole_file(tmp_path):
+    reports = []
+    for name in ("statement.csv", "statement.txt"):
+        path = str(tmp_path / name)
+        with open(path, "w") as handle:
+            handle.write(f"Date,Description,Amount\n2024-01-01,ok,1.00\nnot a date,{name},2.00\n")
+        job = StatementImport(path, "Checking").run()
+        reports.append(job.report()["rejects"])
+    assert reports[0] != reports[1]
+    assert all(name in open(report).read() for name, report in zip(("statement.csv", "statement.txt"), reports))
+
+
+def test_exact_match_takes_its_ledger_row_from_the_near_check(tmp_path):
+    # Two identical purchases on one day; the ledger has one of them
+    row = ["2024-03-05", "Expense", "Checking", 4.5, "", "Coffee House #12"]
+    ledger = Ledger.from_frame(pd.DataFrame([row], columns=COLUMNS))
+    index = FingerprintIndex(ledger)
+    index.build()
+    for chunk_rows in (25, 1):
+        job = run_import(tmp_path, pd.DataFrame([row, row], columns=COLUMNS), index, chunk_rows)
+        assert job.kinds.tolist() == [DUPLICATE, NEW]
@@ -0,0 +1,71 @@
+import calendar
+import datetime
+
+import numpy as np
+
+from budgetbuddy.ledger import format_day
+from budgetbuddy.loans import Loans, amortize
+
+
+def add_months(date, months):
+    month = date.month - 1 + months
+    year, month = date.year + month // 12, month % 12 + 1
+    return datetime.date(year, month, min(date.day, calendar.monthrange(year, month)[1]))
+
+
+def naive_schedule(amount, rate, term, start, extra):
+    # Month by month: interest accrues on what is owed, the level payment
+    # plus extra comes off, until the balance is gone or the term is up
+    owed = round(amount * 100)
+    monthly = rate / 1200
+    level = -(-owed // term) if monthly == 0 else int(np.ceil(owed * monthly / (1 - (1 + monthly) ** -term)))
+    balance, balances, days = float(owed), [], []
+    for number in range(1, term + 1):
+        balance = balance * (1 + monthly) - (level + extra)
+        balances.append(round(max(balance, 0)))
+        days.append(add_months(start, number).isoformat())
+        if balance <= 0.5:
+            break
+    balances[-1] = 0
+    return level, balances, days
+
+
+def random_loans(count, seed):
+    rng = np.random.default_rng(seed)
+    rows, extra = [], {}
+    for loan_id in range(count):
+        date = f"{rng.integers(2010, 2030)}-{rng.integers(1, 13):02d}-{rng.choice([1, 15, 28, 29, 30, 31]):02d}"
+        rows.append((loan_id, "Checking", int(rng.integers(100, 5000000)) / 100,
+                     float(rng.choice([0, 0.5, 3.9, 7.25, 24.99])), int(rng.integers(1, 361)), date))
+        extra[loan_id] = int(rng.choice([0, 0, 500, 10000]))
+    return rows, extra
+
+
+def test_amortize_matches_naive_loop():
+    rows, extra = random_loans(200, seed=0)
+    schedule = amortize(Loans.from_rows(rows, extra))
+    checked = 0
+    for index, (loan_id, _, amount, rate, term, date) in enumerate(rows):
+        payments = schedule.of(index)
+        try:
+            start = datetime.date.fromisoformat(date)
+        except ValueError:
+            assert len(payments["day"]) == 0  # no such day, so the loan is invalid
+            continue
+        level, balances, days = naive_schedule(amount, rate, term, start, extra[loan_id])
+        assert payments["level"] == level
+        assert payments["balance"].tolist() == balances
+        assert [format_day(day) for day in payments["day"]] == days
+        assert payments["number"].tolist() == list(range(1, len(days) + 1))
+        assert payments["principal"].sum() == round(amount * 100)
+        assert (payments["payment"] == payments["interest"] + payments["principal"]).all()
+        checked += 1
+    assert checked > 150
+
+
+def test_amortize_skips_invalid_loans():
+    rows = [(1, "Checking", 0, 5.0, 12, "2024-01-01"), (2, "Checking", 100, -1.0, 12, "2024-01-01"),
+            (3, "Checking", 100, 5.0, 0, "2024-01-01"), (4, "Checking", 100, 5.0, 12, "")]
+    schedule = amortize(Loans.from_rows(rows))
+    assert len(schedule) == 0
+    assert schedule.offsets.tolist() == [0, 0, 0, 0, 0]
@@ -0,0 +1,54 @@
+import numpy as np
+
+from benchmarks.synthetic import generate_frame
+from budgetbuddy.columns import COLUMNS
+from budgetbuddy.ledger import Ledger
+from budgetbuddy.search import SearchIndex
+
+QUERIES = ["", "c", "co", "cof", "coffee", "COFFEE HOUSE #1", "2021-0", "12.", "-", "income", "savings",
+           "rent", "#4", "zzz"]
+
+
+def brute_force(ledger, query):
+    # Every live row with a cell containing query, as the table shows it
+    query = query.lower()
+    return [position for position in ledger.positions().tolist()
+            if any(query in ledger.cell_text(column, position).lower() for column in range(len(COLUMNS)))]
+
+
+def assert_matches(index, ledger):
+    for query in QUERIES:
+        assert index.search(query).tolist() == brute_force(ledger, query), query
+
+
+def test_search_matches_brute_force():
+    ledger = Ledger.from_frame(generate_frame(400, seed=3, distinct_notes=30))
+    index = SearchIndex(ledger)
+    index.build()
+    # QUERIES narrow one another, so later ones re-check earlier hits only
+    assert_matches(index, ledger)
+
+
+def test_search_follows_edits():
+    ledger = Ledger.from_frame(generate_frame(400, seed=4, distinct_notes=30))
+    index = SearchIndex(ledger)
+    index.build()
+    index.search("co")
+
+    ledger.append_rows([["2021-02-03", "Expense", "Checking", -12.5, "Coffee", "Coffee House #999"]])
+    index.append(1)
+    assert_matches(index, ledger)
+
+    ledger.set_row(10, {"Date": "2030-01-01", "Type": "Income", "Account": "Savings", "Amount": 1.23,
+                        "Source/Category": "Refund", "Notes": "zzz"})
+    index.update(10)
+    assert_matches(index, ledger)
+
+    removed = np.arange(0, 400, 3)
+    ledger.delete(removed)
+    index.remove(removed)
+    assert_matches(index, ledger)
+
+    keep = ledger.compact()
+    index.compact(keep)
+    assert_matches(index, ledger)
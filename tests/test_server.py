@@ -0,0 +1,168 @@
+import asyncio
+import base64
+import json
+import os
+import shutil
+from urllib.parse import urlencode
+
+import pytest
+
+from benchmarks.synthetic import generate_frame
+from budgetbuddy import server
+from budgetbuddy.ledger import Ledger
+from budgetbuddy.storage import SqliteStorage, open_database
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BAD_TRANSACTIONS = [
+    b"not json",
+    b"[]",
+    json.dumps({"type": "Income", "account": "Checking", "amount": 1}).encode(),
+    json.dumps({"date": "2024-13-01", "type": "Income", "account": "Checking", "amount": 1}).encode(),
+    json.dumps({"date": "2024-01-01", "type": "Loan", "account": "Checking", "amount": 1}).encode(),
+    json.dumps({"date": "2024-01-01", "type": "Income", "account": "Checking", "amount": "ten"}).encode(),
+    json.dumps({"date": "2024-01-01", "type": "Income", "account": "Checking", "amount": "nan"}).encode(),
+    json.dumps({"date": "2024-01-01", "type": "Income", "account": "Checking", "amount": "inf"}).encode(),
+    json.dumps({"date": "2024-01-01", "type": "Expense", "account": "Checking", "amount": -5}).encode(),
+]
+BAD_QUERIES = [
+    "/api/transactions?limit=ten",
+    "/api/transactions?limit=-1",
+    "/api/transactions?offset=-2",
+    "/api/balances?date=yesterday",
+    "/api/summary?period=fortnightly",
+    "/api/summary?period=custom&start=2024-01-01",
+    "/api/summary?period=monthly&start=2024-02-30",
+]
+
+
+@pytest.fixture
+def database(tmp_path):
+    # A copy of the shipped database with one user and a small ledger
+    path = str(tmp_path / "finance_app.db")
+    shutil.copy(os.path.join(REPO, "instance", "finance_app.db"), path)
+    storage = SqliteStorage(path, username="tester", legacy_csv=str(tmp_path / "missing.csv"))
+    storage.connect()
+    storage.save(Ledger.from_frame(generate_frame(40, seed=12)))
+    storage.close()
+    conn = open_database(path)
+    with conn:
+        # Few iterations, as in benchmarks.load_test; the hash format is the same
+        conn.execute("UPDATE user SET password_hash = ? WHERE username = 'tester'",
+                     (server.hash_password("secret", iterations=1000),))
+    conn.close()
+    return path
+
+
+async def request(port, method, target, body=b"", password="secret"):
+    # One request on its own connection; returns (status, decoded body)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    token = base64.b64encode(f"tester:{password}".encode("utf-8")).decode("ascii")
+    writer.write(f"{method} {target} HTTP/1.1\r\nAuthorization: Basic {token}\r\nConnection: close\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    head, _, payload = (await reader.read()).partition(b"\r\n\r\n")
+    writer.close()
+    if b"transfer-encoding: chunked" in head.lower():
+        chunks = []
+        while True:
+            size, _, payload = payload.partition(b"\r\n")
+            if not int(size, 16):
+                break
+            chunks.append(payload[:int(size, 16)])
+            payload = payload[int(size, 16) + 2:]
+        payload = b"".join(chunks)
+    return int(head.split(b" ")[1]), json.loads(payload) if payload else None
+
+
+def run_server(path, scenario):
+    async def main():
+        app = server.LedgerServer(path)
+        listener = await app.serve("127.0.0.1", 0)
+        try:
+            return await scenario(listener.sockets[0].getsockname()[1])
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            app.pool.close()
+    return asyncio.run(main())
+
+
+def test_bad_requests_get_400(database):
+    async def scenario(port):
+        before = await request(port, "GET", "/api/transactions")
+        for body in BAD_TRANSACTIONS:
+            status, document = await request(port, "POST", "/api/transactions", body)
+            assert status == 400, body
+            assert "error" in document
+        for target in BAD_QUERIES:
+            status, document = await request(port, "GET", target)
+            assert status == 400, target
+            assert "error" in document
+        # None of them wrote anything
+        assert await request(port, "GET", "/api/transactions") == before
+
+    run_server(database, scenario)
+
+
+def test_malformed_request_line_gets_400(database):
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"NONSENSE\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        return response
+
+    assert run_server(database, scenario).startswith(b"HTTP/1.1 400 ")
+
+
+def test_bad_content_length_gets_400(database):
+    async def scenario(port):
+        responses = []
+        for length in (b"ten", b"-1", b"1.5", "\u00b2".encode("latin-1")):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /api/transactions HTTP/1.1\r\nConnection: close\r\nContent-Length: " + length +
+                         b"\r\n\r\n{}")
+            responses.append(await reader.read())
+            writer.close()
+        return responses
+
+    for response in run_server(database, scenario):
+        assert response.startswith(b"HTTP/1.1 400 ")
+
+
+def test_search_matches_wildcards_literally(database):
+    async def scenario(port):
+        for notes in ("50% off", "500 off", "a_c", "abc", "back\\slash"):
+            status, _ = await request(port, "POST", "/api/transactions", json.dumps(
+                {"date": "2024-01-01", "type": "Expense", "account": "Checking", "amount": 1, "notes": notes}).encode())
+            assert status == 201
+        found = {}
+        for search in ("50%", "a_c", "k\\s", "%", "_"):
+            status, rows = await request(port, "GET", "/api/transactions?" + urlencode({"search": search}))
+            assert status == 200
+            found[search] = sorted(row["notes"] for row in rows)
+        return found
+
+    found = run_server(database, scenario)
+    assert found["50%"] == ["50% off"] and found["%"] == ["50% off"]
+    assert found["a_c"] == ["a_c"] and found["_"] == ["a_c"]
+    assert found["k\\s"] == ["back\\slash"]
+
+
+def test_good_requests_still_succeed(database, monkeypatch):
+    # Small pages, so listings span several keyset queries
+    monkeypatch.setattr(server, "STREAM_BATCH", 7)
+
+    async def scenario(port):
+        assert (await request(port, "GET", "/api/transactions", password="wrong"))[0] == 401
+        status, created = await request(port, "POST", "/api/transactions", json.dumps(
+            {"date": "2024-01-01", "type": "Income", "account": "Checking", "amount": 0}).encode())
+        assert status == 201
+        status, rows = await request(port, "GET", "/api/transactions")
+        assert status == 200 and len(rows) == 41
+        assert [(row["date"], row["id"]) for row in rows] == sorted((row["date"], row["id"]) for row in rows)
+        assert created["id"] in [row["id"] for row in rows]
+        status, page = await request(port, "GET", "/api/transactions?limit=10&offset=5")
+        assert status == 200 and page == rows[5:15]
+        assert (await request(port, "GET", "/api/transactions?limit=0"))[1] == []
+
+    run_server(database, scenario)
@@ -0,0 +1,239 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_frame
+from budgetbuddy.columns import COLUMNS
+from budgetbuddy.indexes import DateIndex
+from budgetbuddy.ledger import Ledger
+from budgetbuddy.storage import CsvStorage, JournalStorage, SqliteStorage
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_ledger(rows=300, seed=0):
+    frame = generate_frame(rows, seed, distinct_notes=50)
+    frame.loc[::37, "Notes"] = ""  # blank cells must survive the trip too
+    return Ledger.from_frame(frame)
+
+
+def edit(ledger, storage):
+    # One of each change, made the way the window makes them
+    ledger.append_rows([["2024-02-29", "Income", "Savings", 12.34, "Gift", "leap day"]])
+    storage.add(ledger, 1)
+    edited, *deleted = ledger.positions()[[5, 7, 8, 9]].tolist()
+    ledger.set_row(edited, {"Date": "2023-01-02", "Type": "Expense", "Account": "Checking", "Amount": 0.01,
+                            "Source/Category": "Food", "Notes": "edited"})
+    storage.edit(ledger, edited)
+    ledger.delete(deleted)
+    storage.delete(ledger, deleted)
+    ledger.restore(ledger.id[deleted[:1]].tolist(), [ledger.row_values(deleted[0])])
+    storage.restore(ledger, deleted[:1])
+
+
+def assert_same_rows(loaded, expected):
+    left = loaded.to_frame().sort_values("ID").reset_index(drop=True)
+    right = expected.to_frame().sort_values("ID").reset_index(drop=True)
+    pd.testing.assert_frame_equal(left, right)
+
+
+def sqlite_storage(tmp_path):
+    path = str(tmp_path / "finance_app.db")
+    shutil.copy(os.path.join(REPO, "instance", "finance_app.db"), path)
+    return SqliteStorage(path, username="tester", legacy_csv=str(tmp_path / "missing.csv"))
+
+
+def test_csv_round_trip(tmp_path):
+    path = str(tmp_path / "transactions.csv")
+    ledger = make_ledger()
+    storage = CsvStorage(path, write_delay=0)
+    storage.save(ledger)
+    edit(ledger, storage)
+    storage.close()
+    assert_same_rows(CsvStorage(path).load(), ledger)
+
+
+def test_csv_chunks_match_load(tmp_path):
+    path = str(tmp_path / "transactions.csv")
+    storage = CsvStorage(path, write_delay=0)
+    storage.save(make_ledger(500))
+    storage.close()
+    chunked = Ledger()
+    for chunk, _ in storage.iter_chunks(first_rows=7, rows=100):
+        chunked.append_ledger(chunk)
+    assert_same_rows(chunked, storage.load())
+
+
+def test_journal_round_trip(tmp_path):
+    directory = str(tmp_path / "journal")
+    ledger = make_ledger()
+    storage = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"))
+    storage.save(ledger)
+    edit(ledger, storage)
+    storage.close()
+    assert_same_rows(JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv")).load(), ledger)
+
+
+def test_journal_starts_empty(tmp_path):
+    # The window adds a first transaction after load() finds nothing
+    directory = str(tmp_path / "journal")
+    storage = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"))
+    with pytest.raises(FileNotFoundError):
+        storage.load()
+    ledger = Ledger()
+    ledger.append_rows([["2024-01-01", "Income", "Checking", 5.0, "Gift", "first"]])
+    storage.add(ledger, 1)
+    storage.close()
+    assert_same_rows(JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv")).load(), ledger)
+
+
+def test_journal_replay_after_compaction(tmp_path):
+    directory = str(tmp_path / "journal")
+    ledger = make_ledger()
+    storage = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"), compact_every=4)
+    storage.save(ledger)
+    storage.close()
+    # Several compactions, with records left over in the live segment
+    storage = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"), compact_every=4)
+    ledger = storage.load()
+    for _ in range(3):
+        edit(ledger, storage)
+    ledger.append_rows([["2024-03-01", "Expense", "Checking", 1.0, "Food", "after the last snapshot"]])
+    storage.add(ledger, 1)
+    storage.close()
+    assert storage.generation > 1
+    reopened = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"))
+    loaded = reopened.load()
+    reopened.close()
+    assert_same_rows(loaded, ledger)
+
+
+def test_journal_skips_records_for_unknown_ids(tmp_path):
+    directory = str(tmp_path / "journal")
+    ledger = make_ledger(20)
+    storage = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"))
+    storage.save(ledger)
+    storage.close()
+    with open(storage._journal_path(storage.generation), "a", encoding="utf-8") as journal:
+        journal.write('{"op": "edit", "id": 999, "row": ["2024-01-01", "Income", "Checking", 1.0, "", ""]}\n')
+        journal.write('{"op": "delete", "ids": [998, 3]}\n')
+    with pytest.warns(UserWarning, match="unknown ids"):
+        loaded = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv")).load()
+    ledger.delete([ledger.position_of(3)])
+    assert_same_rows(loaded, ledger)
+
+
+def test_sqlite_round_trip(tmp_path):
+    ledger = make_ledger()
+    storage = sqlite_storage(tmp_path)
+    storage.save(ledger)
+    edit(ledger, storage)
+    storage.close()
+    reopened = SqliteStorage(storage.path, username="tester", legacy_csv=storage.legacy_csv)
+    loaded = reopened.load()
+    reopened.close()
+    assert_same_rows(loaded, ledger)
+
+
+def test_sqlite_save_replaces_rows_atomically(tmp_path):
+    storage = sqlite_storage(tmp_path)
+    first = make_ledger(50, seed=1)
+    storage.save(first)
+    # A row that cannot be stored fails the whole save
+    frame = make_ledger(50, seed=2).to_frame()
+    frame.loc[1, "ID"] = frame.loc[0, "ID"]
+    second = Ledger.from_frame(frame)
+    with pytest.raises(Exception):
+        storage.save(second)
+    loaded = storage.load()
+    storage.close()
+    assert_same_rows(loaded, first)
+    assert np.array_equal(np.sort(loaded.id), np.sort(first.id))
+    assert list(loaded.to_frame().columns[1:]) == COLUMNS
+
+
+def test_journal_drops_a_torn_line_before_appending(tmp_path):
+    directory = str(tmp_path / "journal")
+    ledger = make_ledger(20)
+    storage = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"))
+    storage.save(ledger)
+    edit(ledger, storage)
+    storage.close()
+    # A crash in the middle of writing the next record
+    with open(storage._journal_path(storage.generation), "a", encoding="utf-8") as journal:
+        journal.write('{"op": "add", "ids": [500], "rows": [["2024-01-0')
+    storage = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv"))
+    ledger = storage.load()
+    for notes in ("after the crash", "and again"):
+        ledger.append_rows([["2024-01-02", "Expense", "Checking", 3.0, "Food", notes]])
+        storage.add(ledger, 1)
+    storage.close()
+    loaded = JournalStorage(directory, legacy_csv=str(tmp_path / "missing.csv")).load()
+    assert len(loaded.positions()) == 21
+    assert_same_rows(loaded, ledger)
+
+
+def test_sqlite_never_reuses_a_deleted_rows_id(tmp_path):
+    storage = sqlite_storage(tmp_path)
+    ledger = make_ledger(5)
+    storage.save(ledger)
+    # Add A, delete it, add B, then undo both: A must come back as itself
+    ledger.append_rows([["2024-01-01", "Expense", "Checking", 1.0, "Food", "A"]])
+    storage.add(ledger, 1)
+    a = len(ledger) - 1
+    a_id, a_row = int(ledger.id[a]), ledger.row_values(a)
+    ledger.delete([a])
+    storage.delete(ledger, [a])
+    ledger.append_rows([["2024-01-02", "Expense", "Checking", 2.0, "Food", "B"]])
+    storage.add(ledger, 1)
+    b = len(ledger) - 1
+    assert int(ledger.id[b]) != a_id
+    ledger.delete([b])
+    storage.delete(ledger, [b])
+    storage.restore(ledger, ledger.restore([a_id], [a_row]))
+    loaded = storage.load()
+    storage.close()
+    assert loaded.row(loaded.position_of(a_id))["Notes"] == "A"
+    assert_same_rows(loaded, ledger)
+
+
+def test_ids_of_deleted_rows_are_not_handed_out_again():
+    ledger = make_ledger(10)
+    deleted = int(ledger.id[4])
+    ledger.delete([4])
+    with pytest.raises(ValueError, match="in use"):
+        ledger.assign_ids([0], [deleted])
+    with pytest.raises(ValueError, match="in use"):
+        ledger.assign_ids([0], [int(ledger.id[1])])
+    ledger.assign_ids([0, 1], [int(ledger.id[1]), int(ledger.id[0])])
+    # Two rows loaded under one id cannot both wait to be restored
+    frame = make_ledger(10).to_frame()
+    frame.loc[5, "ID"] = frame.loc[4, "ID"]
+    ledger = Ledger.from_frame(frame)
+    ledger.delete([4])
+    with pytest.raises(ValueError, match="already deleted"):
+        ledger.delete([5])
+    assert ledger.live[5] and ledger.dead == 1
+
+
+def test_sqlite_filters_and_summaries_match_the_date_index(tmp_path):
+    storage = sqlite_storage(tmp_path)
+    storage.save(make_ledger(2000, seed=3))
+    ledger = storage.load()
+    dates = DateIndex(ledger)
+    dates.build()
+    for freq in ("W", "M", "Q"):
+        assert storage.periods(freq) == dates.periods(freq)
+        assert storage.periods(freq, 18000, 18400) == dates.periods(freq, 18000, 18400)
+    assert storage.summary(18000, 18400) == dates.summary(18000, 18400)
+    # Keyset pages, each a separate query, add up to the in-memory filter
+    pages = list(storage.query(transaction_type="Income", account="Savings", start=18000, rows=50))
+    storage.close()
+    assert len(pages) > 2 and all(len(page) <= 50 for page in pages)
+    frame = ledger.to_frame()
+    expected = frame[(frame["Type"] == "Income") & (frame["Account"] == "Savings") & (frame["Date"] >= "2019-04-14")]
+    found = pd.concat([page.to_frame() for page in pages], ignore_index=True)
+    assert found["ID"].tolist() == expected.sort_values(["Date", "ID"])["ID"].tolist()